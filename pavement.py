@@ -68,6 +68,8 @@ setup(
     entry_points = """
     [schevo.schevo_command]
     gnav = schevogtk2.script:start
+    gbench = schevogtk2.benchmark:start
+    ggen = schevogtk2.gendb:start
     """,
     )
 
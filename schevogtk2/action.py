@@ -6,6 +6,8 @@
 import sys
 from schevo.lib import optimize
 
+import weakref
+
 from schevo.base import Entity, Extent, View
 from schevo.introspect import commontype, isselectionmethod
 from schevo.label import label
@@ -22,6 +24,10 @@ LABELS_WITH_SHORTCUTS = {
     'View...': '_View...',
     }
 
+# Cached labels and sort order of actions, by owner: the class of an
+# entity or view, or an extent.  See `_owner_cache`.
+_cache = weakref.WeakKeyDictionary()
+
 
 class Action(object):
 
@@ -48,38 +54,69 @@ class Action(object):
             return cmp(hash(self), hash(other))
 
 
-def get_method_action(db, instance, namespace_id, method_name, related=None):
-    """Return action for method name."""
-    namespace = getattr(instance, namespace_id)
-    method = namespace[method_name]
-    method_label = label(method)
+def get_bulk_action(db, instance, text, job):
+    """Return action that runs the bulk job returned by calling `job`.
+    See `schevogtk2.bulk`."""
     action = Action()
     action.db = db
     action.instance = instance
+    action.label = text
+    action.method = job
+    action.name = 'bulk'
+    action.type = 'bulk'
+    return action
+
+
+def get_method_action(db, instance, namespace_id, method_name, related=None):
+    """Return action for method name."""
+    namespace = getattr(instance, namespace_id)
+    action_label = _method_labels(instance, namespace_id, namespace)[1].get(
+        method_name)
+    if action_label is None:
+        # A hidden method; not cached.
+        method_labels = dict((name, label(namespace[name]))
+                             for name in list(namespace) + [method_name])
+        action_label = _action_label(
+            instance, namespace_id, method_name, method_labels)
+    return _method_action(db, instance, namespace_id, namespace,
+                          method_name, action_label, related)
+
+
+def _action_label(instance, namespace_id, method_name, method_labels):
+    """Return the label of the action for `method_name`, given the
+    `method_labels` of all methods in the same namespace."""
+    method_label = method_labels[method_name]
     # Default label.
-    action.label = u'%s...' % method_label
+    action_label = u'%s...' % method_label
     if namespace_id == 't' and method_name in DEFAULT_T_METHODS:
         # Determine if there are any custom methods whose labels start
         # with the same string.
-        t = action.instance.t
         other_found = False
-        for other_name in t:
+        for other_name, other_label in method_labels.iteritems():
             if other_name not in DEFAULT_T_METHODS:
-                other_label = label(t[other_name])
                 if other_label.startswith(method_label):
                     other_found = True
         if other_found:
             # Custom labels, since there are custom methods that share
             # prefixes.
             if isinstance(instance, Entity):
-                action.label = u'%s %s...' % (
+                action_label = u'%s %s...' % (
                     method_label, label(instance.s.extent))
             elif isinstance(instance, Extent):
-                action.label = u'%s %s...' % (method_label, label(instance))
+                action_label = u'%s %s...' % (method_label, label(instance))
             elif isinstance(instance, View):
-                action.label = u'%s %s...' % (
+                action_label = u'%s %s...' % (
                     method_label, label(instance.s.entity.s.extent))
-    action.method = method
+    return action_label
+
+
+def _method_action(db, instance, namespace_id, namespace, method_name,
+                   action_label, related):
+    action = Action()
+    action.db = db
+    action.instance = instance
+    action.label = action_label
+    action.method = namespace[method_name]
     action.name = method_name
     action.related = related
     if namespace_id == 'q':
@@ -89,6 +126,47 @@ def get_method_action(db, instance, namespace_id, method_name, related=None):
     return action
 
 
+def _method_labels(instance, namespace_id, namespace):
+    """Return `(templates, labels)` for the visible methods of
+    `namespace`, the `namespace_id` namespace of `instance`.
+
+    `templates` is a list of `(method name, action label)` in the order
+    actions are sorted, and `labels` a dictionary of action label by
+    method name.  Both are cached per owner of the namespace and set of
+    visible methods, since which methods are hidden may depend on the
+    instance, but their labels do not."""
+    names = tuple(sorted(namespace))
+    cache = _owner_cache(instance)
+    key = (namespace_id, names)
+    result = cache.get(key)
+    if result is None:
+        method_labels = dict((name, label(namespace[name])) for name in names)
+        templates = [
+            (name, _action_label(instance, namespace_id, name, method_labels))
+            for name in names]
+        # Sorted by label, like `Action.__cmp__`.
+        templates.sort(key=lambda template: template[1])
+        result = cache[key] = (templates, dict(templates))
+    return result
+
+
+def _owner_cache(instance):
+    """Return the cache dictionary of the owner of `instance`'s
+    actions."""
+    if isinstance(instance, (Entity, View)):
+        owner = instance.__class__
+    else:
+        owner = instance
+    try:
+        cache = _cache.get(owner)
+        if cache is None:
+            cache = _cache[owner] = {}
+    except TypeError:
+        # Cannot be weakly referenced; don't cache.
+        cache = {}
+    return cache
+
+
 def get_relationship_actions(db, entity):
     """Return list of relationship actions for an entity instance."""
     actions = []
@@ -113,16 +191,21 @@ def get_tx_actions(db, instance, related=None):
     """Return list of actions for an extent or entity instance."""
     actions = []
     if instance is not None:
-        t_methods = set(instance.t)
-        for method_name in sorted(t_methods):
-            action = get_method_action(db, instance, 't', method_name, related)
+        t = instance.t
+        templates = _method_labels(instance, 't', t)[0]
+        for method_name, action_label in templates:
+            action = _method_action(db, instance, 't', t, method_name,
+                                    action_label, related)
             actions.append(action)
-    return sorted(actions)
+    return actions
+
 
+def get_tx_selectionmethod_actions(db, selection, cls=None):
+    """Return list of selectionmethod transactions for an extent.
 
-def get_tx_selectionmethod_actions(db, selection):
-    """Return list of selectionmethod transactions for an extent."""
-    cls = commontype(selection)
+    `cls` is the common type of `selection`, if already known."""
+    if cls is None:
+        cls = commontype(selection)
     if cls is None:
         return []
     else:
@@ -131,12 +214,15 @@ def get_tx_selectionmethod_actions(db, selection):
         else:
             hidden = []
         actions = []
-        for method_name in sorted(cls.t):
+        t = cls.t
+        templates = _method_labels(cls, 't', t)[0]
+        for method_name, action_label in templates:
             if method_name not in hidden:
-                action = get_method_action(db, cls, 't', method_name)
+                action = _method_action(db, cls, 't', t, method_name,
+                                        action_label, None)
                 action.selection = selection
                 actions.append(action)
-        return sorted(actions)
+        return actions
 
 
 def get_view_actions(db, entity):
@@ -147,12 +233,16 @@ def get_view_actions(db, entity):
             and 'default' in entity._hidden_views
             ):
             return actions
-        options = [False]
-        for name, FieldClass in entity._field_spec.iteritems():
-            if FieldClass.expensive:
-                # XXX: Remove this and add support for View objects.
-##                 options.append(True)
-                break
+        cache = _owner_cache(entity)
+        options = cache.get('view_options')
+        if options is None:
+            options = [False]
+            for name, FieldClass in entity._field_spec.iteritems():
+                if FieldClass.expensive:
+                    # XXX: Remove this and add support for View objects.
+##                     options.append(True)
+                    break
+            cache['view_options'] = options
         for include_expensive in options:
             action = get_view_action(db, entity, include_expensive)
             actions.append(action)
@@ -13,14 +13,21 @@ class Application(object):
 
     WindowClass = NavigatorWindow
 
-    def __init__(self, window_class=None):
+    def __init__(self, window_class=None, watchdog_ms=None,
+                 watchdog_log=None):
         if window_class is None:
             window_class = self.WindowClass
         self.window = window_class()
+        self.watchdog = None
+        if watchdog_ms:
+            self.watchdog_start(watchdog_ms, watchdog_log)
 
     def database_open(self, filename):
         return self.window.database_open(filename)
 
+    def database_open_async(self, filename, done_cb=None):
+        return self.window.database_open_async(filename, done_cb)
+
     @property
     def db(self):
         return self.window._db
@@ -28,6 +35,21 @@ class Application(object):
     def run(self):
         self.window.show_and_loop()
 
+    def watchdog_start(self, threshold_ms=500, log_filename=None):
+        """Report main loop stalls longer than `threshold_ms` to
+        `log_filename`."""
+        from schevogtk2.watchdog import MainLoopWatchdog
+        self.watchdog_stop()
+        activity = self.window.activity.copy
+        self.watchdog = MainLoopWatchdog(
+            threshold_ms, log_filename, activity).start()
+        return self.watchdog
+
+    def watchdog_stop(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+
 ##     def show(self):
 ##         self.window.show()
 
@@ -0,0 +1,365 @@
+"""Headless benchmarks of grids, forms and combo boxes.
+
+Builds a synthetic database in memory, then times the operations the
+navigator performs most often.  When no X display is available, the
+benchmarks are run under a virtual X server (Xvfb).
+
+Results are written as JSON, and may be compared to the results of an
+earlier run.  Any benchmark that became slower than its baseline by
+more than the threshold percentage is reported as a regression, and
+the command then exits with a non-zero status.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import atexit
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import os
+import signal
+import subprocess
+import tempfile
+import time
+
+from schevo.script.command import Command
+from schevo.script import opt
+
+
+RESULTS_FORMAT = 1
+
+USAGE = """\
+schevo gbench [options]
+
+Time grids, forms and combo boxes against a synthetic database."""
+
+
+def _parser():
+    p = opt.parser(USAGE)
+    p.add_option('-r', '--rows', dest='rows', type='int', default=10000,
+                 help='Number of entities in the benchmarked extent.',
+                 )
+    p.add_option('--fields', dest='fields', type='int', default=6,
+                 help='Number of string and integer fields.',
+                 )
+    p.add_option('--entity-fields', dest='entity_fields', type='int',
+                 default=2,
+                 help='Number of Entity fields.',
+                 )
+    p.add_option('--image-fields', dest='image_fields', type='int',
+                 default=0,
+                 help='Number of Image fields.',
+                 )
+    p.add_option('--targets', dest='targets', type='int', default=500,
+                 help='Number of entities referred to by Entity fields.',
+                 )
+    p.add_option('-n', '--repeat', dest='repeat', type='int', default=3,
+                 help='Number of times to run each benchmark.',
+                 )
+    p.add_option('-o', '--output', dest='output', metavar='FILE',
+                 help='Write results as JSON to FILE.',
+                 default=None,
+                 )
+    p.add_option('-b', '--baseline', dest='baseline', metavar='FILE',
+                 help='Compare results to those previously written to FILE.',
+                 default=None,
+                 )
+    p.add_option('-t', '--threshold', dest='threshold', type='float',
+                 default=20.0, metavar='PERCENT',
+                 help='Slowdown, compared to the baseline, that counts as '
+                 'a regression.',
+                 )
+    p.add_option('--no-xvfb', dest='xvfb',
+                 help='Never start a virtual X server.',
+                 action='store_false', default=True,
+                 )
+    return p
+
+
+def profile(rows, fields, entity_fields, image_fields, targets):
+    """Return a `schevogtk2.gendb` profile for an `Item` extent that
+    has the given numbers of fields, and a `Target` extent that its
+    Entity fields refer to."""
+    item_fields = [dict(name='name', type='string', key=True)]
+    for index in xrange(fields):
+        if index % 2:
+            item_fields.append(dict(name='integer_%i' % index, type='integer'))
+        else:
+            item_fields.append(dict(name='string_%i' % index, type='string'))
+    for index in xrange(entity_fields):
+        item_fields.append(dict(name='target_%i' % index, type='entity',
+                                extent='Target', share=0.9))
+    for index in xrange(image_fields):
+        item_fields.append(dict(name='image_%i' % index, type='image',
+                                size=1000, share=0.9))
+    return dict(
+        seed=0,
+        extents=[
+            dict(name='Target', rows=targets, hidden=False, fields=[
+                dict(name='name', type='string', key=True),
+                ]),
+            dict(name='Item', rows=rows, hidden=False, fields=item_fields),
+            ],
+        )
+
+
+def create_db(rows, fields, entity_fields, image_fields, targets):
+    """Return a new in-memory database populated with `rows` items
+    and `targets` targets."""
+    from schevogtk2 import gendb
+    return gendb.create_db(
+        profile(rows, fields, entity_fields, image_fields, targets),
+        fp=tempfile.TemporaryFile(), label='Benchmark')
+
+
+def start_xvfb(first_display=99, timeout=5.0):
+    """Start a virtual X server on the first free display number, and
+    point DISPLAY at it.  The server is stopped when Python exits."""
+    number = first_display
+    while os.path.exists('/tmp/.X%i-lock' % number):
+        number += 1
+    display = ':%i' % number
+    process = subprocess.Popen(
+        ['Xvfb', display, '-screen', '0', '1280x1024x24', '-nolisten', 'tcp'],
+        stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    atexit.register(_stop, process)
+    socket_path = '/tmp/.X11-unix/X%i' % number
+    deadline = time.time() + timeout
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.time() > deadline:
+            raise RuntimeError('Could not start Xvfb on display %s' % display)
+        time.sleep(0.05)
+    os.environ['DISPLAY'] = display
+    return process
+
+
+def _stop(process):
+    if process.poll() is None:
+        os.kill(process.pid, signal.SIGTERM)
+        process.wait()
+
+
+def flush():
+    """Process pending GTK events, such as redraws."""
+    import gtk
+    while gtk.events_pending():
+        gtk.main_iteration(False)
+
+
+class Benchmarks(object):
+    """Timed operations against the `Item` extent of database `db`.
+
+    Each benchmark is a method whose name starts with `bench_`.  It
+    may return a callable that performs the timed operation, after
+    doing untimed setup; the callable may in turn return a callable
+    that undoes the operation, also untimed.
+    """
+
+    def __init__(self, db, repeat=3):
+        self.db = db
+        self.repeat = repeat
+
+    def names(self):
+        return sorted(name[len('bench_'):] for name in dir(self)
+                      if name.startswith('bench_'))
+
+    def run(self, names=None, report=None):
+        """Run the benchmarks and return their results by name."""
+        import gtk
+        from schevogtk2.entitygrid import EntityGrid
+        self.window = gtk.Window()
+        self.window.set_default_size(1024, 768)
+        self.grid = EntityGrid()
+        self.window.add(self.grid)
+        self.window.show_all()
+        flush()
+        results = {}
+        if names is None:
+            names = self.names()
+        for name in names:
+            method = getattr(self, 'bench_' + name)
+            runs = []
+            for n in xrange(self.repeat):
+                operation = method()
+                start = time.time()
+                undo = operation()
+                flush()
+                runs.append((time.time() - start) * 1000.0)
+                if undo is not None:
+                    undo()
+                    flush()
+            results[name] = dict(
+                best_ms=min(runs),
+                mean_ms=sum(runs) / len(runs),
+                runs_ms=runs,
+                )
+            if report is not None:
+                report(name, results[name])
+        self.window.destroy()
+        flush()
+        return results
+
+    def _show_extent(self):
+        grid = self.grid
+        if grid._extent is None:
+            grid.set_extent(self.db.Item)
+            flush()
+        return grid
+
+    def bench_entity_combobox(self):
+        from schevogtk2.fieldwidget import EntityComboBox
+        tx = self.db.Item.t.create()
+        if 'target_0' not in tx.f:
+            # No Entity fields to benchmark.
+            return lambda: None
+        field = tx.f.target_0
+        def operation():
+            combo = EntityComboBox(self.db, field)
+            return combo.destroy
+        return operation
+
+    def bench_form_get_dialog(self):
+        from schevogtk2.field import (
+            DEFAULT_GET_VALUE_HANDLERS, DEFAULT_SET_FIELD_HANDLERS)
+        from schevogtk2 import form
+        entity = self.db.Item[1]
+        tx = entity.t.update()
+        fields = tx.s.field_map().values()
+        def operation():
+            dialog = form.get_dialog(
+                u'Update', self.window, u'Update', self.db, tx, fields,
+                DEFAULT_GET_VALUE_HANDLERS, DEFAULT_SET_FIELD_HANDLERS)
+            dialog.show()
+            return dialog.destroy
+        return operation
+
+    def bench_entity_grid_reflect_changes(self):
+        grid = self._show_extent()
+        db = self.db
+        template = db.Item[1]
+        def operation():
+            tx = template.t.clone()
+            tx.name = u'Benchmark %f' % time.time()
+            result = db.execute(tx)
+            grid.reflect_changes(result, tx)
+            def undo():
+                tx = result.t.delete()
+                db.execute(tx)
+                grid.reflect_changes(None, tx)
+            return undo
+        return operation
+
+    def bench_entity_grid_refresh(self):
+        grid = self._show_extent()
+        return grid.refresh
+
+    def bench_entity_grid_set_extent(self):
+        grid = self.grid
+        grid.set_extent(None)
+        flush()
+        def operation():
+            grid.set_extent(self.db.Item)
+        return operation
+
+    def bench_entity_grid_sort(self):
+        import gtk
+        grid = self._show_extent()
+        # Sort by the first column after the OID and revision.
+        model = grid._model
+        model.set_sort_column_id(-1, gtk.SORT_ASCENDING)
+        flush()
+        def operation():
+            model.set_sort_column_id(2, gtk.SORT_ASCENDING)
+            def undo():
+                model.set_sort_column_id(-1, gtk.SORT_ASCENDING)
+            return undo
+        return operation
+
+
+def compare(results, baseline, threshold):
+    """Return `(name, baseline_ms, result_ms, change)` for each
+    benchmark in `results` that is slower than in `baseline` by more
+    than `threshold` percent."""
+    regressions = []
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        before = baseline[name]['best_ms']
+        after = result['best_ms']
+        if before > 0:
+            change = (after - before) * 100.0 / before
+            if change > threshold:
+                regressions.append((name, before, after, change))
+    return regressions
+
+
+class Benchmark(Command):
+
+    name = 'Benchmark'
+    description = 'Time grids, forms and combo boxes against a ' \
+                  'synthetic database.'
+
+    def main(self, arg0, args):
+        print
+        print
+        parser = _parser()
+        options, args = parser.parse_args(list(args))
+        if (options.xvfb
+            and sys.platform != 'win32'
+            and os.environ.get('DISPLAY', '') == ''
+            ):
+            start_xvfb()
+            print 'Started Xvfb on display', os.environ['DISPLAY']
+        baseline = None
+        if options.baseline:
+            f = open(options.baseline)
+            try:
+                baseline = json.load(f)['results']
+            finally:
+                f.close()
+        print 'Creating database with %i rows...' % options.rows
+        start = time.time()
+        db = create_db(options.rows, options.fields, options.entity_fields,
+                       options.image_fields, options.targets)
+        print 'Created in %.1f s.' % (time.time() - start)
+        def report(name, result):
+            print '  %-36s %10.1f ms (mean %.1f ms)' % (
+                name, result['best_ms'], result['mean_ms'])
+        benchmarks = Benchmarks(db, options.repeat)
+        results = benchmarks.run(args or None, report)
+        db.close()
+        if options.output:
+            params = dict(
+                rows=options.rows,
+                fields=options.fields,
+                entity_fields=options.entity_fields,
+                image_fields=options.image_fields,
+                targets=options.targets,
+                repeat=options.repeat,
+                )
+            f = open(options.output, 'w')
+            try:
+                json.dump(dict(format=RESULTS_FORMAT, params=params,
+                               results=results), f, indent=2)
+            finally:
+                f.close()
+            print 'Wrote results to', options.output
+        if baseline is not None:
+            regressions = compare(results, baseline, options.threshold)
+            for name, before, after, change in regressions:
+                print 'REGRESSION %s: %.1f ms -> %.1f ms (%+.0f%%)' % (
+                    name, before, after, change)
+            if regressions:
+                return 1
+            print 'No regressions over %.0f%%.' % options.threshold
+
+
+start = Benchmark
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,513 @@
+"""Bulk operations on many entities, in chunks."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import time
+
+from schevo.error import EntityDoesNotExist
+from schevo.transaction import Combination
+
+import gobject
+import gtk
+
+from schevogtk2.idle import IdleTask
+
+
+class BulkJob(object):
+    """Execute one transaction per chunk of many entities.
+
+    Chunks are executed one per slice of main loop idle time, so that
+    the interface stays responsive and the job can be stopped between
+    chunks.  Schevo databases are not safe to use from several threads
+    while grids read from them, so the work is done in the main thread.
+
+    - `db`: The database to execute transactions in.
+
+    - `items`: The entities to process, or values that `resolve`
+      turns into entities.  Resolving is done a chunk at a time.
+      Entities that no longer exist are skipped.
+
+    - `chunk_size`: Number of entities per transaction.
+
+    Subclasses implement `make_tx`.  While and after running, `done`,
+    `skipped`, `unchanged`, `chunks` and `seconds` describe the
+    progress.  `error` holds the exception that stopped the job, if
+    any, and `failures` is a list of `(item, message)` for items that
+    failed without stopping the job.  If a chunk's transaction fails,
+    each of its entities is tried again in a transaction of its own,
+    to find those at fault.
+    """
+
+    chunk_size = 200
+
+    # Milliseconds to wait before offering again a chunk that was not
+    # taken.
+    retry_ms = 50
+
+    # Past tense of what the job does, for progress messages.
+    verb = 'Processed'
+
+    def __init__(self, db, items, resolve=None, chunk_size=None):
+        self.db = db
+        self.items = list(items)
+        self.resolve = resolve
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.total = len(self.items)
+        self.chunks = 0
+        self.done = 0
+        self.error = None
+        self.failures = []
+        self.seconds = 0.0
+        self.skipped = 0
+        self.stopped = False
+        self.unchanged = 0
+        self._stop = False
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def configure(self, parent, get_value_handlers, set_field_handlers):
+        """Ask for anything else the job needs before it starts, using
+        dialogs transient for `parent`.  Return False if cancelled."""
+        return True
+
+    def description(self):
+        """Return text describing the job before it starts."""
+        return '%i entities will be processed, %i per transaction.' % (
+            self.total, self.chunk_size)
+
+    def make_tx(self, entities):
+        """Return `(tx, included)` for a chunk of `entities`: the
+        transaction to execute, and the entities it includes.  Those
+        left out are counted as unchanged.  `tx` may be None if none
+        are included."""
+        raise NotImplementedError()
+
+    def progress(self):
+        """Return the fraction of the job that is done."""
+        if self.total:
+            processed = (self.done + self.skipped + self.unchanged
+                         + len(self.failures))
+            return min(float(processed) / self.total, 1.0)
+        return 1.0
+
+    def rate(self):
+        """Return the number of entities processed per second."""
+        if self.seconds:
+            return self.done / self.seconds
+        return 0.0
+
+    def start(self, chunk_cb=None, done_cb=None):
+        """Start the job.  After each transaction, `chunk_cb(job,
+        entities, tx)` is called with the executed transaction.  When
+        the job ends, `done_cb(job)` is called."""
+        def done():
+            if done_cb is not None:
+                done_cb(self)
+        # One chunk per slice, so progress is drawn after each.
+        self._task = IdleTask(
+            self._run(chunk_cb), slice_ms=0, done_cb=done).start()
+        return self
+
+    def stop(self):
+        """Stop the job before its next chunk."""
+        self._stop = True
+
+    def _chunks(self):
+        """Yield the chunks of items to process."""
+        items = self.items
+        chunk_size = self.chunk_size
+        for start in xrange(0, len(items), chunk_size):
+            yield items[start:start + chunk_size]
+
+    def _entities(self, items):
+        resolve = self.resolve
+        entities = []
+        for item in items:
+            try:
+                if resolve is None:
+                    entity = item
+                else:
+                    entity = resolve(item)
+                exists = entity.s.exists
+            except EntityDoesNotExist:
+                exists = False
+            if exists:
+                entities.append(entity)
+            else:
+                self.skipped += 1
+        return entities
+
+    def _execute_chunk(self, chunk, chunk_cb):
+        """Process a chunk of items.  May return False to be called
+        again with the same chunk after `retry_ms` milliseconds."""
+        entities = self._entities(chunk)
+        if not entities:
+            return
+        tx, included = self.make_tx(entities)
+        self.unchanged += len(entities) - len(included)
+        if tx is None or not included:
+            return
+        db = self.db
+        try:
+            db.execute(tx)
+        except Exception:
+            # Find the entities at fault by processing each on its
+            # own.  The transaction of the chunk cannot be reused.
+            for entity in included:
+                try:
+                    tx, single = self.make_tx([entity])
+                    if tx is not None and single:
+                        db.execute(tx)
+                except Exception, e:
+                    self.failures.append((unicode(entity), e))
+                else:
+                    if not single:
+                        self.unchanged += 1
+                        continue
+                    self.done += 1
+                    if chunk_cb is not None:
+                        chunk_cb(self, single, tx)
+        else:
+            self.done += len(included)
+            if chunk_cb is not None:
+                chunk_cb(self, included, tx)
+
+    def _run(self, chunk_cb):
+        chunks = self._chunks()
+        while True:
+            if self._stop:
+                self.stopped = True
+                break
+            mark = time.time()
+            try:
+                chunk = chunks.next()
+            except StopIteration:
+                break
+            except Exception, e:
+                # Could not read the next chunk.
+                self.error = e
+                break
+            try:
+                while self._execute_chunk(chunk, chunk_cb) is False:
+                    # Not taken yet; try the same chunk again after a
+                    # while, rather than spinning in idle time.
+                    self.seconds += time.time() - mark
+                    self._task.sleep(self.retry_ms)
+                    yield
+                    mark = time.time()
+                    if self._stop:
+                        chunk = None
+                        break
+            except Exception, e:
+                self.error = e
+                self.seconds += time.time() - mark
+                break
+            if chunk is None:
+                # Stopped while waiting.
+                self.stopped = True
+                break
+            self.chunks += 1
+            self.seconds += time.time() - mark
+            yield
+        self._task = None
+
+
+class BulkDeleteJob(BulkJob):
+    """Delete entities in chunks.
+
+    - `method`: Selection method that returns a transaction deleting a
+      list of entities, such as an entity class's `delete_selected`.
+      By default, each chunk is a combination of the entities' own
+      delete transactions.
+    """
+
+    verb = 'Deleted'
+
+    def __init__(self, db, items, resolve=None, chunk_size=None,
+                 method=None):
+        BulkJob.__init__(self, db, items, resolve, chunk_size)
+        self.method = method
+
+    def make_tx(self, entities):
+        if self.method is not None:
+            return self.method(entities), entities
+        tx = Combination([entity.t.delete() for entity in entities])
+        return tx, entities
+
+
+class BulkUpdateJob(BulkJob):
+    """Set one field of entities to the same value, in chunks.
+
+    - `field_name`, `value`: The field to set and its new value.  They
+      may be given after creating the job, for instance once chosen
+      with `BulkUpdateFieldDialog`.
+
+    Entities that already have the value, or that cannot be updated,
+    are left alone.
+    """
+
+    verb = 'Updated'
+
+    def __init__(self, db, items, resolve=None, chunk_size=None,
+                 field_name=None, value=None):
+        BulkJob.__init__(self, db, items, resolve, chunk_size)
+        self.field_name = field_name
+        self.value = value
+
+    def configure(self, parent, get_value_handlers, set_field_handlers):
+        if self.field_name is not None:
+            return True
+        sample = self.sample()
+        if sample is None:
+            return False
+        dialog = BulkUpdateFieldDialog(
+            parent, self.db, sample, u'Update %i Entities' % self.total,
+            get_value_handlers, set_field_handlers)
+        choice = dialog.run()
+        dialog.destroy()
+        if choice is None:
+            return False
+        self.field_name, self.value = choice
+        return True
+
+    def make_tx(self, entities):
+        field_name = self.field_name
+        value = self.value
+        kw = {field_name: value}
+        included = [entity for entity in entities
+                    if 'update' in entity.t
+                    and getattr(entity, field_name) != value]
+        if not included:
+            return None, included
+        transactions = [entity.t.update(**kw) for entity in included]
+        return Combination(transactions), included
+
+    def sample(self):
+        """Return the first entity to be updated that still exists, or
+        None."""
+        skipped = self.skipped
+        try:
+            for item in self.items:
+                entities = self._entities([item])
+                if entities:
+                    return entities[0]
+            return None
+        finally:
+            self.skipped = skipped
+
+
+class BulkUpdateFieldDialog(gtk.Dialog):
+    """Dialog to choose the field and value of a `BulkUpdateJob`.
+
+    The fields offered are the editable fields of an update
+    transaction of `sample`, and the value is entered with the same
+    widget as in that transaction's form."""
+
+    def __init__(self, parent, db, sample, title,
+                 get_value_handlers, set_field_handlers):
+        from schevogtk2.field import DynamicField
+        flags = gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT
+        buttons = (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+                   gtk.STOCK_OK, gtk.RESPONSE_OK)
+        gtk.Dialog.__init__(self, title, parent, flags, buttons)
+        self.set_border_width(5)
+        self.set_default_size(400, -1)
+        self.set_default_response(gtk.RESPONSE_OK)
+        self._db = db
+        tx = self._tx = sample.t.update()
+        self._fields = [
+            field for field in tx.f.itervalues()
+            if not (field.fget or field.hidden or field.readonly)
+            ]
+        table = gtk.Table(rows=2, columns=2)
+        table.set_border_width(5)
+        table.set_row_spacings(5)
+        table.set_col_spacings(5)
+        combo = self._combo = gtk.combo_box_new_text()
+        for field in self._fields:
+            combo.append_text(field.label)
+        widget = self._widget = DynamicField(
+            get_value_handlers, set_field_handlers)
+        for row, (text, child) in enumerate([(u'Field:', combo),
+                                             (u'Value:', widget)]):
+            label = gtk.Label(text)
+            label.set_alignment(1.0, 0.5)
+            table.attach(label, 0, 1, row, row + 1, gtk.FILL, gtk.FILL)
+            table.attach(child, 1, 2, row, row + 1,
+                         gtk.EXPAND | gtk.FILL, gtk.FILL)
+        table.show_all()
+        self.vbox.pack_start(table)
+        combo.connect('changed', self._on_combo__changed)
+        if self._fields:
+            combo.set_active(0)
+        else:
+            self.set_response_sensitive(gtk.RESPONSE_OK, False)
+
+    def run(self):
+        """Return `(field_name, value)` as chosen, or None if
+        cancelled."""
+        while gtk.Dialog.run(self) == gtk.RESPONSE_OK:
+            field = self._field()
+            try:
+                setattr(self._tx, field.name, self._widget.get_value())
+                field.validate(field.get())
+            except Exception, e:
+                self._error(field, e)
+                continue
+            return field.name, field.get()
+        return None
+
+    def _error(self, field, e):
+        dialog = gtk.MessageDialog(
+            parent=self, flags=gtk.DIALOG_MODAL,
+            type=gtk.MESSAGE_ERROR, buttons=gtk.BUTTONS_OK,
+            message_format='%s: %s' % (field.label, e))
+        dialog.run()
+        dialog.destroy()
+
+    def _field(self):
+        return self._fields[self._combo.get_active()]
+
+    def _on_combo__changed(self, combo):
+        self._widget.set_field(self._db, self._field())
+        self._widget.show()
+
+
+class BulkJobDialog(gtk.Dialog):
+    """Dialog that asks to start a bulk job, then shows its progress
+    and lets it be stopped.
+
+    `chunk_cb` is passed on to `BulkJob.start`, typically to reflect
+    each chunk's changes in grids."""
+
+    # Milliseconds between progress updates.
+    update_ms = 250
+
+    def __init__(self, parent, job, title, chunk_cb=None):
+        flags = gtk.DIALOG_MODAL | gtk.DIALOG_DESTROY_WITH_PARENT
+        gtk.Dialog.__init__(self, title, parent, flags)
+        self.job = job
+        self.chunk_cb = chunk_cb
+        self.set_border_width(5)
+        self.set_default_size(400, -1)
+        vbox = gtk.VBox(spacing=10)
+        vbox.set_border_width(5)
+        self.vbox.pack_start(vbox)
+        label = self._label = gtk.Label()
+        label.set_alignment(0.0, 0.5)
+        label.set_line_wrap(True)
+        vbox.pack_start(label, expand=False)
+        progress = self._progress = gtk.ProgressBar()
+        vbox.pack_start(progress, expand=False)
+        failures = self._failures = gtk.TextView()
+        failures.set_editable(False)
+        failures.set_cursor_visible(False)
+        scrolled = self._failures_window = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolled.set_shadow_type(gtk.SHADOW_IN)
+        scrolled.set_size_request(-1, 150)
+        scrolled.add(failures)
+        vbox.pack_start(scrolled)
+        vbox.show_all()
+        progress.hide()
+        scrolled.hide()
+        self._failures_shown = 0
+        self._cancel = self.add_button(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL)
+        self._button = self.add_button(gtk.STOCK_EXECUTE, gtk.RESPONSE_OK)
+        self._button.grab_default()
+        label.set_text(job.description())
+
+    def run(self):
+        """Run the dialog until the job is finished and the dialog is
+        closed, or the job is cancelled before it starts.  Return True
+        if the job was started."""
+        job = self.job
+        started = False
+        while True:
+            response = gtk.Dialog.run(self)
+            if not started:
+                if response != gtk.RESPONSE_OK:
+                    return False
+                started = True
+                self._start()
+            elif job.running:
+                # Stop, or the dialog was closed.
+                job.stop()
+                self._button.set_sensitive(False)
+                self._label.set_text('Stopping...')
+            else:
+                return True
+
+    def _start(self):
+        self._cancel.hide()
+        self._button.set_label(gtk.STOCK_STOP)
+        self._button.set_use_stock(True)
+        self._progress.show()
+        self._update()
+        self.job.start(self._on_job__chunk, self._on_job__done)
+        # Also update while the job does work that is not reported per
+        # chunk.
+        gobject.timeout_add(self.update_ms, self._on_timeout)
+
+    def _update(self):
+        job = self.job
+        self._progress.set_fraction(job.progress())
+        if job.total is None:
+            self._progress.set_text('%i%%' % (job.progress() * 100))
+            text = '%s %i entities (%i/s).' % (job.verb, job.done, job.rate())
+        else:
+            self._progress.set_text('%i of %i' % (
+                job.done + job.skipped + job.unchanged + len(job.failures),
+                job.total))
+            text = '%s %i of %i entities (%i/s).' % (
+                job.verb, job.done, job.total, job.rate())
+        if job.skipped:
+            text += '  Skipped %i that no longer exist.' % job.skipped
+        if job.unchanged:
+            text += '  Left %i unchanged.' % job.unchanged
+        if job.failures:
+            text += '  %i failed.' % len(job.failures)
+        if job.error is not None:
+            text += '\n\nStopped by an error: %s' % job.error
+        elif job.stopped:
+            text += '\n\nStopped.'
+        self._label.set_text(text)
+        self._update_failures()
+
+    def _update_failures(self):
+        failures = self.job.failures
+        if len(failures) > self._failures_shown:
+            buf = self._failures.get_buffer()
+            lines = ['%s: %s\n' % (item, message)
+                     for item, message in failures[self._failures_shown:]]
+            buf.insert(buf.get_end_iter(), ''.join(lines))
+            self._failures_shown = len(failures)
+            self._failures_window.show()
+
+    def _on_job__chunk(self, job, entities, tx):
+        if self.chunk_cb is not None:
+            self.chunk_cb(job, entities, tx)
+        self._update()
+
+    def _on_timeout(self):
+        if self.job.running:
+            self._update()
+            return True
+        return False
+
+    def _on_job__done(self, job):
+        self._update()
+        self._button.set_sensitive(True)
+        self._button.set_label(gtk.STOCK_CLOSE)
+        self._button.set_use_stock(True)
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,122 @@
+"""Bounded caches."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+
+_PREV = 0
+_NEXT = 1
+_KEY = 2
+_VALUE = 3
+_SIZE = 4
+
+
+def _unit_size(value):
+    return 1
+
+
+class LRUCache(object):
+    """Mapping that holds at most `max_size` units of values,
+    discarding the least recently used entries first.
+
+    - `max_size`: Total number of units the cache may hold.
+
+    - `sizeof`: Callable that returns the number of units used by a
+      value.  By default, each value uses one unit.
+
+    - `evict_cb`: Callable called with the key and value of each entry
+      discarded to make room for others.
+    """
+
+    def __init__(self, max_size, sizeof=None, evict_cb=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or _unit_size
+        self.evict_cb = evict_cb
+        self.size = 0
+        self._map = {}
+        # Circular doubly-linked list of [prev, next, key, value, size]
+        # nodes, most recently used first.
+        root = self._root = []
+        root[:] = [root, root, None, None, 0]
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __delitem__(self, key):
+        node = self._map.pop(key)
+        self._unlink(node)
+        self.size -= node[_SIZE]
+
+    def __getitem__(self, key):
+        node = self._map[key]
+        self._unlink(node)
+        self._link_first(node)
+        return node[_VALUE]
+
+    def __iter__(self):
+        return iter(self._map)
+
+    def __len__(self):
+        return len(self._map)
+
+    def __setitem__(self, key, value):
+        if key in self._map:
+            del self[key]
+        size = self.sizeof(value)
+        if size > self.max_size:
+            # Never worth keeping.
+            return
+        node = [None, None, key, value, size]
+        self._map[key] = node
+        self._link_first(node)
+        self.size += size
+        self._shrink()
+
+    def clear(self):
+        self._map.clear()
+        root = self._root
+        root[:] = [root, root, None, None, 0]
+        self.size = 0
+
+    def get(self, key, default=None):
+        if key in self._map:
+            return self[key]
+        return default
+
+    def keys(self):
+        return self._map.keys()
+
+    def pop(self, key, default=None):
+        if key in self._map:
+            value = self._map[key][_VALUE]
+            del self[key]
+            return value
+        return default
+
+    def _link_first(self, node):
+        root = self._root
+        first = root[_NEXT]
+        node[_PREV] = root
+        node[_NEXT] = first
+        first[_PREV] = node
+        root[_NEXT] = node
+
+    def _shrink(self):
+        root = self._root
+        evict_cb = self.evict_cb
+        while self.size > self.max_size:
+            last = root[_PREV]
+            del self[last[_KEY]]
+            if evict_cb is not None:
+                evict_cb(last[_KEY], last[_VALUE])
+
+    def _unlink(self, node):
+        prev, next = node[_PREV], node[_NEXT]
+        prev[_NEXT] = next
+        next[_PREV] = prev
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
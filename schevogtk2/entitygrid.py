@@ -6,19 +6,23 @@
 import sys
 from schevo.lib import optimize
 
+from itertools import islice
+import time
+
 from schevo import base
 from schevo import field
 from schevo.label import label, plural
 from schevo.constant import UNASSIGNED
 from schevo.error import EntityDoesNotExist
-from schevo.introspect import commontype
 
 from schevogtk2.action import (
-    get_method_action, get_relationship_actions,
+    get_bulk_action, get_method_action, get_relationship_actions,
     get_tx_actions, get_tx_selectionmethod_actions,
     get_view_action, get_view_actions)
 from schevogtk2 import grid
 from schevogtk2 import icon
+from schevogtk2.idle import IdleTask
+from schevogtk2.querycache import QueryCache
 from schevogtk2.utils import gsignal, type_register
 
 import gobject
@@ -39,8 +43,8 @@ class EntityColumn(grid.Column):
 
     def cell_icon(self, column, cell, model, row_iter):
         grid.Column.cell_icon(self, column, cell, model, row_iter)
-        instance = model[row_iter][OBJECT_COLUMN]
         try:
+            instance = self.grid.row_instance(model, row_iter)
             entity = getattr(instance, self.attribute)
         except EntityDoesNotExist:
             entity = UNASSIGNED
@@ -61,6 +65,31 @@ class EntityGrid(grid.Grid):
 
     gsignal('action-selected', object)
 
+    # Deleting at least this many selected rows runs a
+    # `schevogtk2.bulk.BulkDeleteJob`, which executes transactions of
+    # `bulk_chunk_size` entities, instead of one transaction.
+    bulk_chunk_size = 200
+    bulk_threshold = 1000
+
+    # Set to an `ExtentPrefetcher` to reuse rows prefetched during
+    # idle time when an extent is shown.
+    prefetcher = None
+
+    # Reuse the results of queries run before with the same criteria,
+    # from a `schevogtk2.querycache.QueryCache` of the grid's database
+    # holding up to `query_cache_max_results` results.
+    cache_queries = True
+    query_cache_max_results = 100000
+
+    # Set to True to run queries in main loop idle time, adding their
+    # results in batches of `query_batch_size` as they are produced.
+    # Only queries that Schevo evaluates lazily, such as a `Match`
+    # comparing a field of an extent, are spread over idle slices and
+    # can be cancelled part way; others, such as `Exact` and
+    # `Intersection`, are evaluated entirely in the first slice.
+    async_queries = False
+    query_batch_size = 200
+
     # Set to False if 'Relationships' option should not show up in
     # popup menus.
     show_relationships_in_menu = True
@@ -68,6 +97,16 @@ class EntityGrid(grid.Grid):
     def __init__(self, model_info=None):
         grid.Grid.__init__(self)
         self._hidden = []  # List of fieldnames of columns to hide.
+        self.query_cache = None
+        self._query_count = 0
+        self._query_error = None
+        self._query_generation = 0
+        self._query_started = None
+        self._query_task = None
+        # Shows the progress of queries run asynchronously.
+        label = self._query_label = gtk.Label()
+        label.set_alignment(0.0, 0.5)
+        self.pack_end(label, expand=False)
         self._row_popup_menu = PopupMenu(self)
         self._set_bindings()
         self.reset()
@@ -79,6 +118,9 @@ class EntityGrid(grid.Grid):
              self._related,
              self._hidden,
              columns,
+             self._compact,
+             self._palette,
+             self._palette_map,
              ) = model_info
             if self._sorter is not None:
                 self._view.set_model(self._sorter)
@@ -89,16 +131,63 @@ class EntityGrid(grid.Grid):
         self.set_selection_mode(gtk.SELECTION_MULTIPLE)
 
     def add_row(self, oid):
-        instance = self._extent[oid]
-        row_iter = grid.Grid.add_row(self, instance)
-        self._row_map[oid] = row_iter
+        self.add_rows([oid])
+
+    def add_rows(self, oids):
+        extent = self._extent
+        row_map = self._row_map
+        oids = list(oids)
+        row_iters = grid.Grid.add_rows(self, [extent[oid] for oid in oids])
+        for oid, row_iter in zip(oids, row_iters):
+            row_map[oid] = row_iter
+        return row_iters
+
+    def bulk_update_action(self):
+        """Return an action whose method returns a job setting one
+        field of all selected entities in chunks, or None if fewer than
+        two rows are selected or they cannot be updated."""
+        selection = self._selection
+        if (self.get_selection_mode() != gtk.SELECTION_MULTIPLE
+            or len(selection) < 2
+            ):
+            return None
+        cls = selection.common_type()
+        sample = selection.first()
+        if cls is None or sample is None or 'update' not in sample.t:
+            return None
+        from schevogtk2.bulk import BulkUpdateJob
+        db = self._db
+        chunk_size = self.bulk_chunk_size
+        def job():
+            items, resolve = self._selection_snapshot()
+            return BulkUpdateJob(db, items, resolve, chunk_size)
+        return get_bulk_action(
+            db, cls, u'Update %i %s...' % (len(selection), plural(cls)), job)
 
     def columns_autosize_if_needed(self):
+        if self.fast_layout:
+            # Widths are estimated from samples instead.
+            return
         # Resize columns if 25 or fewer rows.
         model = self._model
         if len(model) <= 25:
             self._view.columns_autosize()
 
+    def export_action(self):
+        """Return an action whose method returns a job exporting the
+        rows shown, or None if there are none."""
+        model = self._view.get_model()
+        if model is None or not self._columns:
+            return None
+        count = model.iter_n_children(None)
+        if not count:
+            return None
+        def job():
+            from schevogtk2.export import ExportJob
+            return ExportJob(self)
+        return get_bulk_action(
+            self._db, self._extent, u'Export %i Rows...' % count, job)
+
     def identify(self, instance):
         return instance._oid
 
@@ -111,15 +200,27 @@ class EntityGrid(grid.Grid):
             self._related,
             self._hidden[:],
             self._columns[:],
+            self._compact,
+            # Shared, not copied, since compact rows of the model refer
+            # to colors by their index in the palette.
+            self._palette,
+            self._palette_map,
             )
 
     def reflect_changes(self, result, tx):
+        if self.query_cache is not None:
+            self.query_cache.reflect_changes(tx)
         if self._extent is not None:
             summary = tx.s.summarize()
-            for oid in summary.deletes.get(self._extent.name, []):
-                self.remove_row(oid)
-            for oid in summary.creates.get(self._extent.name, []):
-                self.add_row(oid)
+            name = self._extent.name
+            self.remove_rows(summary.deletes.get(name, []))
+            self.add_rows(sorted(summary.creates.get(name, [])))
+            # Restyle and refilter only the rows that changed.
+            updates = summary.updates.get(name, [])
+            self.redraw(updates)
+            self.refilter_rows(updates)
+            if self._search is not None:
+                self._search.rows_changed(updates)
             if isinstance(result, self._extent.EntityClass):
                 self.select_row(result.s.oid)
             self.columns_autosize_if_needed()
@@ -138,36 +239,43 @@ class EntityGrid(grid.Grid):
                 self.set_query(query)
             else:
                 # Get current selection identity so we can reselect it.
-                selected = self.get_selected()
                 rect = self._view.get_visible_rect()
-                if selected is None:
-                    identity = None
-                elif isinstance(selected, list):
-                    identity = [self.identify(entity) for entity in selected]
+                if self.get_selection_mode() == gtk.SELECTION_MULTIPLE:
+                    identity = list(self._selection.identities())
                 else:
-                    identity = self.identify(selected)
+                    selected = self.get_selected()
+                    if selected is None:
+                        identity = None
+                    else:
+                        identity = self.identify(selected)
+                def reselect():
+                    # Reselect the identity.
+                    if identity is None:
+                        pass
+                    elif isinstance(identity, list):
+                        self.select_rows(identity)
+                    else:
+                        self.select_row(identity)
+                    if rect.y == 0:
+                        rect_y = rect.y
+                    else:
+                        # XXX: For some reason, if we are at the very
+                        # end of the scroll view, scrolling to the
+                        # point will cause the view to scroll to the
+                        # very top. Take one away from the Y coordinate
+                        # so that this doesn't happen.
+                        rect_y = rect.y - 1
+                    if self._view.window:
+                        self._view.scroll_to_point(rect.x, rect_y)
                 # Refresh query.
-                results = query()
-                self.set_rows([])
-                self.set_rows(results)
-                # Reselect the identity.
-                if identity is None:
-                    pass
-                elif isinstance(identity, list):
-                    self.select_rows(identity)
+                if self.async_queries:
+                    self.set_rows([])
+                    self._run_query(query, reselect)
                 else:
-                    self.select_row(identity)
-                if rect.y == 0:
-                    rect_y = rect.y
-                else:
-                    # XXX: For some reason, if we are at the very end
-                    # of the scroll view, scrolling to the point will
-                    # cause the view to scroll to the very top. Take
-                    # one away from the Y coordinate so that this
-                    # doesn't happen.
-                    rect_y = rect.y - 1
-                if self._view.window:
-                    self._view.scroll_to_point(rect.x, rect_y)
+                    results = self.call_query(query)
+                    self.set_rows([])
+                    self.set_rows(results)
+                    reselect()
         elif related is not None:
             if related.entity.s.exists:
                 if extent is not None:
@@ -186,32 +294,52 @@ class EntityGrid(grid.Grid):
     def refresh_add_delete(self, oids):
         row_map = self._row_map
         # Delete entities that no longer exist.
-        for oid in row_map.keys():
-            if oid not in oids:
-                self.remove_row(oid)
+        oid_set = set(oids)
+        self.remove_rows([oid for oid in row_map if oid not in oid_set])
         # Add new entities.
-        for oid in oids:
-            if oid not in row_map:
-                self.add_row(oid)
+        self.add_rows([oid for oid in oids if oid not in row_map])
 
     def remove_row(self, oid):
-        if oid not in self._row_map:
-            return
+        self.remove_rows([oid])
+
+    def remove_rows(self, oids):
+        """Remove the rows of `oids`, then select the row that followed
+        the first one removed, if any rows remain."""
         model = self._model
-        row_iter = self._row_map.pop(oid)
-        # Get the current position.
-        pos = model[row_iter].path[0]
-        # Remove the instance.
-        model.remove(row_iter)
+        row_map = self._row_map
+        removed = []
+        pos = None
+        for oid in oids:
+            row_iter = row_map.pop(oid, None)
+            if row_iter is None:
+                continue
+            # Get the current position.
+            row_pos = model[row_iter].path[0]
+            if pos is None or row_pos < pos:
+                pos = row_pos
+            # Remove the instance.
+            model.remove(row_iter)
+            removed.append(oid)
+        if not removed:
+            return
+        if self._compiled_filter is not None:
+            self._compiled_filter.invalidate(removed)
+        if self._search is not None:
+            self._search.rows_removed(removed)
+        self._selection.rows_changed()
         # Select the next logical row, if any remain.
         end = len(model) - 1
         if pos > end:
             pos = end
         if pos > -1:
-            other = model[pos][OBJECT_COLUMN]
+            other = self.row_instance(model, model.get_iter(pos))
             self.select(other)
 
+    def resolve(self, oid):
+        return self._extent[oid]
+
     def reset(self):
+        self._cancel_query()
         self._extent = None
         self._query = None
         self._related = None
@@ -220,6 +348,29 @@ class EntityGrid(grid.Grid):
         self.set_rows([])
         self.set_columns([])
 
+    def row_types(self):
+        if self._extent is not None:
+            # Rows of an extent or a relationship are all of the same
+            # type.
+            return set([self._extent.EntityClass])
+        return grid.Grid.row_types(self)
+
+    def call_query(self, query):
+        """Return the results of `query`, from `query_cache` if
+        possible."""
+        cache = self.query_cache
+        if cache is not None and cache.db is self._db:
+            return cache.results(query)
+        return query()
+
+    def iter_query(self, query):
+        """Return an iterator over the results of `query`, from
+        `query_cache` if possible, producing them only as needed."""
+        cache = self.query_cache
+        if cache is not None and cache.db is self._db:
+            return cache.iter_results(query)
+        return iter(query())
+
     def select_action(self, action):
         self.emit('action-selected', action)
 
@@ -233,23 +384,24 @@ class EntityGrid(grid.Grid):
                 self.select_action(m_action)
 
     def select_delete_action(self):
-        selection = self.get_selected()
-        if isinstance(selection, list):
-            if len(selection) == 1:
-                selection = selection[0]
-                # Pass through to 'if selection is not None' block
-                # below.
-            else:
-                cls = commontype(selection)
-                if cls is None:
-                    return
-                method_name = 'delete_selected'
-                if method_name in cls.t:
+        if (self.get_selection_mode() == gtk.SELECTION_MULTIPLE
+            and len(self._selection) > 1
+            ):
+            selection = self._selection
+            cls = selection.common_type()
+            if cls is None:
+                return
+            method_name = 'delete_selected'
+            if method_name in cls.t:
+                if len(selection) >= self.bulk_threshold:
+                    m_action = self._bulk_delete_action(cls, method_name)
+                else:
                     m_action = get_method_action(
                         self._db, cls, 't', method_name)
                     m_action.selection = selection
-                    self.select_action(m_action)
-                return
+                self.select_action(m_action)
+            return
+        selection = self._single_selected()
         if selection is not None:
             method_name = 'delete'
             if method_name in selection.t:
@@ -258,12 +410,11 @@ class EntityGrid(grid.Grid):
                 self.select_action(m_action)
 
     def select_update_action(self):
-        selection = self.get_selected()
-        if isinstance(selection, list):
-            if len(selection) == 1:
-                selection = selection[0]
-            else:
-                selection = None
+        b_action = self.bulk_update_action()
+        if b_action is not None:
+            self.select_action(b_action)
+            return
+        selection = self._single_selected()
         if selection is not None:
             method_name = 'update'
             if method_name in selection.t:
@@ -272,12 +423,7 @@ class EntityGrid(grid.Grid):
                 self.select_action(m_action)
 
     def select_view_action(self):
-        selection = self.get_selected()
-        if isinstance(selection, list):
-            if len(selection) == 1:
-                selection = selection[0]
-            else:
-                selection = None
+        selection = self._single_selected()
         if (selection is not None
             and (selection._hidden_views is None
                  or 'default' not in selection._hidden_views
@@ -287,6 +433,11 @@ class EntityGrid(grid.Grid):
                 self._db, selection, include_expensive=False)
             self.select_action(v_action)
 
+    def select_export_action(self):
+        e_action = self.export_action()
+        if e_action is not None:
+            self.select_action(e_action)
+
     def select_row(self, oid):
         row_iter = self._row_map.get(oid, None)
         if row_iter is not None:
@@ -304,12 +455,18 @@ class EntityGrid(grid.Grid):
 
     def set_all_x(self, name, value):
         """Set x.name to value for all entities."""
-        for item in self._model:
-            entity = item[OBJECT_COLUMN]
+        model = self._model
+        for item in model:
+            entity = self.row_instance(model, item.iter)
             setattr(entity.x, name, value)
 
     def set_db(self, db):
+        if self.query_cache is not None:
+            self.query_cache.clear()
+            self.query_cache = None
         self._db = db
+        if db is not None and self.cache_queries:
+            self.query_cache = QueryCache(db, self.query_cache_max_results)
         if db is None:
             self.reset()
 
@@ -320,9 +477,18 @@ class EntityGrid(grid.Grid):
         if extent is not None:
             self._extent = extent
             self._row_popup_menu.set_extent(extent)
+            self.set_compact(self.compact_rows)
             columns = self._get_columns_for_field_spec(extent.field_spec)
-            self.set_columns(columns)
-            self.set_rows(extent)
+            prefetched = None
+            if self.prefetcher is not None and self._filter is None:
+                prefetched = self.prefetcher.take(extent)
+            if prefetched is not None:
+                model, row_map = prefetched
+                self.set_model_rows(model, row_map)
+                self.set_columns(columns)
+            else:
+                self.set_columns(columns)
+                self.set_rows(extent)
 
     def set_query(self, query):
         if query == self._query:
@@ -330,21 +496,24 @@ class EntityGrid(grid.Grid):
         self.reset()
         if query is not None:
             self._query = query
+            # Query results may be of any type, so they are always
+            # stored in full.
+            self.set_compact(False)
+            if self.async_queries:
+                self._run_query(query)
+                return
             # For now, assume the results are homogenous and take the
             # field_spec of the first result.
             field_spec = None
-            results = query()
+            results = self.call_query(query)
             if not isinstance(results, list):
                 # Work around the fact that queries may return
                 # iterators by returning non-lists into lists.
                 results = list(results)
             for result in results:
+                field_spec = self._result_field_spec(result)
                 if field_spec is not None:
                     break
-                if isinstance(result, base.Entity):
-                    field_spec = result._extent.field_spec
-                elif isinstance(result, base.View):
-                    field_spec = result._field_spec
             if field_spec is not None:
                 columns = self._get_columns_for_field_spec(field_spec)
                 self.set_columns(columns)
@@ -360,6 +529,7 @@ class EntityGrid(grid.Grid):
                 self._extent = extent
                 self._related = related
                 self._row_popup_menu.set_extent(extent)
+                self.set_compact(self.compact_rows)
                 columns = self._get_columns_for_field_spec(extent.field_spec)
                 results = related.entity.s.links(extent.name,
                                                  related.field_name)
@@ -367,8 +537,8 @@ class EntityGrid(grid.Grid):
                 self.set_rows(results)
 
     def _after_view__row_activated(self, view, path, column):
-        row = self._model[path]
-        entity = row[OBJECT_COLUMN]
+        model = self._model
+        entity = self.row_instance(model, model.get_iter(path))
         if (entity is not None
             and (entity._hidden_views is None
                  or 'default' not in entity._hidden_views
@@ -376,6 +546,115 @@ class EntityGrid(grid.Grid):
             ):
             self.emit('row-activated', entity)
 
+    def _bulk_delete_action(self, cls, method_name):
+        """Return an action whose method returns a job deleting the
+        currently selected entities of class `cls` in chunks."""
+        from schevogtk2.bulk import BulkDeleteJob
+        db = self._db
+        chunk_size = self.bulk_chunk_size
+        method = cls.t[method_name]
+        count = len(self._selection)
+        def job():
+            items, resolve = self._selection_snapshot()
+            return BulkDeleteJob(db, items, resolve, chunk_size, method)
+        return get_bulk_action(
+            db, cls, u'Delete %i %s' % (count, plural(cls)), job)
+
+    def _selection_snapshot(self):
+        """Return `(items, resolve)` for the selected entities, to pass
+        to a `schevogtk2.bulk.BulkJob`, since the selection changes
+        while the job runs.  Taken only when the job is created, since
+        it visits every selected row."""
+        if self._compact:
+            return sorted(self._selection.identities()), self.resolve
+        return list(self._selection), None
+
+    def _cancel_query(self):
+        """Stop adding the results of a query run asynchronously."""
+        self._query_generation += 1
+        if self._query_task is not None:
+            self._query_task.cancel()
+            self._query_task = None
+        self._query_label.hide()
+
+    def _query_results(self, query, generation):
+        """Add the results of `query` to the grid in batches, creating
+        columns from the first result that has a field spec."""
+        try:
+            results = self.iter_query(query)
+            pending = []
+            batch_size = self.query_batch_size
+            identify = self.identify
+            row_map = self._row_map
+            while generation == self._query_generation:
+                batch = list(islice(results, batch_size))
+                if not batch:
+                    break
+                pending.extend(batch)
+                if not self._columns:
+                    # For now, assume the results are homogenous and
+                    # take the field_spec of the first result.
+                    for result in batch:
+                        field_spec = self._result_field_spec(result)
+                        if field_spec is not None:
+                            self.set_columns(
+                                self._get_columns_for_field_spec(field_spec))
+                            break
+                    else:
+                        # Keep the results until the columns are known.
+                        yield
+                        continue
+                row_iters = grid.Grid.add_rows(self, pending)
+                for result, row_iter in zip(pending, row_iters):
+                    row_map[identify(result)] = row_iter
+                self._query_count += len(pending)
+                pending = []
+                self._show_query_status(True)
+                yield
+        except Exception, e:
+            if generation == self._query_generation:
+                self._query_error = e
+
+    def _result_field_spec(self, result):
+        if isinstance(result, base.Entity):
+            return result._extent.field_spec
+        elif isinstance(result, base.View):
+            return result._field_spec
+        return None
+
+    def _run_query(self, query, done_cb=None):
+        """Run `query` in main loop idle time, adding its results as
+        they are produced.  A later query, or resetting the grid,
+        cancels it."""
+        self._cancel_query()
+        generation = self._query_generation
+        self._query_count = 0
+        self._query_error = None
+        self._query_started = time.time()
+        self._show_query_status(True)
+        def done():
+            if generation == self._query_generation:
+                self._query_task = None
+                self._show_query_status(False)
+                self.columns_autosize_if_needed()
+                if done_cb is not None:
+                    done_cb()
+        self._query_task = IdleTask(
+            self._query_results(query, generation), done_cb=done).start()
+
+    def _show_query_status(self, running):
+        count = self._query_count
+        elapsed = time.time() - self._query_started
+        if running:
+            text = u'Running query: %i results, %.1f s' % (count, elapsed)
+        elif self._query_error is not None:
+            text = u'Query failed after %i results, %.1f s: %s' % (
+                count, elapsed, self._query_error)
+        else:
+            text = u'%i results in %.1f s' % (count, elapsed)
+        self._query_label.set_text(text)
+        self._query_label.show()
+
     def _get_columns_for_field_spec(self, field_spec):
         columns = []
         if '_oid' not in self._hidden:
@@ -410,6 +689,7 @@ class EntityGrid(grid.Grid):
             ('<Control><Shift>Return', self.select_create_action),
             ('<Control>Return', self.select_update_action),
             ('Delete', self.select_delete_action),
+            ('<Control>e', self.select_export_action),
             ]
         self._bindings = dict([(gtk.accelerator_parse(name), func)
                                for name, func in items])
@@ -462,13 +742,23 @@ class PopupMenu(grid.PopupMenu):
             items.extend(actions)
         # Tx selectionmethod actions.
         selection_mode = self._entity_grid._view.get_selection().get_mode()
-        selection = self._entity_grid.get_selected()
         if selection_mode == gtk.SELECTION_MULTIPLE:
-            actions = get_tx_selectionmethod_actions(db, selection)
+            selection = self._entity_grid.selection()
+            actions = get_tx_selectionmethod_actions(
+                db, selection, selection.common_type())
+            b_action = self._entity_grid.bulk_update_action()
+            if b_action is not None:
+                actions.append(b_action)
             if actions:
                 if items:
                     items.append(None)
                 items.extend(actions)
+        # Export action.
+        e_action = self._entity_grid.export_action()
+        if e_action is not None:
+            if items:
+                items.append(None)
+            items.append(e_action)
         return items
 
     def popup(self, event, instance):
@@ -0,0 +1,213 @@
+"""Export of grid rows to CSV and JSON-lines files."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import csv
+import os
+import Queue
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from schevo.error import EntityDoesNotExist
+
+import gobject
+import gtk
+
+from schevogtk2 import worker
+from schevogtk2.bulk import BulkJob
+from schevogtk2.importer import FORMATS
+
+
+class ExportJob(BulkJob):
+    """Write the rows shown by `grid` to a file, in the grid's current
+    sort and filter order.
+
+    - `filename`: The file to write.  May be chosen after creating the
+      job; see `configure`.
+
+    - `format`: 'csv' or 'json', for JSON-lines.  By default, guessed
+      from the file name's extension.
+
+    The grid's visible text columns are exported.  CSV files start
+    with a row of column titles, and JSON-lines objects are keyed by
+    column attribute, so both can be imported again.
+
+    Rows are read from the grid's view a chunk at a time in main loop
+    idle time, and written by a background thread.  At most
+    `queue_size` chunks wait to be written, so memory use stays bounded
+    however many rows are exported.  While the queue is full, reading
+    waits for the writer without blocking the main loop.
+    """
+
+    chunk_size = 500
+    queue_size = 8
+    verb = 'Exported'
+
+    def __init__(self, grid, filename=None, format=None, chunk_size=None):
+        BulkJob.__init__(self, grid._db, [], chunk_size=chunk_size)
+        self.grid = grid
+        self.filename = filename
+        self.format = format
+        self.columns = [column for column in grid._columns
+                        if column.visible and column.cell_prop != 'pixbuf']
+        model = grid._view.get_model()
+        if model is not None:
+            self.total = model.iter_n_children(None)
+        self._queue = None
+        self._writer = None
+
+    @property
+    def running(self):
+        return self._task is not None or self._writer is not None
+
+    def configure(self, parent, get_value_handlers, set_field_handlers):
+        if self.filename is None:
+            self.filename = choose_file(
+                parent, u'Export %i Rows' % self.total)
+            if self.filename is None:
+                return False
+        if self.format is None:
+            extension = os.path.splitext(self.filename)[1].lower()
+            self.format = FORMATS.get(extension, 'csv')
+        return True
+
+    def description(self):
+        return '%i rows will be exported to %s.' % (
+            self.total, os.path.basename(self.filename))
+
+    def start(self, chunk_cb=None, done_cb=None):
+        """Start the job.  `done_cb(job)` is called once all rows read
+        are written."""
+        queue = self._queue = Queue.Queue(self.queue_size)
+        def written(result):
+            self._writer = None
+            if done_cb is not None:
+                done_cb(self)
+        def failed(exc_type, exc_val, exc_tb):
+            self.error = exc_val
+            written(None)
+        self._writer = worker.run_in_background(
+            self._write, callback=written, errback=failed)
+        def finish():
+            # Let the writer finish, once there is room in the queue.
+            try:
+                queue.put_nowait(None)
+            except Queue.Full:
+                return True
+            return False
+        def read(job):
+            if finish():
+                gobject.timeout_add(self.retry_ms, finish)
+        return BulkJob.start(self, chunk_cb, read)
+
+    def _chunks(self):
+        grid = self.grid
+        model = grid._view.get_model()
+        if model is None:
+            return
+        columns = self.columns
+        row_instance = grid.row_instance
+        chunk_size = self.chunk_size
+        start = 0
+        # Rows are read by position rather than with iterators, which
+        # do not survive changes to the grid's models.
+        while start < model.iter_n_children(None):
+            stop = min(start + chunk_size, model.iter_n_children(None))
+            chunk = []
+            for position in xrange(start, stop):
+                try:
+                    instance = row_instance(model, model.get_iter((position,)))
+                except EntityDoesNotExist:
+                    self.skipped += 1
+                    continue
+                chunk.append([column.export_value(instance)
+                              for column in columns])
+            yield chunk
+            start = stop
+
+    def _execute_chunk(self, chunk, chunk_cb):
+        try:
+            self._queue.put_nowait(chunk)
+        except Queue.Full:
+            # The writer is behind; offer the chunk again after
+            # `retry_ms` rather than blocking the main loop.
+            return False
+        self.done += len(chunk)
+
+    def _write(self):
+        """Write chunks from the queue until it yields None.  Called in
+        the writer thread."""
+        queue = self._queue
+        f = write_rows = None
+        try:
+            f = open(self.filename, 'wb')
+            write_rows = self._row_writer(f)
+        except Exception, e:
+            self._write_failed(e)
+        while True:
+            rows = queue.get()
+            if rows is None:
+                break
+            if self.error is None:
+                try:
+                    write_rows(rows)
+                except Exception, e:
+                    self._write_failed(e)
+        if f is not None:
+            f.close()
+
+    def _write_failed(self, e):
+        # Keep taking chunks from the queue, so the reader doesn't
+        # block, but stop reading more.
+        self.error = e
+        self._stop = True
+
+    def _row_writer(self, f):
+        """Return a function that writes a list of rows to `f`, after
+        writing any header."""
+        if self.format == 'csv':
+            writer = csv.writer(f)
+            def encode(value):
+                if value is None:
+                    return ''
+                if isinstance(value, unicode):
+                    return value.encode('utf-8')
+                return value
+            writer.writerow([encode(column.title) for column in self.columns])
+            def write_rows(rows):
+                writer.writerows([[encode(value) for value in row]
+                                  for row in rows])
+        else:
+            keys = [column.attribute for column in self.columns]
+            dumps = json.dumps
+            def write_rows(rows):
+                f.writelines(['%s\n' % dumps(dict(zip(keys, row)))
+                              for row in rows])
+        return write_rows
+
+
+def choose_file(parent, title):
+    """Return the name of a CSV or JSON-lines file to export to, or
+    None."""
+    dialog = gtk.FileChooserDialog(
+        title, parent, gtk.FILE_CHOOSER_ACTION_SAVE,
+        (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+         gtk.STOCK_SAVE, gtk.RESPONSE_OK))
+    dialog.set_default_response(gtk.RESPONSE_OK)
+    dialog.set_do_overwrite_confirmation(True)
+    dialog.set_current_name('export.csv')
+    filename = None
+    if dialog.run() == gtk.RESPONSE_OK:
+        filename = dialog.get_filename()
+    dialog.destroy()
+    return filename
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
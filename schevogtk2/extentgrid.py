@@ -11,6 +11,7 @@ from schevo.label import label, plural
 from schevogtk2 import action
 from schevogtk2 import grid
 from schevogtk2 import icon
+from schevogtk2.predicate import Eq
 from schevogtk2.utils import gsignal, type_register
 
 import gtk
@@ -34,12 +35,13 @@ class ExtentGrid(grid.Grid):
 
     gsignal('action-selected', object)
 
+    # Number of entities created per transaction when importing.
+    import_chunk_size = 200
+
     def __init__(self):
         grid.Grid.__init__(self)
         self._show_hidden_extents = False
-        self._filter = self._model.filter_new()
-        self._filter.set_visible_func(self._is_visible)
-        self._sorter = gtk.TreeModelSort(self._filter)
+        self.set_filter(self._hidden_filter())
         self._row_popup_menu = PopupMenu(self)
         self._set_bindings()
         columns = self._columns = []
@@ -49,6 +51,36 @@ class ExtentGrid(grid.Grid):
         columns.append(column)
         self.set_columns(columns)
 
+    def get_adjacent(self, extent, distance=1):
+        """Return the visible extents within `distance` rows of
+        `extent`, nearest first."""
+        model = self._view.get_model()
+        if model is None:
+            return []
+        extents = [row[OBJECT_COLUMN] for row in model]
+        if extent not in extents:
+            return []
+        index = extents.index(extent)
+        adjacent = []
+        for offset in xrange(1, distance + 1):
+            for other_index in (index + offset, index - offset):
+                if 0 <= other_index < len(extents):
+                    adjacent.append(extents[other_index])
+        return adjacent
+
+    def import_action(self, extent):
+        """Return an action whose method returns a job importing a file
+        into `extent`, or None if entities cannot be created in it."""
+        if extent is None or 'create' not in extent.t:
+            return None
+        db = self._db
+        chunk_size = self.import_chunk_size
+        def job():
+            from schevogtk2.importer import ImportJob
+            return ImportJob(db, extent, chunk_size=chunk_size)
+        return action.get_bulk_action(
+            db, extent, u'Import %s...' % plural(extent), job)
+
     def select_action(self, action):
         self.emit('action-selected', action)
 
@@ -61,6 +93,11 @@ class ExtentGrid(grid.Grid):
                     self._db, extent, 't', method_name)
                 self.select_action(m_action)
 
+    def select_import_action(self):
+        i_action = self.import_action(self.get_selected())
+        if i_action is not None:
+            self.select_action(i_action)
+
     def set_db(self, db):
         self._db = db
         if db is None:
@@ -75,35 +112,26 @@ class ExtentGrid(grid.Grid):
         else:
             self.set_columns(self._columns[:-1])
 
-    def set_visible_func(self, fn):
-        """Create a new filter for the model, and set its visible_func to
-        `fn`."""
-        self._filter = self._model.filter_new()
-        self._filter.set_visible_func(fn)
-        self._sorter = gtk.TreeModelSort(self._filter)
-
     def _get_show_hidden_extents(self):
         return self._show_hidden_extents
 
     def _set_show_hidden_extents(self, value):
         self._show_hidden_extents = value
-        self._filter.refilter()
+        self.set_filter(self._hidden_filter())
 
     show_hidden_extents = property(fget=_get_show_hidden_extents,
                                    fset=_set_show_hidden_extents)
 
-    def _is_visible(self, model, row_iter):
-        visible = False
-        extent = model[row_iter][OBJECT_COLUMN]
-        if extent is not None:
-            if self._show_hidden_extents or not extent.hidden:
-                visible = True
-        return visible
+    def _hidden_filter(self):
+        if self._show_hidden_extents:
+            return None
+        return Eq('hidden', False)
 
     def _set_bindings(self):
         items = [
             ('Insert', self.select_create_action),
             ('<Control><Shift>Return', self.select_create_action),
+            ('<Control>i', self.select_import_action),
             ]
         self._bindings = dict([(gtk.accelerator_parse(name), func)
                                for name, func in items])
@@ -125,6 +153,11 @@ class PopupMenu(grid.PopupMenu):
         actions = action.get_tx_actions(self._extent_grid._db, extent)
         if actions:
             items.extend(actions)
+        i_action = self._extent_grid.import_action(extent)
+        if i_action is not None:
+            if items:
+                items.append(None)
+            items.append(i_action)
         return items
 
     def popup(self, event, instance):
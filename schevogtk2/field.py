@@ -19,7 +19,8 @@ from schevo.base import Entity, Transaction
 from schevo.constant import UNASSIGNED
 
 from schevogtk2.constants import MONO_FONT
-from schevogtk2 import fieldwidget
+# schevogtk2.fieldwidget is imported by the handlers that use it, so
+# that it is only loaded once a field widget is needed.
 from schevogtk2.utils import gsignal, type_register
 
 
@@ -213,6 +214,7 @@ def _get_value_ScrolledWindow(widget):
 
 @optimize.do_not_optimize
 def _get_value_BooleanRadio(widget):
+    from schevogtk2 import fieldwidget
     if isinstance(widget, fieldwidget.BooleanRadio):
         value = widget.get_value()
         return (widget, False, value)
@@ -229,6 +231,7 @@ def _get_value_CheckButton(widget):
 
 @optimize.do_not_optimize
 def _get_value_FileChooser(widget):
+    from schevogtk2 import fieldwidget
     if isinstance(widget, fieldwidget.FileChooser):
         value = widget.get_filename()
         return (widget, False, value)
@@ -246,6 +249,7 @@ def _get_value_Image(widget):
 
 @optimize.do_not_optimize
 def _get_value_EntityChooser(widget):
+    from schevogtk2 import fieldwidget
     if isinstance(widget, fieldwidget.EntityChooser):
         value = widget.get_selected()
         if value is None:
@@ -268,6 +272,7 @@ def _get_value_TextView(widget):
 
 @optimize.do_not_optimize
 def _get_value_ValueChooser(widget):
+    from schevogtk2 import fieldwidget
     if isinstance(widget, fieldwidget.ValueChooser):
         value = widget.get_selected()
         if value is None:
@@ -320,6 +325,7 @@ DEFAULT_GET_VALUE_HANDLERS = [
 
 @optimize.do_not_optimize
 def _set_field_rw_boolean(container, db, field, change_cb):
+    from schevogtk2 import fieldwidget
     if isinstance(field, schevo.field.Boolean) and not field.readonly:
         value = field.value
         if value is UNASSIGNED:
@@ -337,6 +343,7 @@ def _set_field_rw_boolean(container, db, field, change_cb):
 
 @optimize.do_not_optimize
 def _set_field_rw_entity(container, db, field, change_cb):
+    from schevogtk2 import fieldwidget
     if isinstance(field, schevo.field.Entity) and not field.readonly:
         widget = fieldwidget.EntityChooser(db, field)
         widget.connect('value-changed', change_cb, field)
@@ -403,6 +410,7 @@ def _set_field_calculated(container, db, field, change_cb):
 
 @optimize.do_not_optimize
 def _set_field_rw_path(container, db, field, change_cb):
+    from schevogtk2 import fieldwidget
     if isinstance(field, schevo.field.Path) and not field.readonly:
         value = field.value
         widget = fieldwidget.FileChooser(db, field)
@@ -432,6 +440,7 @@ def _set_field_ro_boolean(container, db, field, change_cb):
 
 @optimize.do_not_optimize
 def _set_field_generic_valid_values(container, db, field, change_cb):
+    from schevogtk2 import fieldwidget
     if field.valid_values is not None and not (field.readonly or field.fget):
         widget = fieldwidget.ValueChooser(db, field)
         widget.connect('value-changed', change_cb, field)
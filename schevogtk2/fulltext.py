@@ -0,0 +1,511 @@
+"""Full-text search of the entities of a database.
+
+A `FullTextIndex` maps the casefolded words of the string fields of
+every non-hidden extent to the entities that contain them.  It is
+built in main loop idle time the first time it is needed, and saved
+next to the database file, with the `INDEX_EXTENSION` suffix, to be
+loaded in a background thread the next time the database is opened.
+Executed transactions update it incrementally.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from bisect import bisect_left
+import os
+import time
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import schevo.field
+from schevo.error import EntityDoesNotExist
+from schevo.label import plural
+
+import gobject
+import gtk
+
+from schevogtk2 import icon
+from schevogtk2.gridsearch import tokenize
+from schevogtk2.idle import IdleTask
+from schevogtk2 import worker
+
+
+INDEX_EXTENSION = '.gnav-index'
+
+# Version of the format of saved indexes.  Indexes saved in another
+# format are rebuilt.
+INDEX_VERSION = 2
+
+
+class FullTextIndex(object):
+    """Word index of the string fields of the entities of `db`.
+
+    - `filename`: The database file.  If given, the index is loaded
+      from and saved to a file beside it.
+
+    - `ready`: True once the index has been loaded or built.
+
+    - `seconds`: Time spent building the index.
+
+    The index is only used if the database file has the size and
+    modification time it had when the index was saved; otherwise it is
+    rebuilt.  Entities are indexed by `(extent name, oid)`.
+    """
+
+    def __init__(self, db, filename=None):
+        self.db = db
+        self.filename = filename
+        self.changed = False
+        self.ready = False
+        self.seconds = 0.0
+        self._docs = {}
+        self._fields = {}
+        self._loader = None
+        self._pending = set()
+        self._postings = {}
+        self._task = None
+        self._tokens = None
+
+    @property
+    def building(self):
+        return self._task is not None or self._loader is not None
+
+    @property
+    def index_filename(self):
+        if self.filename is None:
+            return None
+        return self.filename + INDEX_EXTENSION
+
+    def close(self):
+        """Stop building the index, and save it if it changed."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._loader = None
+        if self.ready and self.changed:
+            self.save()
+        self.db = None
+
+    def open(self, done_cb=None):
+        """Load the saved index in a background thread, or build it in
+        idle time if there is none or it is out of date.  `done_cb` is
+        called once the index is ready."""
+        if self.ready or self.building:
+            return
+        index_filename = self.index_filename
+        if index_filename is None or not os.path.isfile(index_filename):
+            self._build(done_cb)
+            return
+        def loaded(postings):
+            if self._loader is not loader:
+                # Closed, or opened again, while loading.
+                return
+            self._loader = None
+            if postings is None:
+                self._build(done_cb)
+            else:
+                self._set_postings(postings)
+                self._ready(done_cb)
+        def failed(exc_type, exc_val, exc_tb):
+            loaded(None)
+        loader = self._loader = worker.run_in_background(
+            self._load, (), loaded, failed)
+
+    def reflect_changes(self, tx):
+        """Update the index for the entities that the executed
+        transaction `tx` created, updated or deleted."""
+        summary = tx.s.summarize()
+        docs = set()
+        for changes in (summary.creates, summary.deletes, summary.updates):
+            for extent_name, oids in changes.iteritems():
+                docs.update((extent_name, oid) for oid in oids)
+        if not docs:
+            return
+        if self.ready:
+            self._update(docs)
+        else:
+            # Applied once the index is loaded or built.
+            self._pending.update(docs)
+
+    def save(self):
+        """Save the index beside the database file.
+
+        The index is saved as JSON, with the postings of each token as
+        a list of `[extent name, oid, count]`, so that loading it never
+        runs code.  If it cannot be written, any partly written file is
+        removed so that the index is rebuilt the next time the database
+        is opened.
+        """
+        index_filename = self.index_filename
+        if index_filename is None:
+            return
+        try:
+            postings = dict(
+                (token, [[extent_name, oid, count]
+                         for (extent_name, oid), count in posting.iteritems()])
+                for token, posting in self._postings.iteritems()
+                )
+            data = dict(
+                version=INDEX_VERSION,
+                stamp=list(self._stamp()),
+                postings=postings,
+                )
+            f = open(index_filename, 'wb')
+            try:
+                json.dump(data, f, separators=(',', ':'))
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            # Read-only directory, full disk, database file gone, or a
+            # word that is not valid UTF-8.
+            try:
+                os.remove(index_filename)
+            except OSError:
+                pass
+        self.changed = False
+
+    def search(self, text):
+        """Return `(extent name, [(score, oid), ...])` for the entities
+        that have, for each word of `text`, a word starting with it.
+        Hits are ranked by how often the words occur, counting whole
+        words twice.  Extents are ordered by their best hit."""
+        words = tokenize(text)
+        if not words or not self.ready:
+            return []
+        tokens = self._tokens
+        if tokens is None:
+            tokens = self._tokens = sorted(self._postings)
+        postings = self._postings
+        # Longest words first, since they usually match fewest entities.
+        words.sort(key=len, reverse=True)
+        scores = None
+        for word in words:
+            word_scores = {}
+            index = bisect_left(tokens, word)
+            while index < len(tokens) and tokens[index].startswith(word):
+                token = tokens[index]
+                if token == word:
+                    weight = 2
+                else:
+                    weight = 1
+                for doc, count in postings[token].iteritems():
+                    word_scores[doc] = word_scores.get(doc, 0) + weight * count
+                index += 1
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict((doc, score + word_scores[doc])
+                              for doc, score in scores.iteritems()
+                              if doc in word_scores)
+            if not scores:
+                return []
+        groups = {}
+        for (extent_name, oid), score in scores.iteritems():
+            groups.setdefault(extent_name, []).append((-score, oid))
+        results = []
+        for extent_name, hits in groups.iteritems():
+            hits.sort()
+            results.append(
+                (extent_name, [(-score, oid) for score, oid in hits]))
+        results.sort(key=lambda result: (-result[1][0][0], result[0]))
+        return results
+
+    def _add(self, doc, entity, field_names):
+        counts = {}
+        for field_name in field_names:
+            value = getattr(entity, field_name)
+            if not isinstance(value, basestring) or not value:
+                continue
+            if isinstance(value, str):
+                value = value.decode('utf-8', 'replace')
+            for token in tokenize(value):
+                counts[token] = counts.get(token, 0) + 1
+        postings = self._postings
+        for token, count in counts.iteritems():
+            posting = postings.get(token)
+            if posting is None:
+                posting = postings[token] = {}
+                self._tokens = None
+            posting[doc] = count
+        if counts:
+            self._docs[doc] = tuple(counts)
+
+    def _build(self, done_cb):
+        self._task = IdleTask(self._build_steps(done_cb)).start()
+
+    def _build_steps(self, done_cb):
+        self._docs.clear()
+        self._postings.clear()
+        self._tokens = None
+        self.seconds = 0.0
+        mark = time.time()
+        for extent in self.db.extents():
+            field_names = self._field_names(extent)
+            if not field_names:
+                continue
+            extent_name = extent.name
+            # Entities may be created or deleted while building; those
+            # changes are pending until the index is ready.
+            for oid in extent.find_oids():
+                try:
+                    entity = extent[oid]
+                    self._add((extent_name, oid), entity, field_names)
+                except EntityDoesNotExist:
+                    pass
+                now = time.time()
+                self.seconds += now - mark
+                yield
+                mark = time.time()
+        self._task = None
+        self.changed = True
+        self._ready(done_cb)
+        if self.index_filename is not None:
+            self.save()
+
+    def _field_names(self, extent):
+        """Return the names of the string fields of `extent` to index,
+        or an empty list if it is hidden."""
+        field_names = self._fields.get(extent.name)
+        if field_names is None:
+            field_names = []
+            if not extent.hidden:
+                for field_name, FieldClass in extent.field_spec.iteritems():
+                    if (issubclass(FieldClass,
+                                   (schevo.field.String, schevo.field.Unicode))
+                        and not issubclass(FieldClass, schevo.field.Password)
+                        and not FieldClass.hidden
+                        and not FieldClass.expensive
+                        ):
+                        field_names.append(field_name)
+            self._fields[extent.name] = field_names
+        return field_names
+
+    def _load(self):
+        """Return the saved postings, or None if they are out of date.
+        Called in a background thread."""
+        f = open(self.index_filename, 'rb')
+        try:
+            try:
+                data = json.load(f)
+            except ValueError:
+                return None
+        finally:
+            f.close()
+        if (not isinstance(data, dict)
+            or data.get('version') != INDEX_VERSION
+            or data.get('stamp') != list(self._stamp())
+            or not isinstance(data.get('postings'), dict)
+            ):
+            return None
+        postings = {}
+        try:
+            for token, entries in data['postings'].iteritems():
+                posting = postings[token] = {}
+                for extent_name, oid, count in entries:
+                    if not (isinstance(extent_name, basestring)
+                            and isinstance(oid, (int, long))
+                            and isinstance(count, (int, long))
+                            ):
+                        return None
+                    posting[(str(extent_name), oid)] = count
+        except (TypeError, ValueError):
+            # Not a list of `[extent name, oid, count]` entries.
+            return None
+        return postings
+
+    def _ready(self, done_cb):
+        self._tokens = sorted(self._postings)
+        self.ready = True
+        pending = self._pending
+        if pending:
+            self._pending = set()
+            self._update(pending)
+        if done_cb is not None:
+            done_cb()
+
+    def _remove(self, doc):
+        postings = self._postings
+        for token in self._docs.pop(doc, ()):
+            posting = postings.get(token)
+            if posting is not None:
+                posting.pop(doc, None)
+                if not posting:
+                    del postings[token]
+                    self._tokens = None
+
+    def _set_postings(self, postings):
+        docs = {}
+        for token, posting in postings.iteritems():
+            for doc in posting:
+                docs.setdefault(doc, []).append(token)
+        self._docs = dict((doc, tuple(tokens))
+                          for doc, tokens in docs.iteritems())
+        self._postings = postings
+        self._tokens = None
+
+    def _stamp(self):
+        """Return the size and modification time of the database
+        file."""
+        st = os.stat(self.filename)
+        return (st.st_size, st.st_mtime)
+
+    def _update(self, docs):
+        extent = self.db.extent
+        for doc in docs:
+            self._remove(doc)
+            extent_name, oid = doc
+            try:
+                ext = extent(extent_name)
+                field_names = self._field_names(ext)
+                if field_names:
+                    self._add(doc, ext[oid], field_names)
+            except EntityDoesNotExist:
+                pass
+        self.changed = True
+
+
+class FullTextSearch(gtk.VBox):
+    """Search box for the entities of a database, with the hits shown
+    below it, grouped by extent.
+
+    Activating a hit calls `activate_cb(entity)`.  At most `max_hits`
+    hits are shown per extent.
+    """
+
+    max_hits = 20
+
+    def __init__(self, activate_cb=None):
+        gtk.VBox.__init__(self)
+        self.activate_cb = activate_cb
+        self.index = None
+        box = gtk.HBox(spacing=6)
+        self.pack_start(box, expand=False)
+        box.pack_start(gtk.Label('Search:'), expand=False)
+        entry = self._entry = gtk.Entry()
+        entry.connect('changed', self._on_entry__changed)
+        entry.connect('focus-in-event', self._on_entry__focus_in_event)
+        entry.connect('key-press-event', self._on_entry__key_press_event)
+        box.pack_start(entry, expand=True)
+        label = self._label = gtk.Label()
+        box.pack_start(label, expand=False)
+        # Hits.
+        model = self._model = gtk.TreeStore(
+            gobject.TYPE_PYOBJECT, gtk.gdk.Pixbuf, gobject.TYPE_STRING)
+        view = self._view = gtk.TreeView(model)
+        view.set_headers_visible(False)
+        column = gtk.TreeViewColumn()
+        cell = gtk.CellRendererPixbuf()
+        column.pack_start(cell, expand=False)
+        column.add_attribute(cell, 'pixbuf', 1)
+        cell = gtk.CellRendererText()
+        column.pack_start(cell, expand=True)
+        column.add_attribute(cell, 'text', 2)
+        view.append_column(column)
+        view.connect('row-activated', self._on_view__row_activated)
+        scroller = self._scroller = gtk.ScrolledWindow()
+        scroller.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scroller.set_shadow_type(gtk.SHADOW_IN)
+        scroller.props.height_request = 200
+        scroller.add(view)
+        self.pack_start(scroller, expand=True)
+        scroller.set_no_show_all(True)
+
+    def clear(self):
+        """Clear the search box and hide the hits."""
+        self._entry.set_text('')
+
+    def grab_focus(self):
+        self._entry.grab_focus()
+
+    def reflect_changes(self, tx):
+        index = self.index
+        if index is not None and tx.s.executed:
+            index.reflect_changes(tx)
+            if self._entry.get_text():
+                self.search()
+
+    def search(self):
+        """Show the hits of the text in the search box."""
+        text = unicode(self._entry.get_text(), 'utf-8')
+        model = self._model
+        model.clear()
+        index = self.index
+        if index is None or not text.strip():
+            self._label.set_text('')
+            self._scroller.hide()
+            return
+        if not index.ready:
+            self._label.set_text('Indexing...')
+            return
+        start = time.time()
+        results = index.search(text)
+        db = index.db
+        max_hits = self.max_hits
+        count = 0
+        for extent_name, hits in results:
+            extent = db.extent(extent_name)
+            count += len(hits)
+            parent = model.append(None, [
+                None, icon.small_pixbuf(self, extent),
+                u'%s (%i)' % (plural(extent), len(hits))])
+            for score, oid in hits[:max_hits]:
+                try:
+                    entity = extent[oid]
+                except EntityDoesNotExist:
+                    continue
+                model.append(parent, [entity, None, unicode(entity)])
+        self._view.expand_all()
+        elapsed = (time.time() - start) * 1000
+        self._label.set_text(u'%i hits in %.1f ms' % (count, elapsed))
+        self._scroller.show_all()
+
+    def set_db(self, db, filename=None):
+        """Search `db`, whose file is `filename`.  The index of the
+        previous database is saved."""
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if db is not None:
+            self.index = FullTextIndex(db, filename)
+        self.clear()
+        self.search()
+
+    def _on_entry__changed(self, entry):
+        self.search()
+
+    def _on_entry__focus_in_event(self, entry, event):
+        # Load or build the index on first use.
+        index = self.index
+        if index is not None and not index.ready:
+            index.open(self.search)
+            self.search()
+
+    def _on_entry__key_press_event(self, entry, event):
+        keyval = event.keyval
+        if keyval == gtk.keysyms.Escape:
+            self.clear()
+            return True
+        elif keyval == gtk.keysyms.Down and len(self._model):
+            self._view.grab_focus()
+            self._view.set_cursor((0, 0))
+            return True
+
+    def _on_view__row_activated(self, view, path, column):
+        model = self._model
+        entity = model.get_value(model.get_iter(path), 0)
+        if entity is None:
+            if view.row_expanded(path):
+                view.collapse_row(path)
+            else:
+                view.expand_row(path, False)
+        elif self.activate_cb is not None:
+            self.activate_cb(entity)
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
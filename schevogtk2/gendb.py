@@ -0,0 +1,510 @@
+"""Synthetic database generator for load-testing the navigator.
+
+A profile declares the extents to generate, in order.  Each extent
+has a number of rows and a list of fields; Entity fields may only
+refer to extents declared before them, so that references form a
+graph as deep as the list of extents.  Extents referred to by several
+other extents have many relationships, as shown by the relationship
+navigator's `RelatedGrid`.
+
+Example profile, as JSON::
+
+  {
+    "seed": 1,
+    "batch_size": 1000,
+    "hidden_share": 0.1,
+    "expensive_share": 0.1,
+    "extents": [
+      {"name": "Region", "rows": 50,
+       "fields": [{"name": "name", "type": "string", "key": true}]},
+      {"name": "Customer", "rows": 100000,
+       "fields": [
+         {"name": "name", "type": "string", "key": true},
+         {"name": "region", "type": "entity", "extent": "Region",
+          "fanout": "skewed"},
+         {"name": "age", "type": "integer", "min": 18, "max": 90,
+          "distribution": "normal"},
+         {"name": "photo", "type": "image", "size": 20000, "share": 0.5}
+       ]}
+    ]
+  }
+
+Profile settings:
+
+- `seed`: Seed of the random number generator, so that a profile
+  always generates the same database.
+
+- `batch_size`: Number of creates executed in each transaction.
+
+- `hidden_share`: Share of extents, among those that do not set
+  `hidden` themselves, that are hidden.
+
+- `expensive_share`: Share of each extent's fields that are
+  expensive calculated fields, unless the extent sets
+  `expensive_fields` to a number of such fields.
+
+Field settings:
+
+- `type`: One of `string`, `integer`, `float`, `boolean`, `date`,
+  `entity`, `image` or `blob`.
+
+- `key`: True if the field is the extent's key.  Key values are
+  always unique.
+
+- `share`: Share of rows that have a value; the others are
+  UNASSIGNED.
+
+- `distribution`: For strings, `words` (the default), `unique` or
+  `choice` from `values`.  For numbers and dates, `uniform` (the
+  default) between `min` and `max`, `normal`, `skewed` towards `min`,
+  or `sequential`.
+
+- `extent` and `fanout`: For Entity fields, the extent referred to,
+  and how references spread over its entities: `uniform` (the
+  default), `skewed` towards a few entities that have many links, or
+  `sequential`.
+
+- `size`: For images and blobs, the approximate size in bytes.
+
+Rows are created in batched transactions, and the object cache is
+shrunk after each batch, so that memory use does not grow with the
+number of rows.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import datetime
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import math
+import os
+import random
+import struct
+import time
+import zlib
+
+from schevo.constant import UNASSIGNED
+from schevo.script.command import Command
+from schevo.script import opt
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+FIELD_TYPES = {
+    'blob': 'f.blob',
+    'boolean': 'f.boolean',
+    'date': 'f.date',
+    'entity': 'f.entity',
+    'float': 'f.float',
+    'image': 'f.image',
+    'integer': 'f.integer',
+    'string': 'f.string',
+    }
+
+WORDS = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot',
+         'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima', 'mike',
+         'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra',
+         'tango', 'uniform', 'victor', 'whiskey', 'xray', 'yankee', 'zulu']
+
+# A profile resembling a typical business database.  `Customer` and
+# `Product` are referred to by several extents, and `Note` refers to
+# a chain of extents.
+PROFILES = {
+    'business': {
+        'seed': 1,
+        'hidden_share': 0.1,
+        'expensive_share': 0.2,
+        'extents': [
+            {'name': 'Region', 'rows': 50, 'fields': [
+                {'name': 'name', 'type': 'string', 'key': True},
+                ]},
+            {'name': 'Customer', 'rows': 20000, 'fields': [
+                {'name': 'name', 'type': 'string', 'key': True},
+                {'name': 'region', 'type': 'entity', 'extent': 'Region',
+                 'fanout': 'skewed'},
+                {'name': 'since', 'type': 'date'},
+                {'name': 'photo', 'type': 'image', 'size': 4000,
+                 'share': 0.2},
+                ]},
+            {'name': 'Product', 'rows': 2000, 'fields': [
+                {'name': 'code', 'type': 'string', 'key': True},
+                {'name': 'description', 'type': 'string', 'words': 6},
+                {'name': 'price', 'type': 'float', 'min': 1, 'max': 500,
+                 'distribution': 'skewed'},
+                {'name': 'discontinued', 'type': 'boolean', 'share': 0.1},
+                ]},
+            {'name': 'Order', 'rows': 100000, 'fields': [
+                {'name': 'number', 'type': 'integer', 'key': True},
+                {'name': 'customer', 'type': 'entity', 'extent': 'Customer',
+                 'fanout': 'skewed'},
+                {'name': 'placed', 'type': 'date'},
+                ]},
+            {'name': 'OrderLine', 'rows': 400000, 'fields': [
+                {'name': 'order', 'type': 'entity', 'extent': 'Order',
+                 'fanout': 'sequential'},
+                {'name': 'product', 'type': 'entity', 'extent': 'Product',
+                 'fanout': 'skewed'},
+                {'name': 'quantity', 'type': 'integer', 'min': 1, 'max': 100,
+                 'distribution': 'skewed'},
+                ]},
+            {'name': 'Contact', 'rows': 40000, 'fields': [
+                {'name': 'customer', 'type': 'entity', 'extent': 'Customer'},
+                {'name': 'name', 'type': 'string', 'words': 2},
+                {'name': 'email', 'type': 'string', 'distribution': 'unique'},
+                ]},
+            {'name': 'Note', 'rows': 50000, 'fields': [
+                {'name': 'customer', 'type': 'entity', 'extent': 'Customer',
+                 'share': 0.5},
+                {'name': 'order', 'type': 'entity', 'extent': 'Order',
+                 'share': 0.5},
+                {'name': 'text', 'type': 'string', 'words': 20},
+                {'name': 'attachment', 'type': 'blob', 'size': 50000,
+                 'share': 0.05},
+                ]},
+            ],
+        },
+    }
+
+
+USAGE = """\
+schevo ggen [options] DBFILE
+
+DBFILE: The database file to create.  It must not already exist."""
+
+
+def _parser():
+    p = opt.parser(USAGE)
+    p.add_option('-p', '--profile', dest='profile', metavar='PROFILE',
+                 help='JSON profile file, or the name of a built-in '
+                 'profile (%s).' % ', '.join(sorted(PROFILES)),
+                 default='business',
+                 )
+    p.add_option('-s', '--scale', dest='scale', type='float', default=1.0,
+                 help='Multiply the number of rows of each extent by SCALE.',
+                 )
+    p.add_option('--seed', dest='seed', type='int', default=None,
+                 help='Seed of the random number generator.',
+                 )
+    p.add_option('--batch-size', dest='batch_size', type='int', default=None,
+                 help='Number of creates executed in each transaction.',
+                 )
+    p.add_option('--schema', dest='schema', action='store_true',
+                 help='Print the generated schema and exit.',
+                 default=False,
+                 )
+    return p
+
+
+def load_profile(name):
+    """Return the built-in profile `name`, or the profile in the JSON
+    file `name`."""
+    if name in PROFILES:
+        return PROFILES[name]
+    f = open(name)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+def scale_profile(profile, scale):
+    """Return a copy of `profile` with the number of rows of each
+    extent multiplied by `scale`."""
+    profile = dict(profile)
+    extents = []
+    for spec in profile['extents']:
+        spec = dict(spec)
+        spec['rows'] = max(1, int(spec['rows'] * scale))
+        extents.append(spec)
+    profile['extents'] = extents
+    return profile
+
+
+def _prepare(profile):
+    """Return the extent specifications of `profile`, with hidden
+    extents and expensive field counts decided."""
+    rng = random.Random(profile.get('seed', 0))
+    extents = [dict(spec) for spec in profile['extents']]
+    # Hide the requested share of the extents that don't say whether
+    # they are hidden.
+    undecided = [spec for spec in extents if 'hidden' not in spec]
+    hidden = int(round(len(undecided) * profile.get('hidden_share', 0.0)))
+    for spec in undecided:
+        spec['hidden'] = False
+    for spec in rng.sample(undecided, hidden):
+        spec['hidden'] = True
+    share = profile.get('expensive_share', 0.0)
+    for spec in extents:
+        if 'expensive_fields' not in spec:
+            stored = len(spec['fields'])
+            if share < 1.0:
+                spec['expensive_fields'] = int(round(
+                    stored * share / (1.0 - share)))
+            else:
+                spec['expensive_fields'] = 0
+    return extents
+
+
+def schema_source(profile):
+    """Return the source of the schema described by `profile`."""
+    lines = [
+        'from schevo.schema import *',
+        'schevo.schema.prep(locals())',
+        ]
+    for spec in _prepare(profile):
+        lines.append('')
+        lines.append('')
+        lines.append('class %s(E.Entity):' % spec['name'])
+        lines.append('')
+        key = []
+        for field in spec['fields']:
+            name = field['name']
+            args = []
+            if field['type'] == 'entity':
+                args.append(repr(str(field['extent'])))
+            if field.get('share', 1.0) < 1.0:
+                args.append('required=False')
+            lines.append('    %s = %s(%s)' % (
+                name, FIELD_TYPES[field['type']], ', '.join(args)))
+            if field.get('key'):
+                key.append(name)
+        for index in xrange(spec['expensive_fields']):
+            lines.append('')
+            lines.append('    @f.integer(expensive=True)')
+            lines.append('    def expensive_%i(self):' % index)
+            lines.append('        return self.s.count()')
+        if spec['hidden']:
+            lines.append('')
+            lines.append('    _hidden = True')
+        if key:
+            lines.append('')
+            lines.append('    _key(%s)' % ', '.join(key))
+    return '\n'.join(lines) + '\n'
+
+
+def create_db(profile, filename=None, fp=None, label='', progress=None):
+    """Create a database from `profile` in the file `filename`, or in
+    the file object `fp`, and return it open.
+
+    `progress`, if given, is called with the extent name, the number
+    of rows created so far and the number to create, after each
+    batch.
+    """
+    import schevo.database
+    db = schevo.database.open(
+        filename=filename, fp=fp, schema_source=schema_source(profile),
+        label=label or 'Generated Database')
+    populate(db, profile, progress)
+    return db
+
+
+def populate(db, profile, progress=None):
+    """Create the rows described by `profile` in `db`."""
+    from schevo.transaction import Combination
+    rng = random.Random(profile.get('seed', 0))
+    batch_size = profile.get('batch_size', DEFAULT_BATCH_SIZE)
+    connection = db.connection
+    # Number of rows of each extent created so far; since each extent
+    # is new, its entities have the OIDs 1 to rows.
+    created = {}
+    for spec in profile['extents']:
+        name = spec['name']
+        rows = spec['rows']
+        create = db.extent(name).t.create
+        values = [(field['name'], _value_func(db, field, rows, created, rng))
+                  for field in spec['fields']]
+        batch = []
+        for n in xrange(rows):
+            kw = {}
+            for field_name, value in values:
+                kw[field_name] = value(n)
+            batch.append(create(**kw))
+            if len(batch) == batch_size or n == rows - 1:
+                db.execute(Combination(batch), bulk_mode=True)
+                batch = []
+                # Keep memory use bounded by the cache size.
+                connection.shrink_cache()
+                if progress is not None:
+                    progress(name, n + 1, rows)
+        created[name] = rows
+
+
+def _value_func(db, field, rows, created, rng):
+    """Return a function of the row number that returns the value of
+    `field` for that row."""
+    type = field['type']
+    share = field.get('share', 1.0)
+    if type == 'entity':
+        func = _entity_func(db, field, created, rng)
+    elif type in ('blob', 'image'):
+        func = _data_func(field)
+    elif type == 'boolean':
+        func = lambda n: rng.random() < 0.5
+    elif type == 'string':
+        func = _string_func(field, rng)
+    elif field.get('key'):
+        func = _unique_number_func(field)
+    else:
+        func = _number_func(field, rows, rng)
+    if share < 1.0:
+        def sometimes(n, func=func):
+            if rng.random() < share:
+                return func(n)
+            return UNASSIGNED
+        return sometimes
+    return func
+
+
+def _choose(distribution, size, n, rng, skew=3.0):
+    """Return an index from 0 to `size` - 1 for row `n`."""
+    if distribution == 'sequential':
+        return n % size
+    elif distribution == 'skewed':
+        return min(int(size * rng.random() ** skew), size - 1)
+    elif distribution == 'normal':
+        index = int(rng.normalvariate(size / 2.0, size / 6.0))
+        return min(max(index, 0), size - 1)
+    return rng.randrange(size)
+
+
+def _data_func(field):
+    size = field.get('size', 1000)
+    if field['type'] == 'image':
+        data = _png(size)
+    else:
+        data = os.urandom(size)
+    return lambda n: data
+
+
+def _entity_func(db, field, created, rng):
+    if field['extent'] not in created:
+        raise ValueError(
+            'Entity field %r refers to extent %r, which must be declared '
+            'before it.' % (field['name'], field['extent']))
+    extent = db.extent(field['extent'])
+    size = created[field['extent']]
+    fanout = field.get('fanout', 'uniform')
+    skew = field.get('skew', 3.0)
+    def entity(n):
+        return extent[_choose(fanout, size, n, rng, skew) + 1]
+    return entity
+
+
+def _number_func(field, rows, rng):
+    type = field['type']
+    distribution = field.get('distribution', 'uniform')
+    skew = field.get('skew', 3.0)
+    if type == 'date':
+        low = datetime.date(*field.get('min', (2000, 1, 1)))
+        high = datetime.date(*field.get('max', (2009, 12, 31)))
+        days = (high - low).days + 1
+        def date(n):
+            return low + datetime.timedelta(
+                _choose(distribution, days, n, rng, skew))
+        return date
+    low = field.get('min', 0)
+    high = field.get('max', rows)
+    span = high - low
+    if type == 'float':
+        def number(n):
+            if distribution == 'sequential':
+                return float(low + n)
+            elif distribution == 'skewed':
+                return low + span * rng.random() ** skew
+            elif distribution == 'normal':
+                value = rng.normalvariate(low + span / 2.0, span / 6.0)
+                return min(max(value, low), high)
+            return rng.uniform(low, high)
+        return number
+    def number(n):
+        return low + _choose(distribution, span + 1, n, rng, skew)
+    return number
+
+
+def _string_func(field, rng):
+    distribution = field.get('distribution', 'words')
+    if field.get('key') or distribution == 'unique':
+        prefix = field['name']
+        return lambda n: u'%s %08i' % (prefix, n)
+    elif distribution == 'choice':
+        choices = field['values']
+        return lambda n: choices[rng.randrange(len(choices))]
+    count = field.get('words', 3)
+    def words(n):
+        return u' '.join([rng.choice(WORDS) for i in xrange(count)])
+    return words
+
+
+def _unique_number_func(field):
+    low = field.get('min', 1)
+    if field['type'] == 'float':
+        return lambda n: float(low + n)
+    elif field['type'] == 'date':
+        low = datetime.date(*field.get('min', (2000, 1, 1)))
+        return lambda n: low + datetime.timedelta(n)
+    return lambda n: low + n
+
+
+def _png(size):
+    """Return a grey PNG image whose data is about `size` bytes."""
+    side = max(1, int(math.sqrt(size / 3.0)))
+    row = '\0' + '\x80' * (side * 3)
+    # Store without compression, so that the image has the requested
+    # size.
+    data = zlib.compress(row * side, 0)
+    def chunk(kind, body):
+        crc = zlib.crc32(kind + body) & 0xffffffff
+        return struct.pack('>I', len(body)) + kind + body + struct.pack(
+            '>I', crc)
+    header = struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0)
+    return ('\x89PNG\r\n\x1a\n' + chunk('IHDR', header)
+            + chunk('IDAT', data) + chunk('IEND', ''))
+
+
+class Generator(Command):
+
+    name = 'Database Generator'
+    description = 'Generate a synthetic database for load testing.'
+
+    def main(self, arg0, args):
+        print
+        print
+        parser = _parser()
+        options, args = parser.parse_args(list(args))
+        profile = scale_profile(load_profile(options.profile), options.scale)
+        if options.seed is not None:
+            profile['seed'] = options.seed
+        if options.batch_size is not None:
+            profile['batch_size'] = options.batch_size
+        if options.schema:
+            print schema_source(profile)
+            return
+        if len(args) != 1:
+            parser.error('Please specify DBFILE.')
+        db_filename = args[0]
+        if os.path.exists(db_filename):
+            print 'File %r already exists' % db_filename
+            return 1
+        total = sum(spec['rows'] for spec in profile['extents'])
+        print 'Generating %i rows in %s...' % (total, db_filename)
+        start = time.time()
+        def progress(name, done, rows):
+            sys.stdout.write('\r  %-24s %10i / %i' % (name, done, rows))
+            if done == rows:
+                sys.stdout.write('\n')
+            sys.stdout.flush()
+        db = create_db(profile, db_filename, progress=progress)
+        db.close()
+        print 'Generated in %.1f s.' % (time.time() - start)
+
+
+start = Generator
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
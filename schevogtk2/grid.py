@@ -5,14 +5,20 @@
 
 import gc
 import datetime
+from itertools import islice
 import sys
+import time
 from schevo.lib import optimize
 
+from schevo.constant import UNASSIGNED
 from schevo.error import EntityDoesNotExist
 
+import gobject
 import gtk
 from gtk import gdk
 
+from schevogtk2.cache import LRUCache
+from schevogtk2.idle import IdleTask
 from schevogtk2.utils import gproperty, gsignal, type_register
 
 
@@ -21,6 +27,7 @@ WATCH = gdk.Cursor(gdk.WATCH)
 OBJECT_COLUMN = 0
 COLOR_COLUMN = 1
 STRIKETHROUGH_COLUMN = 2
+VISIBLE_COLUMN = 3
 
 
 class Column(object):
@@ -30,6 +37,7 @@ class Column(object):
     visible = True
     width = None
 
+    _cell_data_funcs = ()
     _has_icon = False
     _style = gtk.Style()
 
@@ -54,18 +62,19 @@ class Column(object):
             self.cell_prop = 'active'
 
     def cell_data(self, column, cell, model, row_iter):
-        instance = model[row_iter][OBJECT_COLUMN]
-        color = model[row_iter][COLOR_COLUMN]
-        limits = self.grid.limit_row_background_color
+        grid = self.grid
+        limits = grid.limit_row_background_color
         if limits is not None and self.attribute in limits:
+            color = grid.row_color(model, row_iter)
             cell.set_property('cell-background', color)
-        strikethrough = model[row_iter][STRIKETHROUGH_COLUMN]
+        strikethrough = model.get_value(row_iter, STRIKETHROUGH_COLUMN)
         try:
             cell.set_property('strikethrough', strikethrough)
         except TypeError:
             # Cell does not have the 'strikethrough' property.
             pass
         try:
+            instance = grid.row_instance(model, row_iter)
             data = self.cell_data_getattr(instance, self.attribute)
         except EntityDoesNotExist:
             data = None
@@ -93,14 +102,15 @@ class Column(object):
     cell_data_getattr = staticmethod(getattr)
 
     def cell_icon(self, column, cell, model, row_iter):
-        instance = model[row_iter][OBJECT_COLUMN]
-        color = model[row_iter][COLOR_COLUMN]
-        limits = self.grid.limit_row_background_color
+        grid = self.grid
+        limits = grid.limit_row_background_color
         if limits is not None and self.attribute in limits:
+            color = grid.row_color(model, row_iter)
             cell.set_property('cell-background', color)
 
     def create_column(self, grid):
         self.is_row_strikethrough = grid.is_row_strikethrough
+        self._cell_data_funcs = []
         justify = self.justify
         if justify == gtk.JUSTIFY_LEFT:
             xalign = 0.0
@@ -123,31 +133,100 @@ class Column(object):
         if self.width is not None:
             column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
             column.set_fixed_width(self.width)
+        elif grid.fast_layout:
+            column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+            column.set_fixed_width(self.estimate_width(grid, []))
+        self.view_column = column
 ##         if self.searchable:
 ##             view.set_search_column(index)
 ##             view.set_search_equal_func(view_search_equal_func, column)
         return column
 
+    def estimate_width(self, grid, texts):
+        """Return the width in pixels needed to show the column's
+        title and `texts`, measured with the grid's Pango context."""
+        layout = grid._view.create_pango_layout(self.title)
+        # Leave room for the sort indicator in the header.
+        width = layout.get_pixel_size()[0] + 20
+        for text in texts:
+            layout.set_text(text)
+            width = max(width, layout.get_pixel_size()[0])
+        xpad = self.cell.get_property('xpad')
+        width += 2 * xpad + 8
+        if self._has_icon:
+            width += 20
+        return min(width, grid.fast_layout_max_width)
+
+    def export_value(self, instance):
+        """Return the value shown for `instance`, for exporting: numbers
+        and booleans as they are, None if there is no value, otherwise
+        the text shown."""
+        try:
+            data = self.export_getattr(instance, self.attribute)
+            if self.call:
+                data = data()
+        except EntityDoesNotExist:
+            return None
+        if data is None or data is UNASSIGNED:
+            return None
+        if isinstance(data, (bool, int, long, float)):
+            return data
+        return self.sample_text(instance)
+
+    export_getattr = staticmethod(getattr)
+
     @classmethod
     def get_style(cls):
         return cls._style
 
+    def sample_text(self, instance):
+        """Return the text shown for `instance`, or None if the column
+        does not show text."""
+        if self.cell_prop != 'text':
+            return None
+        try:
+            data = self.cell_data_getattr(instance, self.attribute)
+            if self.call:
+                data = data()
+            if data is None:
+                return u''
+            return unicode(data)
+        except EntityDoesNotExist:
+            return u''
+
+    def reset_cell_data_funcs(self):
+        """Set the cell data functions of the column's renderers again,
+        for instance after the grid's instrumentation is toggled."""
+        for column, cell, name in self._cell_data_funcs:
+            self._set_cell_data_func(column, cell, name, False)
+
     def _pack(self, column):
         """Pack one or more renderers into the column."""
         cell = self.cell
         column.pack_start(cell)
-        column.set_cell_data_func(cell, self.cell_data)
+        self._set_cell_data_func(column, cell, 'cell_data')
 
     def _pack_icon(self, column):
         """Pack one or more renderers into the column."""
         # Icon.
         cell = self.cell_pb = gtk.CellRendererPixbuf()
         column.pack_start(cell, False)
-        column.set_cell_data_func(cell, self.cell_icon)
+        self._set_cell_data_func(column, cell, 'cell_icon')
         # Standard renderer.
         cell = self.cell
         column.pack_start(cell)
-        column.set_cell_data_func(cell, self.cell_data)
+        self._set_cell_data_func(column, cell, 'cell_data')
+
+    def _set_cell_data_func(self, column, cell, name, remember=True):
+        """Use the method `name` as the cell data function of `cell`,
+        timed if the grid is instrumented."""
+        func = getattr(self, name)
+        stats = self.grid.stats
+        if stats is not None:
+            func = stats.timed(func, (self.title, name))
+        column.set_cell_data_func(cell, func)
+        if remember:
+            self._cell_data_funcs.append((column, cell, name))
 
 
 class Grid(gtk.VBox):
@@ -158,10 +237,38 @@ class Grid(gtk.VBox):
 
     gsignal('selection-changed', object)
 
+    # In multiple selection mode, emitted with the `GridSelection` once
+    # the main loop is idle after the selection changed, so that
+    # selecting many rows one by one emits it only once.
+    gsignal('selection-settled', object)
+
+    # Set to True to store rows compactly when the grid's contents
+    # allow it; see `set_compact`.
+    compact_rows = False
+
+    # Set to True to give all rows the same height and all columns a
+    # fixed width, estimated from a sample of rows during idle time,
+    # so that layout cost does not depend on the number of rows.  See
+    # `set_fast_layout`.
+    fast_layout = False
+    fast_layout_max_width = 300
+    fast_layout_sample = 200
+
+    # Maximum number of instances resolved from compact rows to keep
+    # in memory.
+    compact_cache_size = 2000
+
     limit_row_background_color = None
 
+    # Number of rows whose styles are computed by each call to
+    # `row_styles`.
+    row_styles_chunk_size = 500
+
     search_equal_func = None
 
+    # `GridStats` collected while the grid is instrumented.
+    stats = None
+
     def __init__(self, columns=[]):
         gtk.VBox.__init__(self)
         self.props.spacing = 5
@@ -184,11 +291,20 @@ class Grid(gtk.VBox):
         self.pack_start(scrolled)
         self._bindings = {}
         self._columns = []
+        self._compact = False
+        self._compiled_filter = None
+        self._row_types = set()
         self._filter = None
+        self._filter_by_column = False
+        self._instance_cache = LRUCache(self.compact_cache_size)
+        self._layout_task = None
+        self._palette = [None]
+        self._palette_map = {None: 0}
         self._sorter = None
         self._row_map = {}
         self._row_popup_menu = None
-        self._model = model = gtk.ListStore(object, object, object)
+        self._search = None
+        self._model = model = self.new_model()
         model.set_default_sort_func(model_default_sort)
         self._view = view = gtk.TreeView(model)
         view.connect(
@@ -203,20 +319,52 @@ class Grid(gtk.VBox):
         view.show()
         scrolled.add(view)
         self.set_columns(columns)
+        from schevogtk2.selection import GridSelection
+        self._selection = GridSelection(self)
+        self._selection_settled_id = None
         selection = view.get_selection()
         selection.connect('changed', self._on_selection__changed)
         self.set_selection_mode(gtk.SELECTION_BROWSE)
 
     def add_row(self, instance):
-        color = self.row_background_color(instance)
-        strikethrough = self.is_row_strikethrough(instance)
-        row_iter = self._model.append((instance, color, strikethrough))
-        return row_iter
+        return Grid.add_rows(self, [instance])[0]
+
+    def add_rows(self, instances):
+        """Append rows for `instances`, computing their styles in one
+        call to `row_styles`, and return their iters."""
+        instances = list(instances)
+        append = self._model.append
+        model_row = self.model_row
+        styles = self._row_styles_func()(instances)
+        flags = self._visibility(instances)
+        if self._row_types is not None:
+            self._row_types.update(map(type, instances))
+        row_iters = [append(model_row(instance, color, strikethrough,
+                                      visible=visible))
+                     for instance, (color, strikethrough), visible
+                     in zip(instances, styles, flags)]
+        if self._search is not None:
+            identify = self.identify
+            self._search.rows_added([identify(instance)
+                                     for instance in instances])
+        return row_iters
 
     def clear(self):
         """Removes all the instances of the list"""
         self._model.clear()
         self._row_map.clear()
+        self._instance_cache.clear()
+        self._row_types = set()
+        self._selection.rows_changed()
+        if self._compiled_filter is not None:
+            self._compiled_filter.invalidate()
+
+    def filter_stats(self):
+        """Return the evaluation timings of the grid's filter
+        predicate, or None if it has none."""
+        if self._compiled_filter is None:
+            return None
+        return self._compiled_filter.stats()
 
     def get_selected(self):
         """If in multiple selection mode, return a list of the
@@ -226,38 +374,202 @@ class Grid(gtk.VBox):
         if selection.get_mode() != gtk.SELECTION_MULTIPLE:
             model, row_iter = selection.get_selected()
             if row_iter:
-                return model[row_iter][OBJECT_COLUMN]
+                return self.row_instance(model, row_iter)
         else:
-            selection = self._view.get_selection()
-            model, rows = selection.get_selected_rows()
-            return [model[row][OBJECT_COLUMN] for row in rows]
+            return list(self._selection)
+
+    def _single_selected(self):
+        """Return the selected instance if exactly one is selected,
+        else None."""
+        if self.get_selection_mode() != gtk.SELECTION_MULTIPLE:
+            return self.get_selected()
+        selection = self._selection
+        if len(selection) == 1:
+            return selection.first()
+        return None
 
     def is_row_strikethrough(self, instance):
         return False
 
-    def redraw(self):
-        """Resets color and strikethrough values."""
+    def model_row(self, instance, color, strikethrough, compact=None,
+                  visible=True):
+        """Return the model row for `instance`, in compact form if
+        `compact` is true or, by default, if the grid is compact."""
+        if compact is None:
+            compact = self._compact
+        if compact:
+            return (self.identify(instance), self.palette_index(color),
+                    bool(strikethrough), visible)
+        return (instance, color, strikethrough, visible)
+
+    def new_model(self, compact=None):
+        """Return a new, empty model suitable for holding this grid's
+        rows, in compact form if `compact` is true or, by default, if
+        the grid is compact."""
+        if compact is None:
+            compact = self._compact
+        if compact:
+            return gtk.ListStore(long, int, bool, bool)
+        return gtk.ListStore(object, object, object, bool)
+
+    def palette_index(self, color):
+        """Return the index of `color` in the palette of colors used
+        by compact rows, adding it if needed."""
+        index = self._palette_map.get(color)
+        if index is None:
+            index = self._palette_map[color] = len(self._palette)
+            self._palette.append(color)
+        return index
+
+    def redraw(self, identities=None):
+        """Resets color and strikethrough values.
+
+        If `identities` is given, only the rows of the instances with
+        those identities are restyled."""
         model = self._model
-        for row in model:
-            instance = row[OBJECT_COLUMN]
-            try:
-                color = self.row_background_color(instance)
-            except EntityDoesNotExist:
-                color = None
-            row[COLOR_COLUMN] = color
-            try:
-                strikethrough = self.is_row_strikethrough(instance)
-            except EntityDoesNotExist:
-                strikethrough = False
-            row[STRIKETHROUGH_COLUMN] = strikethrough
+        row_styles = self._row_styles_func()
+        compact = self._compact
+        palette_index = self.palette_index
+        for chunk, instances in self._row_chunks(self._row_iters(identities)):
+            styles = row_styles(instances)
+            for row_iter, (color, strikethrough) in zip(chunk, styles):
+                if compact:
+                    color = palette_index(color)
+                model.set(row_iter, COLOR_COLUMN, color,
+                          STRIKETHROUGH_COLUMN, bool(strikethrough))
 
     def refilter(self):
-        if self._filter is not None:
+        """Re-evaluate the visibility of all rows."""
+        if self._compiled_filter is not None:
+            self._compiled_filter.invalidate()
+            self._apply_filter(self._row_iters())
+        elif self._filter is not None:
             self._filter.refilter()
 
+    def refilter_rows(self, identities):
+        """Re-evaluate the filter predicate for the rows of the
+        instances with `identities`, after those instances changed."""
+        compiled_filter = self._compiled_filter
+        if compiled_filter is None:
+            return
+        identities = list(identities)
+        compiled_filter.invalidate(identities)
+        self._apply_filter(self._row_iters(identities))
+
+    def resolve(self, identity):
+        """Return the instance with `identity`, as stored in compact
+        rows.  Grids that support compact rows override this."""
+        raise NotImplementedError()
+
     def row_background_color(self, instance):
         return None
 
+    def row_color(self, model, row_iter):
+        """Return the background color of the row at `row_iter` in
+        `model`."""
+        color = model.get_value(row_iter, COLOR_COLUMN)
+        if self._compact:
+            color = self._palette[color]
+        return color
+
+    def row_instance(self, model, row_iter):
+        """Return the instance shown by the row at `row_iter` in
+        `model`, resolving it if the grid is compact."""
+        value = model.get_value(row_iter, OBJECT_COLUMN)
+        if self._compact:
+            cache = self._instance_cache
+            instance = cache.get(value)
+            if instance is None:
+                instance = cache[value] = self.resolve(value)
+            return instance
+        return value
+
+    def _row_chunks(self, row_iters):
+        """Yield `(row iters, instances)` pairs for chunks of
+        `row_iters`.  Instances that no longer exist are None."""
+        model = self._model
+        row_instance = self.row_instance
+        chunk_size = self.row_styles_chunk_size
+        while True:
+            chunk = list(islice(row_iters, chunk_size))
+            if not chunk:
+                break
+            instances = []
+            for row_iter in chunk:
+                try:
+                    instances.append(row_instance(model, row_iter))
+                except EntityDoesNotExist:
+                    instances.append(None)
+            yield chunk, instances
+
+    def _row_iters(self, identities=None):
+        """Return an iterator over the row iters of the instances with
+        `identities`, or of all rows."""
+        if identities is None:
+            return (row.iter for row in self._model)
+        row_map = self._row_map
+        return (row_map[identity] for identity in identities
+                if identity in row_map)
+
+    def row_styles(self, instances):
+        """Return a list of `(color, strikethrough)` pairs, one for
+        each of `instances`.
+
+        By default, `row_background_color` and `is_row_strikethrough`
+        are called for each instance.  Override this to compute the
+        styles of a chunk of rows at once, such as with a single pass
+        over an index.  Instances that no longer exist may be None."""
+        row_background_color, is_row_strikethrough = self._row_style_funcs()
+        styles = []
+        append = styles.append
+        for instance in instances:
+            if instance is None:
+                append((None, False))
+                continue
+            try:
+                color = row_background_color(instance)
+            except EntityDoesNotExist:
+                color = None
+            try:
+                strikethrough = is_row_strikethrough(instance)
+            except EntityDoesNotExist:
+                strikethrough = False
+            append((color, strikethrough))
+        return styles
+
+    def _row_styles_func(self):
+        """Return the `row_styles` method, timed if the grid is
+        instrumented."""
+        row_styles = self.row_styles
+        stats = self.stats
+        if stats is not None:
+            row_styles = stats.timed_row_style(row_styles)
+        return row_styles
+
+    def _row_style_funcs(self):
+        """Return the `row_background_color` and `is_row_strikethrough`
+        methods, timed if the grid is instrumented."""
+        row_background_color = self.row_background_color
+        is_row_strikethrough = self.is_row_strikethrough
+        stats = self.stats
+        if stats is not None:
+            row_background_color = stats.timed_row_style(row_background_color)
+            is_row_strikethrough = stats.timed_row_style(is_row_strikethrough)
+        return row_background_color, is_row_strikethrough
+
+    def row_types(self):
+        """Return the set of types of the instances that have been
+        added to the grid since it was last cleared, or None if
+        unknown.  A set of one type means that all rows are of that
+        type."""
+        return self._row_types
+
+    def selection(self):
+        """Return the `GridSelection` of the grid, a lazy view of its
+        selected rows that is cheaper than `get_selected` in multiple
+        selection mode."""
+        return self._selection
+
     def select(self, instance, scroll=True):
         model = self._model
         view = self._view
@@ -270,25 +582,153 @@ class Grid(gtk.VBox):
                 self.select_and_focus_row(row_iter)
 ##                 view.scroll_to_cell(model[row_iter].path, None, True, 0.5, 0)
 
+    def grab_focus(self):
+        self._view.grab_focus()
+
     def select_and_focus_row(self, row_iter):
         self._view.set_cursor(self._model[row_iter].path)
 
+    def set_compact(self, compact):
+        """Store rows compactly if `compact` is true, replacing the
+        grid's model with an empty one if the storage changes.
+
+        Compact rows hold only the identity of each instance, an index
+        into a palette of background colors, and the strikethrough
+        flag.  Instances are resolved from identities with `resolve`
+        when needed, and only the most recently used are kept, so that
+        large grids don't keep every instance in memory.
+
+        Filtered grids are never compact, since the filter wraps the
+        grid's original model; for them, this does nothing.  See
+        `set_filter`."""
+        compact = bool(compact)
+        if compact == self._compact or self._filter is not None:
+            return
+        view = self._view
+        view.set_model(None)
+        self._row_map.clear()
+        self._instance_cache.clear()
+        self._compact = compact
+        model = self._model = self.new_model()
+        model.set_default_sort_func(model_default_sort)
+        view.set_model(model)
+        self._row_types = set()
+        self._selection.rows_changed()
+        if self._search is not None:
+            self._search.invalidate()
+
+    def view_path(self, identity):
+        """Return the path in the grid's view of the row of the
+        instance with `identity`, or None if it is not shown."""
+        row_iter = self._row_map.get(identity)
+        models = self._view_models()
+        if row_iter is None or models is None:
+            return None
+        path = self._model.get_path(row_iter)
+        for model in models:
+            path = model.convert_child_path_to_path(path)
+            if path is None:
+                # Hidden by a filter.
+                return None
+        return path
+
+    def _view_models(self):
+        """Return the models that wrap the grid's rows in its view,
+        such as a filter and a sorter, innermost first.  Return None
+        if the view does not show the grid's rows."""
+        model = self._model
+        models = []
+        child = self._view.get_model()
+        while child is not model:
+            if child is None:
+                return None
+            models.append(child)
+            child = child.get_model()
+        models.reverse()
+        return models
+
+    def set_filter(self, predicate):
+        """Show only the rows whose instances match `predicate`, a
+        `schevogtk2.predicate.Predicate`, or all rows if it is None.
+
+        The predicate is compiled once, and each row's visibility is
+        stored in the model, so the filter model reads a column rather
+        than calling back into Python for every row.  Rows are
+        evaluated when added, and again after `refilter_rows` or
+        `refilter`; the attribute values the predicate reads are cached
+        per row until then.  See `filter_stats` for timings.
+
+        Replaces any function given to `set_visible_func`.  A compact
+        grid stores its rows in full from then on."""
+        from schevogtk2.predicate import CompiledFilter
+        if self._compact:
+            self._expand_rows()
+        view = self._view
+        view.freeze_notify()
+        view.set_model(None)
+        if not self._filter_by_column:
+            self._filter = self._model.filter_new()
+            self._filter.set_visible_column(VISIBLE_COLUMN)
+            self._filter_by_column = True
+            self._sorter = gtk.TreeModelSort(self._filter)
+            self._set_sort_funcs()
+        if predicate is None:
+            self._compiled_filter = None
+        else:
+            self._compiled_filter = CompiledFilter(predicate)
+        self._apply_filter(self._row_iters())
+        view.set_model(self._sorter)
+        view.thaw_notify()
+
+    def _expand_rows(self):
+        """Store the rows of a compact grid in full."""
+        resolve = self.resolve
+        instances = []
+        for row in self._model:
+            try:
+                instances.append(resolve(row[OBJECT_COLUMN]))
+            except EntityDoesNotExist:
+                pass
+        self.set_compact(False)
+        self.set_rows(instances)
+
+    def _apply_filter(self, row_iters):
+        model = self._model
+        get_value = model.get_value
+        set_value = model.set_value
+        for chunk, instances in self._row_chunks(row_iters):
+            for row_iter, visible in zip(chunk, self._visibility(instances)):
+                # Only touch rows whose visibility changed, since each
+                # change is propagated through the filter and sorter.
+                if get_value(row_iter, VISIBLE_COLUMN) != visible:
+                    set_value(row_iter, VISIBLE_COLUMN, visible)
+
+    def _visibility(self, instances):
+        """Return the visibility of each of `instances` under the
+        grid's filter predicate."""
+        compiled_filter = self._compiled_filter
+        if compiled_filter is None:
+            return [True] * len(instances)
+        identify = self.identify
+        rows = []
+        for instance in instances:
+            if instance is None:
+                rows.append((None, None))
+            else:
+                rows.append((identify(instance), instance))
+        return compiled_filter.evaluate(rows)
+
     def set_columns(self, columns, spacer=True):
         # Reset sorting back to the default.
         self._model.set_sort_column_id(-1, gtk.SORT_ASCENDING)
-        # Use a sort model if one was defined.
-        if self._sorter is not None:
-            model = self._sorter
-        else:
-            model = self._model
         view = self._view
         # Remove any existing columns.
         for column in view.get_columns():
             view.remove_column(column)
         # Create new columns.
         self._columns = columns
+        self._set_sort_funcs()
         for index, column in enumerate(columns):
-            model.set_sort_func(index, model_sort, (column, column.attribute))
             view_column = column.create_column(self)
             view_column.set_sort_column_id(index)
             view.append_column(view_column)
@@ -298,6 +738,99 @@ class Grid(gtk.VBox):
             view_column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
             view_column.set_fixed_width(1)
             view.append_column(view_column)
+        if self.fast_layout:
+            # All columns have fixed sizing, so every row may be given
+            # the height of the first.
+            view.set_fixed_height_mode(True)
+            self._schedule_layout()
+        if self._search is not None:
+            self._search.invalidate()
+
+    def set_fast_layout(self, fast_layout):
+        """Turn fast layout mode on or off for the current and future
+        columns."""
+        fast_layout = bool(fast_layout)
+        if fast_layout == self.fast_layout:
+            return
+        self.fast_layout = fast_layout
+        view = self._view
+        if not fast_layout:
+            self._cancel_layout()
+            view.set_fixed_height_mode(False)
+        for column in self._columns:
+            if column.width is None:
+                view_column = column.view_column
+                if fast_layout:
+                    width = max(view_column.get_width(), 1)
+                    view_column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+                    view_column.set_fixed_width(width)
+                else:
+                    view_column.set_sizing(gtk.TREE_VIEW_COLUMN_GROW_ONLY)
+        if fast_layout:
+            view.set_fixed_height_mode(True)
+            self._schedule_layout()
+
+    def _cancel_layout(self):
+        if self._layout_task is not None:
+            self._layout_task.cancel()
+            self._layout_task = None
+
+    def _layout(self):
+        """Estimate column widths from a sample of rows, then apply
+        them, as a generator for `IdleTask`."""
+        model = self._model
+        count = len(model)
+        columns = [column for column in self._columns
+                   if column.width is None and column.cell_prop == 'text']
+        texts = dict((column, []) for column in columns)
+        if count:
+            step = max(count // self.fast_layout_sample, 1)
+            for index in xrange(0, count, step):
+                if index >= len(model):
+                    # Rows were removed meanwhile.
+                    break
+                try:
+                    instance = self.row_instance(model, model.get_iter(index))
+                except EntityDoesNotExist:
+                    continue
+                for column in columns:
+                    texts[column].append(column.sample_text(instance))
+                yield
+        for column in columns:
+            width = column.estimate_width(self, texts[column])
+            column.view_column.set_fixed_width(width)
+        self._layout_task = None
+
+    def _schedule_layout(self):
+        self._cancel_layout()
+        if self.fast_layout and self._columns:
+            self._layout_task = IdleTask(self._layout()).start()
+
+    def set_instrumented(self, instrumented):
+        """Start or stop collecting `GridStats` in `stats`."""
+        if instrumented == (self.stats is not None):
+            return
+        if instrumented:
+            from schevogtk2.instrument import GridStats
+            self.stats = GridStats(self.__class__.__name__)
+        else:
+            self.stats = None
+        for column in self._columns:
+            column.reset_cell_data_funcs()
+        self._set_sort_funcs()
+        self._view.queue_draw()
+
+    def _set_sort_funcs(self):
+        if self._sorter is not None:
+            model = self._sorter
+        else:
+            model = self._model
+        stats = self.stats
+        for index, column in enumerate(self._columns):
+            func = model_sort
+            if stats is not None:
+                func = stats.sort_func(func, column.title)
+            model.set_sort_func(index, func, (column, column.attribute))
 
     def set_cursor(self, cursor=None):
         window = self.window
@@ -323,20 +856,95 @@ class Grid(gtk.VBox):
         identify = self.identify
         row_map = self._row_map
         insert = model.insert
+        row_styles = self._row_styles_func()
+        compact = self._compact
+        palette_index = self.palette_index
+        chunk_size = self.row_styles_chunk_size
+        visibility = self._visibility
+        row_types = self._row_types
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+        instances = iter(instances)
         n = 0
-        for instance in instances:
-            inst_id = identify(instance)
-            color = self.row_background_color(instance)
-            strikethrough = self.is_row_strikethrough(instance)
-            row_iter = insert(n, (instance, color, strikethrough))
-            row_map[inst_id] = row_iter
-            n += 1
+        while True:
+            chunk = list(islice(instances, chunk_size))
+            if not chunk:
+                break
+            styles = row_styles(chunk)
+            flags = visibility(chunk)
+            row_types.update(map(type, chunk))
+            for instance, (color, strikethrough), visible in zip(
+                chunk, styles, flags):
+                inst_id = identify(instance)
+                if compact:
+                    row = (inst_id, palette_index(color), bool(strikethrough),
+                           visible)
+                else:
+                    row = (instance, color, strikethrough, visible)
+                row_iter = insert(n, row)
+                row_map[inst_id] = row_iter
+                n += 1
+        if stats is not None:
+            stats.add_population(n, time.time() - start)
         if self._sorter is not None:
             view.set_model(self._sorter)
         else:
             view.set_model(model)
         view.thaw_notify()
         self.set_cursor()
+        self._schedule_layout()
+        if self._search is not None:
+            self._search.invalidate()
+
+    def set_model_rows(self, model, row_map):
+        """Replace the grid's rows with those of `model`, built
+        elsewhere with `new_model`, and its identity-to-iter `row_map`.
+        The model must use the grid's current row storage.
+
+        Only grids without a filter may adopt another model, since the
+        filter wraps the grid's original model."""
+        if self._filter is not None:
+            raise ValueError('Cannot replace the model of a filtered grid.')
+        view = self._view
+        view.freeze_notify()
+        view.set_model(None)
+        self.unselect_all()
+        model.set_default_sort_func(model_default_sort)
+        self._instance_cache.clear()
+        self._model = model
+        self._row_map = row_map
+        # The types of the adopted rows are unknown.
+        self._row_types = None
+        self._selection.rows_changed()
+        view.set_model(model)
+        view.thaw_notify()
+        self._schedule_layout()
+        if self._search is not None:
+            self._search.invalidate()
+
+    def set_search_indexed(self, indexed):
+        """Turn indexed find-as-you-type on or off.
+
+        When on, typing in the grid or pressing Ctrl+F opens the find
+        bar, which jumps between rows matching the typed words using a
+        `schevogtk2.gridsearch.SearchIndex` instead of GTK's
+        interactive search."""
+        if indexed == (self._search is not None):
+            return
+        view = self._view
+        if indexed:
+            from schevogtk2.gridsearch import GridSearch
+            self._search = GridSearch(self)
+            view.props.enable_search = False
+            self._search_signal_id = view.connect(
+                'start-interactive-search',
+                self._on_view__start_interactive_search)
+        else:
+            self._search.destroy()
+            self._search = None
+            view.disconnect(self._search_signal_id)
+            self._find_entry_box.hide()
 
     def set_search_equal_func(self, search_equal_func):
         view = self._view
@@ -356,6 +964,8 @@ class Grid(gtk.VBox):
         self._view.get_selection().set_mode(mode)
 
     def set_visible_func(self, func, data=None):
+        self._compiled_filter = None
+        self._filter_by_column = False
         self._filter = self._model.filter_new()
         if data is None:
             self._filter.set_visible_func(func)
@@ -377,16 +987,37 @@ class Grid(gtk.VBox):
         if binding in self._bindings:
             func = self._bindings[binding]
             func()
+        elif (self._search is not None
+              and not mask & (gdk.CONTROL_MASK | gdk.MOD1_MASK)
+              ):
+            # Start finding with the typed character.
+            char = gdk.keyval_to_unicode(keyval)
+            if char and not unichr(char).isspace():
+                self._search.open(unichr(char))
+                return True
 
     def _after_view__row_activated(self, view, path, column):
-        row = self._model[path]
-        item = row[OBJECT_COLUMN]
+        model = self._model
+        item = self.row_instance(model, model.get_iter(path))
         self.emit('row-activated', item)
 
     def _on_selection__changed(self, selection):
-        """Transform selection::changed into selection-changed."""
+        """Transform selection::changed into selection-changed, and in
+        multiple selection mode, selection-settled."""
+        self._selection.changed()
         item = self.get_selected()
         self.emit('selection-changed', item)
+        if (selection.get_mode() == gtk.SELECTION_MULTIPLE
+            and self._selection_settled_id is None
+            ):
+            self._selection_settled_id = gobject.idle_add(
+                self._emit_selection_settled,
+                priority=gobject.PRIORITY_HIGH_IDLE)
+
+    def _emit_selection_settled(self):
+        self._selection_settled_id = None
+        self.emit('selection-settled', self._selection)
+        return False
 
     def _on_view__button_press_event(self, view, event):
         if self.get_selection_mode() == gtk.SELECTION_MULTIPLE:
@@ -403,9 +1034,8 @@ class Grid(gtk.VBox):
                 path = view.get_path_at_pos(int(x), int(y))
                 if path is not None:
                     path, col, cell_x, cell_y = path
-                    row = self._model[path]
-                    item = row[OBJECT_COLUMN]
-                    cursor_over_selected_item = item in self.get_selected()
+                    selection = view.get_selection()
+                    cursor_over_selected_item = selection.path_is_selected(path)
                     return cursor_over_selected_item
                 else:
                     # Not over any row; allow event to propagate.
@@ -413,27 +1043,20 @@ class Grid(gtk.VBox):
 
     def _on_view__button_release_event(self, view, event):
         if event.button == 3 and self._row_popup_menu is not None:
-            instance = self.get_selected()
-            if isinstance(instance, list):
-                if len(instance) == 1:
-                    instance = instance[0]
-                else:
-                    instance = None
+            instance = self._single_selected()
             self._row_popup_menu.popup(event, instance)
 
     def _on_view__popup_menu(self, view):
         if self._row_popup_menu is not None:
             event = None
-            instance = self.get_selected()
-            if isinstance(instance, list):
-                if len(instance) == 1:
-                    instance = instance[0]
-                else:
-                    instance = None
+            instance = self._single_selected()
             self._row_popup_menu.popup(event, instance)
             return True
 
     def _on_view__start_interactive_search(self, view):
+        if self._search is not None:
+            self._search.open()
+            return True
         self._find_entry.show()
         self._find_entry.grab_focus()
 
@@ -467,13 +1090,16 @@ class PopupMenu(gtk.Menu):
 
 
 def model_default_sort(model, row_iter1, row_iter2):
-    instance1 = model[row_iter1][OBJECT_COLUMN]
-    instance2 = model[row_iter2][OBJECT_COLUMN]
+    # Compact rows hold identities, which sort the same way as the
+    # instances of a single extent.
+    instance1 = model.get_value(row_iter1, OBJECT_COLUMN)
+    instance2 = model.get_value(row_iter2, OBJECT_COLUMN)
     return cmp(instance1, instance2)
 
 def model_sort(model, row_iter1, row_iter2, (column, attr_name)):
-    instance1 = model[row_iter1][OBJECT_COLUMN]
-    instance2 = model[row_iter2][OBJECT_COLUMN]
+    row_instance = column.grid.row_instance
+    instance1 = row_instance(model, row_iter1)
+    instance2 = row_instance(model, row_iter2)
     get_attribute = column.get_attribute
     attr1 = get_attribute(instance1, attr_name)
     attr2 = get_attribute(instance2, attr_name)
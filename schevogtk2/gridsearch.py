@@ -0,0 +1,492 @@
+"""Indexed find-as-you-type for grids.
+
+Turn it on for a grid with `Grid.set_search_indexed(True)`.  When the
+grid's find bar opens, a casefolded token index of the text shown in
+the grid's visible columns is built during idle time.  Each word typed
+then matches the rows that have a token starting with that word, found
+by bisecting the sorted tokens rather than by testing each row.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from bisect import bisect_left
+import re
+import time
+
+from schevo.error import EntityDoesNotExist
+
+import gtk
+
+from schevogtk2.grid import OBJECT_COLUMN
+from schevogtk2.idle import IdleTask
+
+
+_words = re.compile(r'\w+', re.UNICODE).findall
+
+
+def tokenize(text):
+    """Return the casefolded words of `text`."""
+    return _words(text.lower())
+
+
+class SearchIndex(object):
+    """Token index of the text shown in the visible text columns of
+    `grid`, by row identity.
+
+    - `ready`: True once the index has been built.
+
+    - `seconds`: Time spent building the index.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.ready = False
+        self.seconds = 0.0
+        self._postings = {}
+        self._row_tokens = {}
+        self._task = None
+        self._tokens = None
+
+    @property
+    def building(self):
+        return self._task is not None
+
+    def add(self, identities):
+        """Index the rows of the instances with `identities`, replacing
+        any tokens they had."""
+        grid = self.grid
+        model = grid._model
+        row_map = grid._row_map
+        columns = self._columns()
+        for identity in identities:
+            self.remove([identity])
+            row_iter = row_map.get(identity)
+            if row_iter is None:
+                continue
+            try:
+                instance = grid.row_instance(model, row_iter)
+            except EntityDoesNotExist:
+                continue
+            self._add(identity, instance, columns)
+
+    def build(self, done_cb=None):
+        """Start building the index during idle time.  `done_cb` is
+        called once it is ready."""
+        self.clear()
+        self._task = IdleTask(self._build(done_cb)).start()
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def clear(self):
+        self.cancel()
+        self.ready = False
+        self.seconds = 0.0
+        self._postings.clear()
+        self._row_tokens.clear()
+        self._tokens = None
+
+    def match(self, query):
+        """Return the set of identities of the rows that have, for each
+        word of `query`, a token starting with that word."""
+        words = tokenize(query)
+        if not words:
+            return set()
+        tokens = self._tokens
+        if tokens is None:
+            tokens = self._tokens = sorted(self._postings)
+        postings = self._postings
+        # Longest words first, since they usually match fewest rows.
+        words.sort(key=len, reverse=True)
+        result = None
+        for word in words:
+            matches = set()
+            index = bisect_left(tokens, word)
+            while index < len(tokens) and tokens[index].startswith(word):
+                matches.update(postings[tokens[index]])
+                index += 1
+            if result is None:
+                result = matches
+            else:
+                result &= matches
+            if not result:
+                break
+        return result
+
+    def refine(self, matches, query):
+        """Return the subset of `matches` that also match `query`,
+        checking each row's own tokens.  Cheaper than `match` when a
+        query was extended and the previous matches are few."""
+        words = tokenize(query)
+        row_tokens = self._row_tokens
+        result = set()
+        for identity in matches:
+            tokens = row_tokens.get(identity, ())
+            for word in words:
+                for token in tokens:
+                    if token.startswith(word):
+                        break
+                else:
+                    break
+            else:
+                result.add(identity)
+        return result
+
+    def remove(self, identities):
+        postings = self._postings
+        row_tokens = self._row_tokens
+        for identity in identities:
+            for token in row_tokens.pop(identity, ()):
+                posting = postings.get(token)
+                if posting is not None:
+                    posting.discard(identity)
+                    if not posting:
+                        del postings[token]
+                        self._tokens = None
+
+    def _add(self, identity, instance, columns):
+        tokens = set()
+        for column in columns:
+            text = column.sample_text(instance)
+            if text:
+                tokens.update(tokenize(text))
+        postings = self._postings
+        for token in tokens:
+            posting = postings.get(token)
+            if posting is None:
+                posting = postings[token] = set()
+                self._tokens = None
+            posting.add(identity)
+        self._row_tokens[identity] = tuple(tokens)
+
+    def _build(self, done_cb):
+        grid = self.grid
+        model = grid._model
+        row_map = grid._row_map
+        row_instance = grid.row_instance
+        columns = self._columns()
+        mark = time.time()
+        for identity in row_map.keys():
+            # Rows may be removed while the index is being built.
+            row_iter = row_map.get(identity)
+            if row_iter is not None:
+                try:
+                    instance = row_instance(model, row_iter)
+                except EntityDoesNotExist:
+                    pass
+                else:
+                    self._add(identity, instance, columns)
+            now = time.time()
+            self.seconds += now - mark
+            yield
+            mark = time.time()
+        self._tokens = sorted(self._postings)
+        self.ready = True
+        self._task = None
+        if done_cb is not None:
+            done_cb()
+
+    def _columns(self):
+        return [column for column in self.grid._columns
+                if column.cell_prop == 'text'
+                and column.view_column.get_visible()]
+
+
+class GridSearch(object):
+    """Find bar of `grid`, backed by a `SearchIndex`.
+
+    The positions of matches in the grid's view are computed for at
+    most `max_ranked` matches.  With more matches than that, the next
+    or previous match is found by scanning the view from the cursor,
+    which is quick because such matches are dense.
+    """
+
+    max_ranked = 5000
+
+    # Number of matches below which an extended query is checked
+    # against the previous matches rather than looked up again.
+    max_refined = 1000
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.index = SearchIndex(grid)
+        self.matches = set()
+        self.query = u''
+        self._positions = None
+        self._current = None
+        box = grid._find_entry_box
+        entry = self._entry = grid._find_entry
+        label = self._label = gtk.Label()
+        box.pack_start(label, expand=False)
+        previous = gtk.Button()
+        previous.add(gtk.Arrow(gtk.ARROW_UP, gtk.SHADOW_NONE))
+        previous.set_relief(gtk.RELIEF_NONE)
+        previous.connect('clicked', lambda button: self.previous())
+        box.pack_start(previous, expand=False)
+        next = gtk.Button()
+        next.add(gtk.Arrow(gtk.ARROW_DOWN, gtk.SHADOW_NONE))
+        next.set_relief(gtk.RELIEF_NONE)
+        next.connect('clicked', lambda button: self.next())
+        box.pack_start(next, expand=False)
+        self._widgets = [label, previous, next]
+        self._signals = [
+            entry.connect('changed', self._on_entry__changed),
+            entry.connect('key-press-event', self._on_entry__key_press_event),
+            ]
+        self._set_bindings()
+
+    def close(self):
+        """Hide the find bar and return focus to the grid."""
+        self.grid._find_entry_box.hide()
+        self.grid._view.grab_focus()
+
+    def destroy(self):
+        """Remove the find bar's widgets and stop indexing."""
+        self.index.clear()
+        for widget in self._widgets:
+            widget.destroy()
+        for signal_id in self._signals:
+            self._entry.disconnect(signal_id)
+
+    def invalidate(self):
+        """Discard the index after the grid's rows or columns were
+        replaced.  It is rebuilt if the find bar is open."""
+        self.index.clear()
+        self.matches = set()
+        self._positions = None
+        if self.grid._find_entry_box.get_property('visible'):
+            self._build()
+
+    def next(self):
+        self._step(1)
+
+    def open(self, text=None):
+        """Show the find bar, optionally starting the query with
+        `text`."""
+        box = self.grid._find_entry_box
+        box.show_all()
+        entry = self._entry
+        entry.grab_focus()
+        if text is not None:
+            entry.set_text(text)
+            entry.set_position(-1)
+        if not self.index.ready and not self.index.building:
+            self._build()
+
+    def previous(self):
+        self._step(-1)
+
+    def rows_added(self, identities):
+        if self.index.ready:
+            self.index.add(identities)
+            self._rematch()
+
+    def rows_changed(self, identities):
+        if self.index.ready:
+            self.index.add(identities)
+            self._rematch()
+
+    def rows_removed(self, identities):
+        if self.index.ready:
+            self.index.remove(identities)
+            self.matches.difference_update(identities)
+            self._positions = None
+
+    def search(self, query, jump=True):
+        """Find the rows matching `query` and, if `jump` is true, move
+        the cursor to the first one at or after it."""
+        index = self.index
+        previous_query = self.query
+        self.query = query
+        if not index.ready:
+            self._update_label()
+            return
+        if (previous_query
+            and query.startswith(previous_query)
+            and 0 < len(self.matches) <= self.max_refined
+            ):
+            self.matches = index.refine(self.matches, query)
+        else:
+            self.matches = index.match(query)
+        self._positions = None
+        self._current = None
+        if jump:
+            self._step(0)
+        else:
+            self._update_label()
+
+    def _build(self):
+        self.index.build(self._on_index__done)
+        self._update_label()
+
+    def _cursor_position(self):
+        path, column = self.grid._view.get_cursor()
+        if path is None:
+            return -1
+        return path[0]
+
+    def _identity(self, model, row_iter):
+        value = model.get_value(row_iter, OBJECT_COLUMN)
+        grid = self.grid
+        if grid._compact:
+            return value
+        if value is None:
+            return None
+        return grid.identify(value)
+
+    def _jump(self, position):
+        self._current = position
+        view = self.grid._view
+        view.set_cursor((position, ))
+        view.scroll_to_cell((position, ), None, True, 0.5, 0.0)
+
+    def _ranked(self):
+        """Return the sorted view positions of the matches, or None if
+        there are too many to rank."""
+        if self._positions is not None:
+            return self._positions
+        matches = self.matches
+        if len(matches) > self.max_ranked:
+            return None
+        grid = self.grid
+        model = grid._model
+        chain = grid._view_models()
+        if chain is None:
+            return None
+        row_map = grid._row_map
+        positions = []
+        for identity in matches:
+            row_iter = row_map.get(identity)
+            if row_iter is None:
+                continue
+            path = model.get_path(row_iter)
+            for child in chain:
+                path = child.convert_child_path_to_path(path)
+                if path is None:
+                    # Hidden by a filter.
+                    break
+            else:
+                positions.append(path[0])
+        positions.sort()
+        self._positions = positions
+        return positions
+
+    def _rematch(self):
+        """Look up the matches of the unchanged query again, since
+        added or changed rows may now match it."""
+        self.matches = set()
+        self.search(self.query, jump=False)
+
+    def _scan(self, start, step):
+        """Return the view position of the nearest match from `start`
+        in direction `step`, or None."""
+        model = self.grid._view.get_model()
+        if model is None:
+            return None
+        count = len(model)
+        if not count:
+            return None
+        matches = self.matches
+        identity = self._identity
+        get_iter = model.get_iter
+        if step == 0:
+            # Include the row at the cursor itself.
+            start = max(start, 0) - 1
+            step = 1
+        elif start < 0:
+            start = 0
+        for offset in xrange(1, count + 1):
+            position = (start + offset * step) % count
+            if identity(model, get_iter((position, ))) in matches:
+                return position
+        return None
+
+    def _step(self, step):
+        """Move to the next match in direction `step`, or to the first
+        match at or after the cursor if `step` is 0."""
+        if not self.matches:
+            self._update_label()
+            return
+        start = self._cursor_position()
+        positions = self._ranked()
+        if positions is None:
+            position = self._scan(start, step)
+        elif not positions:
+            position = None
+        else:
+            if step >= 0:
+                if step == 0:
+                    index = bisect_left(positions, start)
+                else:
+                    index = bisect_left(positions, start + 1)
+                if index == len(positions):
+                    index = 0
+            else:
+                index = bisect_left(positions, start) - 1
+            position = positions[index]
+        if position is not None:
+            self._jump(position)
+        self._update_label()
+
+    def _update_label(self):
+        if not self.index.ready:
+            text = 'Indexing...'
+        elif not self.query:
+            text = ''
+        elif not self.matches:
+            text = 'No matches'
+        else:
+            positions = self._positions
+            if positions is not None and self._current in positions:
+                text = '%i of %i' % (positions.index(self._current) + 1,
+                                     len(positions))
+            elif positions is not None:
+                text = '%i matches' % len(positions)
+            else:
+                text = '%i matches' % len(self.matches)
+        self._label.set_text(text)
+
+    def _set_bindings(self):
+        items = [
+            ('Escape', self.close),
+            ('Return', self.next),
+            ('Down', self.next),
+            ('<Control>g', self.next),
+            ('<Shift>Return', self.previous),
+            ('Up', self.previous),
+            ('<Control><Shift>g', self.previous),
+            ]
+        self._bindings = {}
+        for name, func in items:
+            keyval, mod = gtk.accelerator_parse(name)
+            self._bindings[(keyval, mod)] = func
+            # Hack to support these with CapsLock on.
+            mod = mod | gtk.gdk.LOCK_MASK
+            self._bindings[(keyval, mod)] = func
+
+    def _on_entry__changed(self, entry):
+        self.search(unicode(entry.get_text(), 'utf-8'))
+
+    def _on_entry__key_press_event(self, entry, event):
+        keyval = event.keyval
+        mask = event.state & gtk.gdk.MODIFIER_MASK
+        func = self._bindings.get((keyval, mask))
+        if func is None and mask & gtk.gdk.SHIFT_MASK:
+            # Shift changes the keyval of letters; match either case.
+            keyval = gtk.gdk.keyval_to_lower(keyval)
+            func = self._bindings.get((keyval, mask))
+        if func is not None:
+            func()
+            return True
+
+    def _on_index__done(self):
+        self.search(self.query)
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
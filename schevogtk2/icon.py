@@ -16,6 +16,9 @@ from schevo.base import Extent
 
 _db_map = weakref.WeakKeyDictionary()
 
+# Rendered pixbufs, by database, then by style, name and size.
+_pixbuf_map = weakref.WeakKeyDictionary()
+
 
 _stock_map = {
     'db.execute': gtk.STOCK_EXECUTE,
@@ -29,18 +32,8 @@ _stock_map = {
 
 def iconset(widget, *args):
     """Return a gtk.IconSet for the database object `obj`."""
-    # Find database from obj.
-    if isinstance(args[0], Database):
-        db, name = args
-    elif isinstance(args[0], Extent):
-        extent = args[0]
-        db = extent.db
-        name = u'db.%s' % extent.name
-    else:
-        # Could not find object.
-        return gtk.IconSet()
-    # Make sure database supports icons.
-    if not hasattr(db, '_icon'):
+    db, name = _db_name(args)
+    if db is None:
         return gtk.IconSet()
     return _iconset(widget, db, name)
 
@@ -59,28 +52,31 @@ def small_image(widget, *args):
 
 def large_pixbuf(widget, *args):
     """Return a large-size Pixbuf for the object."""
-    iset = iconset(widget, *args)
-    return iset.render_icon(
-        style=widget.get_style(),
-        direction=gtk.TEXT_DIR_NONE,
-        state=gtk.STATE_NORMAL,
-        size=gtk.ICON_SIZE_LARGE_TOOLBAR,
-        widget=None,
-        detail=None,
-        )
+    return _pixbuf(widget, gtk.ICON_SIZE_LARGE_TOOLBAR, args)
 
 
 def small_pixbuf(widget, *args):
     """Return a small-size Pixbuf for the object."""
-    iset = iconset(widget, *args)
-    return iset.render_icon(
-        style=widget.get_style(),
-        direction=gtk.TEXT_DIR_NONE,
-        state=gtk.STATE_NORMAL,
-        size=gtk.ICON_SIZE_SMALL_TOOLBAR,
-        widget=None,
-        detail=None,
-        )
+    return _pixbuf(widget, gtk.ICON_SIZE_SMALL_TOOLBAR, args)
+
+
+def _db_name(args):
+    """Return `(db, icon name)` for the arguments of `iconset`, or
+    `(None, None)` if the database does not support icons."""
+    # Find database from obj.
+    if isinstance(args[0], Database):
+        db, name = args
+    elif isinstance(args[0], Extent):
+        extent = args[0]
+        db = extent.db
+        name = u'db.%s' % extent.name
+    else:
+        # Could not find object.
+        return None, None
+    # Make sure database supports icons.
+    if not hasattr(db, '_icon'):
+        return None, None
+    return db, name
 
 
 def _iconset(widget, db, name):
@@ -109,4 +105,30 @@ def _iconset(widget, db, name):
         return iset
 
 
+def _pixbuf(widget, size, args):
+    """Return a Pixbuf of `size` for the object, rendered once per
+    database, style, name and size."""
+    style = widget.get_style()
+    db, name = _db_name(args)
+    if db is None:
+        return _render(gtk.IconSet(), style, size)
+    pixbufs = _pixbuf_map.setdefault(db, {})
+    key = (style, name, size)
+    pixbuf = pixbufs.get(key)
+    if pixbuf is None:
+        pixbuf = pixbufs[key] = _render(_iconset(widget, db, name), style, size)
+    return pixbuf
+
+
+def _render(iset, style, size):
+    return iset.render_icon(
+        style=style,
+        direction=gtk.TEXT_DIR_NONE,
+        state=gtk.STATE_NORMAL,
+        size=size,
+        widget=None,
+        detail=None,
+        )
+
+
 optimize.bind_all(sys.modules[__name__])  # Last line of module.
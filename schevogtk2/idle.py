@@ -0,0 +1,93 @@
+"""Run long-running work in small slices of main loop idle time."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import time
+
+import gobject
+from gtk import gdk
+
+
+class IdleTask(object):
+    """Run a generator in slices of main loop idle time.
+
+    Each time the main loop is idle, the generator is advanced until
+    `slice_ms` milliseconds have elapsed or user input is waiting in
+    the GDK event queue, whichever comes first.  The task then yields
+    back to the main loop and resumes at the next idle moment, so the
+    interface stays responsive while the work proceeds.
+
+    `done_cb`, if given, is called with no arguments once the
+    generator is exhausted.  It is not called if the task is
+    cancelled.
+
+    The generator may call `sleep` before yielding, to wait for
+    something without using idle time meanwhile.
+    """
+
+    def __init__(self, generator, slice_ms=10, done_cb=None,
+                 priority=gobject.PRIORITY_LOW):
+        self.done_cb = done_cb
+        self.priority = priority
+        self.slice_ms = slice_ms
+        self._generator = generator
+        self._source_id = None
+        self._wake_id = None
+
+    @property
+    def running(self):
+        return self._source_id is not None or self._wake_id is not None
+
+    def cancel(self):
+        """Stop the task without running it to completion."""
+        if self._source_id is not None:
+            gobject.source_remove(self._source_id)
+            self._source_id = None
+        if self._wake_id is not None:
+            gobject.source_remove(self._wake_id)
+            self._wake_id = None
+        self._generator = None
+
+    def sleep(self, ms):
+        """Resume the generator, once it next yields, only after `ms`
+        milliseconds."""
+        if self._wake_id is None:
+            self._wake_id = gobject.timeout_add(ms, self._on_wake)
+
+    def start(self):
+        if self._source_id is None and self._generator is not None:
+            self._source_id = gobject.idle_add(
+                self._on_idle, priority=self.priority)
+        return self
+
+    def _on_idle(self):
+        deadline = time.time() + self.slice_ms / 1000.0
+        generator = self._generator
+        try:
+            while True:
+                generator.next()
+                if self._wake_id is not None:
+                    # Sleeping; `_on_wake` starts the task again.
+                    self._source_id = None
+                    return False
+                if time.time() >= deadline or gdk.events_pending():
+                    # Keep the idle source, and continue later.
+                    return True
+        except StopIteration:
+            self._source_id = None
+            self._generator = None
+            if self.done_cb is not None:
+                self.done_cb()
+            return False
+
+    def _on_wake(self):
+        self._wake_id = None
+        self.start()
+        return False
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
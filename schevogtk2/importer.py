@@ -0,0 +1,292 @@
+"""Import of CSV and JSON-lines files into extents."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import csv
+import os
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import schevo.field
+from schevo.label import plural
+from schevo.transaction import Combination
+
+import gtk
+
+from schevogtk2.bulk import BulkJob
+
+
+FORMATS = {
+    '.csv': 'csv',
+    '.json': 'json',
+    '.jsonl': 'json',
+    }
+
+# Marks labels shared by several entities in an entity lookup.
+AMBIGUOUS = object()
+
+
+class ImportJob(BulkJob):
+    """Create entities in `extent` from the rows of a file, in chunks.
+
+    - `filename`: A CSV file whose first row names the columns, or a
+      JSON-lines file with one object per line.  May be chosen after
+      creating the job; see `configure`.
+
+    - `format`: 'csv' or 'json'.  By default, guessed from the file
+      name's extension.
+
+    The file is read as the job runs.  Columns are matched to fields
+    of `extent` by name or label, and other columns are ignored.
+    Values of entity fields are looked up among the allowed extents by
+    label, or by `extent-oid` as in `Field.reversible`.  The lookups
+    are built once per set of allowed extents, and entities created by
+    the import are added to them.
+
+    A row that cannot be converted or created is recorded in
+    `failures` by line number, and the rest of the import goes on.
+    """
+
+    verb = 'Imported'
+
+    def __init__(self, db, extent, filename=None, format=None,
+                 chunk_size=None):
+        BulkJob.__init__(self, db, [], chunk_size=chunk_size)
+        self.extent = extent
+        self.filename = filename
+        self.format = format
+        self.ignored = []
+        self.position = 0
+        self.size = 0
+        self.total = None
+        self._columns = {}
+        self._lookups = {}
+        self._settable = None
+
+    def configure(self, parent, get_value_handlers, set_field_handlers):
+        if self.filename is None:
+            self.filename = choose_file(
+                parent, u'Import %s' % plural(self.extent))
+            if self.filename is None:
+                return False
+        if self.format is None:
+            extension = os.path.splitext(self.filename)[1].lower()
+            self.format = FORMATS.get(extension, 'csv')
+        self.size = os.path.getsize(self.filename)
+        return True
+
+    def description(self):
+        return '%s will be imported from %s, %i per transaction.' % (
+            plural(self.extent), os.path.basename(self.filename),
+            self.chunk_size)
+
+    def progress(self):
+        if self.size:
+            return min(float(self.position) / self.size, 1.0)
+        return 1.0
+
+    def _chunks(self):
+        chunk = []
+        chunk_size = self.chunk_size
+        for row in self._rows():
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _column_field(self, column):
+        """Return the name of the field for `column`, or None."""
+        columns = self._columns
+        if column in columns:
+            return columns[column]
+        settable = self._settable
+        if settable is None:
+            # Fields that can be set when creating an entity, by
+            # lowercase name and label.
+            settable = self._settable = {}
+            tx = self.extent.t.create()
+            for name, field in tx.f.iteritems():
+                if not (field.fget or field.readonly):
+                    settable[name.lower()] = name
+                    settable.setdefault(field.label.lower(), name)
+        key = column.strip().lower()
+        field_name = settable.get(key)
+        if field_name is None:
+            field_name = settable.get(key.replace(' ', '_'))
+        if field_name is None:
+            self.ignored.append(column)
+        columns[column] = field_name
+        return field_name
+
+    def _create_tx(self, values):
+        field_spec = self.extent.field_spec
+        tx = self.extent.t.create()
+        for column, value in values.iteritems():
+            field_name = self._column_field(column)
+            if field_name is None or value is None or value == '':
+                continue
+            FieldClass = field_spec.get(field_name)
+            if (FieldClass is not None
+                and issubclass(FieldClass, schevo.field.Entity)
+                and isinstance(value, basestring)
+                ):
+                value = self._lookup(FieldClass, value)
+            setattr(tx, field_name, value)
+        return tx
+
+    def _execute_chunk(self, chunk, chunk_cb):
+        rows = []
+        for number, values in chunk:
+            try:
+                tx = self._create_tx(values)
+            except Exception, e:
+                self._fail(number, e)
+            else:
+                rows.append((number, values, tx))
+        if not rows:
+            return
+        db = self.db
+        tx = Combination([tx for number, values, tx in rows])
+        try:
+            results = db.execute(tx)
+        except Exception:
+            # Find the rows at fault by creating each on its own.  The
+            # transactions of the combination cannot be reused.
+            for number, values, tx in rows:
+                try:
+                    tx = self._create_tx(values)
+                    result = db.execute(tx)
+                except Exception, e:
+                    self._fail(number, e)
+                else:
+                    self.done += 1
+                    self._remember([result])
+                    if chunk_cb is not None:
+                        chunk_cb(self, [result], tx)
+        else:
+            self.done += len(results)
+            self._remember(results)
+            if chunk_cb is not None:
+                chunk_cb(self, results, tx)
+
+    def _fail(self, number, e):
+        self.failures.append(('Line %i' % number, e))
+
+    def _lookup(self, FieldClass, text):
+        """Return the entity that `text` refers to in a field of
+        `FieldClass`."""
+        allow = frozenset(FieldClass.allow)
+        lookup = self._lookups.get(allow)
+        if lookup is None:
+            lookup = self._lookups[allow] = {}
+            for extent_name in allow:
+                for entity in self.db.extent(extent_name):
+                    key = unicode(entity)
+                    if key in lookup:
+                        lookup[key] = AMBIGUOUS
+                    else:
+                        lookup[key] = entity
+        entity = lookup.get(text)
+        if entity is AMBIGUOUS:
+            raise ValueError('%r refers to more than one entity' % text)
+        if entity is None:
+            # Try `extent-oid`.
+            try:
+                extent_name, oid = text.rsplit('-', 1)
+                if allow and extent_name not in allow:
+                    raise KeyError(extent_name)
+                entity = self.db.extent(extent_name)[int(oid)]
+            except Exception:
+                raise ValueError('%r does not refer to an entity' % text)
+        return entity
+
+    def _remember(self, entities):
+        """Add created `entities` to the lookups that include the
+        extent, so that later rows can refer to them."""
+        extent_name = self.extent.name
+        for allow, lookup in self._lookups.iteritems():
+            if extent_name not in allow:
+                continue
+            for entity in entities:
+                key = unicode(entity)
+                if key in lookup:
+                    lookup[key] = AMBIGUOUS
+                else:
+                    lookup[key] = entity
+
+    def _rows(self):
+        """Yield `(line number, values by column)` for each row of the
+        file."""
+        f = open(self.filename, 'rb')
+        try:
+            # Read lines with readline, so that `tell` stays accurate.
+            lines = iter(f.readline, '')
+            if self.format == 'csv':
+                reader = csv.reader(lines)
+                header = None
+                for row in reader:
+                    self.position = f.tell()
+                    try:
+                        row = [value.decode('utf-8') for value in row]
+                    except UnicodeDecodeError, e:
+                        self._fail(reader.line_num, e)
+                        continue
+                    if header is None:
+                        header = row
+                    elif row:
+                        yield reader.line_num, dict(zip(header, row))
+            else:
+                number = 0
+                for line in lines:
+                    number += 1
+                    self.position = f.tell()
+                    if not line.strip():
+                        continue
+                    try:
+                        values = json.loads(line.decode('utf-8'))
+                    except ValueError, e:
+                        # Includes UnicodeDecodeError.
+                        self._fail(number, e)
+                        continue
+                    if not isinstance(values, dict):
+                        self._fail(number, 'Not an object')
+                        continue
+                    yield number, values
+        finally:
+            f.close()
+
+
+def choose_file(parent, title):
+    """Return the name of a CSV or JSON-lines file chosen to import, or
+    None."""
+    dialog = gtk.FileChooserDialog(
+        title, parent, gtk.FILE_CHOOSER_ACTION_OPEN,
+        (gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL,
+         gtk.STOCK_OPEN, gtk.RESPONSE_OK))
+    dialog.set_default_response(gtk.RESPONSE_OK)
+    for name, patterns in [
+        ('CSV and JSON-lines files', ['*.csv', '*.json', '*.jsonl']),
+        ('All files', ['*']),
+        ]:
+        file_filter = gtk.FileFilter()
+        file_filter.set_name(name)
+        for pattern in patterns:
+            file_filter.add_pattern(pattern)
+        dialog.add_filter(file_filter)
+    filename = None
+    if dialog.run() == gtk.RESPONSE_OK:
+        filename = dialog.get_filename()
+    dialog.destroy()
+    return filename
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,236 @@
+"""Instrumentation of grid rendering, sorting and population.
+
+Instrumentation is off by default.  Turn it on for a grid with
+`Grid.set_instrumented(True)`; the grid then collects a `GridStats`
+in its `stats` attribute.  While it is off, the grid's hot paths run
+unwrapped, so there is no overhead beyond an attribute check when
+columns are created or rows are loaded.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+import time
+
+import gobject
+import gtk
+import pango
+
+
+class GridStats(object):
+    """Statistics collected by an instrumented grid.
+
+    - `renderers`: Dictionary of `[calls, seconds]` by `(column title,
+      renderer name)`, for the cell data functions of each column.
+
+    - `row_styles`: Dictionary of `[calls, seconds]` by method name,
+      for `row_background_color` and `is_row_strikethrough`.
+
+    - `sorts`: List of `[column title, comparisons, seconds]`, one
+      per sort of the grid's model.
+
+    - `populations`: List of `[rows, seconds]`, one per call to
+      `set_rows`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.populations = []
+        self.renderers = {}
+        self.row_styles = {}
+        self.sorts = []
+        self._sort = None
+
+    def add_population(self, rows, seconds):
+        self.populations.append([rows, seconds])
+
+    def snapshot(self):
+        """Return the statistics as a dictionary of plain values."""
+        renderers = []
+        for (title, name), (calls, seconds) in sorted(self.renderers.items()):
+            renderers.append(dict(
+                column=title, renderer=name, calls=calls, seconds=seconds))
+        row_styles = []
+        for name, (calls, seconds) in sorted(self.row_styles.items()):
+            row_styles.append(dict(name=name, calls=calls, seconds=seconds))
+        sorts = []
+        for title, comparisons, seconds in self.sorts:
+            sorts.append(dict(
+                column=title, comparisons=comparisons, seconds=seconds))
+        populations = []
+        for rows, seconds in self.populations:
+            populations.append(dict(
+                rows=rows, seconds=seconds,
+                rows_per_second=_rate(rows, seconds)))
+        return dict(
+            grid=self.name,
+            renderers=renderers,
+            row_styles=row_styles,
+            sorts=sorts,
+            populations=populations,
+            )
+
+    def sort_func(self, func, title):
+        """Return `func`, a model sort function, wrapped to count the
+        comparisons made in each sort."""
+        def timed_sort_func(*args):
+            sort = self._sort
+            if sort is None:
+                # Sorting is done in one go, so everything up to the
+                # next idle moment belongs to the same sort.
+                sort = self._sort = [title, 0, 0.0]
+                self.sorts.append(sort)
+                gobject.idle_add(self._end_sort)
+            start = time.time()
+            try:
+                return func(*args)
+            finally:
+                sort[1] += 1
+                sort[2] += time.time() - start
+        return timed_sort_func
+
+    def timed(self, func, key, totals='renderers'):
+        """Return `func` wrapped to add its calls and cumulative time
+        to the `key` entry of the `totals` dictionary attribute."""
+        def timed_func(*args):
+            start = time.time()
+            try:
+                return func(*args)
+            finally:
+                elapsed = time.time() - start
+                total = getattr(self, totals).get(key)
+                if total is None:
+                    total = getattr(self, totals)[key] = [0, 0.0]
+                total[0] += 1
+                total[1] += elapsed
+        return timed_func
+
+    def timed_row_style(self, func):
+        """Return `func`, a row style method, wrapped to add its calls
+        and cumulative time to `row_styles`."""
+        return self.timed(func, func.__name__, 'row_styles')
+
+    def _end_sort(self):
+        self._sort = None
+        return False
+
+
+def dump(grids, filename):
+    """Write a JSON snapshot of the statistics of the instrumented
+    `grids` to `filename`."""
+    snapshots = [grid.stats.snapshot() for grid in grids
+                 if grid.stats is not None]
+    f = open(filename, 'w')
+    try:
+        json.dump(dict(time=time.time(), grids=snapshots), f, indent=2)
+    finally:
+        f.close()
+
+
+def report(stats):
+    """Return a text report of `stats`."""
+    lines = [stats.name]
+    lines.append('  %-36s %9s %10s %9s' % ('Renderer', 'Calls', 'ms', 'us/call'))
+    for (title, name), (calls, seconds) in sorted(stats.renderers.items()):
+        lines.append('  %-36s %9i %10.1f %9.1f' % (
+            '%s.%s' % (title, name), calls, seconds * 1000.0,
+            _per_call(seconds, calls)))
+    for name, (calls, seconds) in sorted(stats.row_styles.items()):
+        lines.append('  %-36s %9i %10.1f %9.1f' % (
+            name, calls, seconds * 1000.0, _per_call(seconds, calls)))
+    lines.append('  %-36s %9s %10s' % ('Sort', 'Compares', 'ms'))
+    for title, comparisons, seconds in stats.sorts[-5:]:
+        lines.append('  %-36s %9i %10.1f' % (
+            title, comparisons, seconds * 1000.0))
+    lines.append('  %-36s %9s %10s %9s' % ('Population', 'Rows', 'ms', 'rows/s'))
+    for rows, seconds in stats.populations[-5:]:
+        lines.append('  %-36s %9i %10.1f %9i' % (
+            '', rows, seconds * 1000.0, _rate(rows, seconds)))
+    return '\n'.join(lines)
+
+
+def _per_call(seconds, calls):
+    if calls:
+        return seconds * 1000000.0 / calls
+    return 0.0
+
+
+def _rate(rows, seconds):
+    if seconds:
+        return int(rows / seconds)
+    return 0
+
+
+class StatsWindow(gtk.Window):
+    """Developer overlay that shows the statistics of instrumented
+    grids, refreshed every `interval_ms` milliseconds."""
+
+    def __init__(self, grids, interval_ms=1000):
+        gtk.Window.__init__(self)
+        self.grids = grids
+        self.set_title('Grid Instrumentation')
+        self.set_default_size(640, 480)
+        self.set_keep_above(True)
+        vbox = gtk.VBox(spacing=5)
+        vbox.set_border_width(5)
+        self.add(vbox)
+        scrolled = gtk.ScrolledWindow()
+        scrolled.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        scrolled.set_shadow_type(gtk.SHADOW_ETCHED_IN)
+        vbox.pack_start(scrolled)
+        textview = self._textview = gtk.TextView()
+        textview.props.editable = False
+        textview.modify_font(pango.FontDescription('monospace'))
+        scrolled.add(textview)
+        buttons = gtk.HButtonBox()
+        buttons.set_layout(gtk.BUTTONBOX_END)
+        buttons.set_spacing(5)
+        vbox.pack_start(buttons, expand=False)
+        reset = gtk.Button('_Reset')
+        reset.connect('clicked', self._on_reset__clicked)
+        buttons.pack_start(reset)
+        save = gtk.Button(stock=gtk.STOCK_SAVE)
+        save.connect('clicked', self._on_save__clicked)
+        buttons.pack_start(save)
+        self._status = gtk.Label()
+        vbox.pack_start(self._status, expand=False)
+        vbox.show_all()
+        self._source_id = gobject.timeout_add(interval_ms, self._on_timeout)
+        self.connect('destroy', self._on_destroy)
+        self.update()
+
+    def update(self):
+        reports = [report(grid.stats) for grid in self.grids
+                   if grid.stats is not None]
+        self._textview.get_buffer().set_text('\n\n'.join(reports))
+
+    def _on_destroy(self, window):
+        gobject.source_remove(self._source_id)
+
+    def _on_reset__clicked(self, button):
+        for grid in self.grids:
+            if grid.stats is not None:
+                grid.stats.reset()
+        self.update()
+
+    def _on_save__clicked(self, button):
+        filename = time.strftime('gnav-stats-%Y%m%d-%H%M%S.json')
+        dump(self.grids, filename)
+        self._status.set_text('Saved %s' % filename)
+
+    def _on_timeout(self):
+        self.update()
+        return True
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -16,7 +16,9 @@ from schevo import database
 from schevo.label import label, plural
 
 from schevogtk2.cursor import TemporaryCursor
+from schevogtk2.fulltext import FullTextSearch
 from schevogtk2 import icon
+from schevogtk2.prefetch import ExtentPrefetcher
 from schevogtk2.window import Window
 
 
@@ -29,8 +31,59 @@ class NavigatorWindow(Window):
         file_custom_filter = 'All Files\0*.*\0'
         file_open_title = 'Open Schevo Database File'
 
+    # Prefetch the rows of extents likely to be viewed next, using
+    # main loop idle time.  The budget limits the total number of
+    # prefetched rows held in memory, the milliseconds of work done
+    # per idle slice, and the seconds of work done per extent visit.
+    prefetch = True
+    prefetch_max_rows = 50000
+    prefetch_slice_ms = 10
+    prefetch_max_seconds = 2.0
+
+    # Store only the OIDs of the rows of the entity grid, resolving
+    # entities as they are displayed.
+    compact_rows = True
+
+    # Give the entity grid fixed-height rows and fixed-width columns
+    # estimated from a sample of rows.  Off by default, since image
+    # fields need rows of varying height.
+    fast_layout = False
+
+    # Run queries shown in the entity grid in idle time, adding their
+    # results as they are produced.
+    async_queries = True
+
+    # Find rows of the entity grid as you type, using a token index
+    # built when the find bar opens.
+    search_indexed = True
+
+    # Search the string fields of all extents from a box above the
+    # grids, using an index saved beside the database file.
+    fulltext = True
+
+    # Developer overlay showing grid instrumentation, while enabled.
+    _stats_window = None
+
     def __init__(self):
         Window.__init__(self)
+        self.entity_grid.compact_rows = self.compact_rows
+        self.entity_grid.async_queries = self.async_queries
+        self.entity_grid.set_fast_layout(self.fast_layout)
+        self.entity_grid.set_search_indexed(self.search_indexed)
+        if self.prefetch:
+            self.entity_grid.prefetcher = ExtentPrefetcher(
+                self.entity_grid,
+                max_rows=self.prefetch_max_rows,
+                slice_ms=self.prefetch_slice_ms,
+                max_seconds=self.prefetch_max_seconds,
+                )
+        self.search_box = None
+        if self.fulltext:
+            search_box = self.search_box = FullTextSearch(
+                self._on_search_box__activate)
+            self.navigator_vbox.pack_start(search_box, expand=False, padding=3)
+            self.navigator_vbox.reorder_child(search_box, 0)
+            search_box.show_all()
         self.update_ui()
 
 ##     def database_new(self, filename):
@@ -53,6 +106,10 @@ class NavigatorWindow(Window):
     def on_entity_grid__action_selected(self, widget, action):
         self._on_action_selected(widget, action)
 
+    def focus_search_box(self):
+        if self.search_box is not None:
+            self.search_box.grab_focus()
+
     def on_entity_grid__row_activated(self, widget, entity):
         self._on_grid__row_activated(widget, entity)
 
@@ -62,6 +119,8 @@ class NavigatorWindow(Window):
 
     def on_extent_grid__selection_changed(self, widget, extent):
         if extent is not None:
+            self.activity['grid'] = 'entity_grid'
+            self.activity['extent'] = extent.name
             with TemporaryCursor(self):
                 icon_set = icon.iconset(widget, extent)
                 size = gtk.ICON_SIZE_LARGE_TOOLBAR
@@ -69,6 +128,70 @@ class NavigatorWindow(Window):
                 text = u'List of %s:' % plural(extent)
                 self.entity_grid_label.set_text(text)
                 self.entity_grid.set_extent(extent)
+            prefetcher = self.entity_grid.prefetcher
+            if prefetcher is not None:
+                prefetcher.schedule(extent, widget.get_adjacent(extent))
+
+    def quit(self, *args):
+        if self.search_box is not None:
+            # Save the search index.
+            self.search_box.set_db(None)
+        Window.quit(self, *args)
+
+    def reflect_changes(self, result, tx):
+        prefetcher = self.entity_grid.prefetcher
+        if prefetcher is not None and tx.s.executed:
+            prefetcher.clear()
+        if self.search_box is not None:
+            self.search_box.reflect_changes(tx)
+
+    def _set_bindings(self):
+        Window._set_bindings(self)
+        items = [
+            ('<Control><Shift>I', self.toggle_instrumentation),
+            ('<Control><Shift>F', self.focus_search_box),
+            ]
+        for name, func in items:
+            keyval, mod = gtk.accelerator_parse(name)
+            self._bindings[(keyval, mod)] = func
+            # Hack to support these with CapsLock on.
+            mod = mod | gtk.gdk.LOCK_MASK
+            self._bindings[(keyval, mod)] = func
+
+    def show_placeholder(self, text):
+        size = gtk.ICON_SIZE_LARGE_TOOLBAR
+        self.entity_grid_image.set_from_stock(gtk.STOCK_INFO, size)
+        self.entity_grid_label.set_text(text)
+        self.extent_grid.set_sensitive(False)
+        self.entity_grid.set_sensitive(False)
+
+    def toggle_instrumentation(self):
+        """Turn grid instrumentation on or off, showing its statistics
+        in a developer overlay while it is on."""
+        grids = [self.extent_grid, self.entity_grid]
+        if self._stats_window is None:
+            from schevogtk2.instrument import StatsWindow
+            for grid in grids:
+                grid.set_instrumented(True)
+            window = self._stats_window = StatsWindow(grids)
+            window.set_transient_for(self.toplevel)
+            window.connect('delete-event', self._on_stats_window__delete_event)
+            window.show()
+        else:
+            for grid in grids:
+                grid.set_instrumented(False)
+            self._stats_window.destroy()
+            self._stats_window = None
+
+    def _on_search_box__activate(self, entity):
+        """Show `entity`, a search hit, in the entity grid."""
+        self.extent_grid.select(entity._extent)
+        self.entity_grid.select_row(entity._oid)
+        self.entity_grid.grab_focus()
+
+    def _on_stats_window__delete_event(self, window, event):
+        self.toggle_instrumentation()
+        return True
 
     def update_title(self):
         """Add or remove the database label from the end of the title."""
@@ -83,8 +206,14 @@ class NavigatorWindow(Window):
     def update_ui(self):
         """Update the interface to reflect the state of the database."""
         self.update_title()
+        if self.entity_grid.prefetcher is not None:
+            self.entity_grid.prefetcher.clear()
         self.entity_grid.set_db(self._db)
         self.extent_grid.set_db(self._db)
+        if self.search_box is not None:
+            self.search_box.set_db(self._db, self._db_filename)
+        self.extent_grid.set_sensitive(True)
+        self.entity_grid.set_sensitive(True)
         if self._db is None:
             size = gtk.ICON_SIZE_LARGE_TOOLBAR
             self.entity_grid_image.set_from_stock(gtk.STOCK_INFO, size)
@@ -7,11 +7,17 @@ import gtk
 import gobject
 
 from schevo import base
-from schevo.gtk import icon
 from schevo.label import label, plural
 
+from schevogtk2 import icon
+
 
 class ExtentExpanderBox(gtk.VBox):
+    """Expanders for the extents of `db`.
+
+    Only the label of each expander is built up front.  Its panel of
+    query and transaction buttons is built the first time it is
+    expanded.  Icons come from the shared pixbuf cache of `icon`."""
 
     def __init__(self, db):
         gtk.VBox.__init__(self)
@@ -21,8 +27,7 @@ class ExtentExpanderBox(gtk.VBox):
         for extent in db.extents():
             expander = gtk.Expander()
             extent_label = plural(extent)
-            iset = icon.iconset(self, extent)
-            image_label = icon.small_image(self, extent)
+            image_label = self._image(extent)
 ##             text_label = gtk.Label(u'<b>%s</b>' % extent_label)
 ##             text_label.props.use_markup = True
             text_label = gtk.Label(extent_label)
@@ -31,64 +36,73 @@ class ExtentExpanderBox(gtk.VBox):
             label_widget.pack_start(text_label, expand=False)
             expander.props.label_widget = label_widget
             self.pack_start(expander)
-            # Children of expander.
-            hbox = gtk.HBox()
-            expander.add(hbox)
-            # Padding on left.
-            padding = gtk.VBox()
-            padding.props.width_request = 20
-            hbox.pack_start(padding, expand=False)
-            # Buttons.
-            buttons = gtk.VBox()
-            hbox.add(buttons)
-            # Query buttons.
-            q = extent.q
-            for q_name in q:
-                q_method = q[q_name]
-##                 q_label = label(q_method)
-                q_label = gtk.Label(label(q_method))
-                q_button = gtk.Button()
-##                 q_button.props.label = q_label
-##                 q_button.props.image = icon.small_image(
-##                     self, db, 'q.%s' % q_name)
-                q_image = icon.small_image(self, db, 'q.%s' % q_name)
-                q_hbox = gtk.HBox(spacing=2)
-                q_hbox.pack_start(q_image, expand=False)
-                q_hbox.pack_start(q_label, expand=False, padding=1)
-                q_button.add(q_hbox)
-##                 q_button.props.relief = gtk.RELIEF_NONE
-                q_button.props.xalign = 0.0
-                q_button.connect(
-                    'clicked', self.on_q_button_clicked,
-                    extent, q_name)
-                buttons.add(q_button)
-            # Transaction buttons.
-            t = extent.t
-            for t_name in t:
-                t_method = t[t_name]
-                t_label = label(t_method)
-                t_button = gtk.Button()
-                t_button.props.label = t_label
-                t_button.props.image = icon.small_image(
-                    self, db, 't.%s' % t_name)
-##                 t_button.props.relief = gtk.RELIEF_NONE
-                t_button.props.xalign = 0.0
-                t_button.connect(
-                    'clicked', self.on_t_button_clicked,
-                    extent, t_name)
-                buttons.add(t_button)
-            # Padding on bottom.
-            padding = gtk.VBox()
-            padding.props.height_request = 11
-            buttons.add(padding)
+            expander.connect('notify::expanded', self.on_notify_expanded,
+                             extent)
         self.show_all()
 
+    def on_notify_expanded(self, expander, pspec, extent):
+        if expander.props.expanded and expander.get_child() is None:
+            panel = self._panel(extent)
+            expander.add(panel)
+            panel.show_all()
+
     def on_q_button_clicked(self, button, extent, method_name):
         self.emit('q_method_activated', extent, method_name)
 
     def on_t_button_clicked(self, button, extent, method_name):
         self.emit('t_method_activated', extent, method_name)
 
+    def _image(self, *args):
+        return gtk.image_new_from_pixbuf(icon.small_pixbuf(self, *args))
+
+    def _panel(self, extent):
+        """Return the panel of buttons for the methods of `extent`."""
+        db = self._db
+        hbox = gtk.HBox()
+        # Padding on left.
+        padding = gtk.VBox()
+        padding.props.width_request = 20
+        hbox.pack_start(padding, expand=False)
+        # Buttons.
+        buttons = gtk.VBox()
+        hbox.add(buttons)
+        # Query buttons.
+        q = extent.q
+        for q_name in q:
+            q_method = q[q_name]
+            q_label = gtk.Label(label(q_method))
+            q_button = gtk.Button()
+            q_image = self._image(db, 'q.%s' % q_name)
+            q_hbox = gtk.HBox(spacing=2)
+            q_hbox.pack_start(q_image, expand=False)
+            q_hbox.pack_start(q_label, expand=False, padding=1)
+            q_button.add(q_hbox)
+##             q_button.props.relief = gtk.RELIEF_NONE
+            q_button.props.xalign = 0.0
+            q_button.connect(
+                'clicked', self.on_q_button_clicked,
+                extent, q_name)
+            buttons.add(q_button)
+        # Transaction buttons.
+        t = extent.t
+        for t_name in t:
+            t_method = t[t_name]
+            t_label = label(t_method)
+            t_button = gtk.Button()
+            t_button.props.label = t_label
+            t_button.props.image = self._image(db, 't.%s' % t_name)
+##             t_button.props.relief = gtk.RELIEF_NONE
+            t_button.props.xalign = 0.0
+            t_button.connect(
+                'clicked', self.on_t_button_clicked,
+                extent, t_name)
+            buttons.add(t_button)
+        # Padding on bottom.
+        padding = gtk.VBox()
+        padding.props.height_request = 11
+        buttons.add(padding)
+        return hbox
+
 ##     def expander_for(self, extent):
 ##         return self._extent_expander[extent]
 
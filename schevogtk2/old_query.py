@@ -3,9 +3,13 @@
 # Copyright (c) 2001-2009 ElevenCraft Inc.
 # See LICENSE for details.
 
+from copy import copy
+import time
+
 from dispatch import generic
 
 from schevo import base
+from schevo.error import EntityDoesNotExist
 from schevo import fieldspec
 from schevo.gtk import icon
 from schevo.gtk import field as gtk_field
@@ -18,13 +22,27 @@ import gtk
 
 from kiwi.ui.objectlist import ObjectList, Column
 
+from schevogtk2.idle import IdleTask
+
 
 class Query(gtk.VBox):
 
+    # In live mode, criteria are applied this long after the last edit.
+    live_delay_ms = 300
+
+    # Number of entities of the extent tested against the criteria per
+    # idle slice.
+    run_batch_size = 500
+
     def __init__(self, db, extent, method_name):
         gtk.VBox.__init__(self)
         self._db = db
         self._extent = extent
+        self._edited = None
+        self._run_error = None
+        self._run_results = None
+        self._run_task = None
+        self._timeout_id = None
         method = extent.q[method_name]
         query = self._query = method()
         # Criteria form.
@@ -45,80 +63,294 @@ class Query(gtk.VBox):
         expander.add(vbox)
         criteria = self._criteria = query_widget(db, query)
         vbox.pack_start(criteria, expand=False)
+        criteria.watch(self.on_criteria_changed)
         # Update button.
         box = gtk.HBox()
         vbox.pack_start(box, expand=False)
         refresh = gtk.Button(stock=gtk.STOCK_REFRESH)
         refresh.connect('clicked', self.on_refresh_clicked)
         box.pack_end(refresh, expand=False)
+        live = self._live = gtk.CheckButton('_Live')
+        live.set_tooltip_text('Update results as criteria are edited')
+        live.connect('toggled', self.on_live_toggled)
+        box.pack_end(live, expand=False, padding=6)
         # Results table.
         scroller = gtk.ScrolledWindow()
         scroller.set_policy(gtk.POLICY_NEVER, gtk.POLICY_AUTOMATIC)
         self.pack_start(scroller, expand=True)
         results = self._results = Results(db, query)
         scroller.add_with_viewport(results)
+        # Status of the last run.
+        status = self._status = gtk.Label()
+        status.props.xalign = 0.0
+        self.pack_start(status, expand=False, padding=3)
         self.show_all()
         criteria.update_ui()
         results.rerun()
+        self.connect('destroy', self.on_destroy)
+
+    def cancel(self):
+        """Cancel any scheduled or running rerun."""
+        if self._timeout_id is not None:
+            gobject.source_remove(self._timeout_id)
+            self._timeout_id = None
+        if self._run_task is not None:
+            self._run_task.cancel()
+            self._run_task = None
+
+    def on_criteria_changed(self):
+        if not self._live.get_active():
+            return
+        # Debounce: restart the delay on each edit, and abandon a run
+        # for criteria that are already out of date.
+        self.cancel()
+        self._edited = time.time()
+        self._timeout_id = gobject.timeout_add(
+            self.live_delay_ms, self.on_timeout)
+
+    def on_destroy(self, w):
+        self.cancel()
+
+    def on_live_toggled(self, w):
+        if w.get_active():
+            self._edited = time.time()
+            self._start_run()
+        else:
+            self.cancel()
 
     def on_refresh_clicked(self, w):
-        self._criteria.update_query()
-        self._results.rerun()
+        self._edited = time.time()
+        self._start_run()
+
+    def on_timeout(self):
+        self._timeout_id = None
+        self._start_run()
+        return False
+
+    def _run(self):
+        """Collect the results of the query, in idle time.
+
+        A match, or an intersection of matches, on the extent is tested
+        against `run_batch_size` entities per idle slice, so that a
+        newer edit can cancel it part way.  Other queries are run all at
+        once, in the first slice.
+        """
+        results = self._run_results
+        try:
+            matches = _batch_matches(self._query, self._extent)
+            if matches is None:
+                results.extend(self._query())
+                return
+            extent = self._extent
+            oids = list(extent.find_oids())
+            batch_size = self.run_batch_size
+            for start in xrange(0, len(oids), batch_size):
+                batch = []
+                for oid in oids[start:start + batch_size]:
+                    try:
+                        batch.append(extent[oid])
+                    except EntityDoesNotExist:
+                        pass
+                found = None
+                for match in matches:
+                    match.on = batch
+                    if found is None:
+                        found = set(match())
+                    else:
+                        found.intersection_update(match())
+                    if not found:
+                        break
+                results.extend(entity for entity in batch if entity in found)
+                yield
+        except Exception, e:
+            self._run_error = e
+
+    def _run_done(self):
+        self._run_task = None
+        latency = (time.time() - self._edited) * 1000
+        if self._run_error is not None:
+            text = u'Query failed after %i ms: %s' % (latency, self._run_error)
+        else:
+            # Swap in all results at once, never partial ones.
+            self._results.show_results(self._run_results)
+            count = len(self._run_results)
+            text = u'%i results in %i ms' % (count, latency)
+        self._run_results = None
+        self._status.set_text(text)
+
+    def _start_run(self):
+        self.cancel()
+        try:
+            self._criteria.update_query()
+        except Exception, e:
+            # Criteria being edited may not be valid yet.
+            self._status.set_text(u'Invalid criteria: %s' % e)
+            return
+        self._run_error = None
+        self._run_results = []
+        self._status.set_text(u'Searching...')
+        self._run_task = IdleTask(self._run(), done_cb=self._run_done).start()
 
 
 class Results(gtk.VBox):
 
+    # Classes with more results than this are shown in a
+    # `LargeResultsView`, which only formats the rows it draws, rather
+    # than a `ResultsListView`.
+    large_results = 500
+
     def __init__(self, db, query):
         gtk.VBox.__init__(self)
         self._db = db
         self._query = query
-        self._class_expander = [
-            # (Class, expander),
-            ]
+        self._class_expander = {
+            # Class: ClassResults,
+            }
+        self._no_results = None
 
     def rerun(self):
         """Re-run the query and update results."""
-        db = self._db
-        # Destroy existing results.
-        class_expander = self._class_expander
-        while class_expander:
-            class_, expander = class_expander.pop()
-            expander.destroy()
-        # Re-run query.
-        results = self._query()
+        self.show_results(self._query())
+
+    def show_results(self, results):
+        """Show `results`.
+
+        Expanders and views of classes that are still found are kept,
+        and only the differences in their results are applied."""
         class_results = {}
+        order = []
         for result in results:
-            L = class_results.setdefault(result.__class__, [])
+            class_ = result.__class__
+            L = class_results.get(class_)
+            if L is None:
+                L = class_results[class_] = []
+                order.append(class_)
             L.append(result)
-        # Create expanders and listviews.
+        # Remove classes no longer found.
+        class_expander = self._class_expander
+        for class_ in class_expander.keys():
+            if class_ not in class_results:
+                class_expander.pop(class_).destroy()
+        no_results = self._no_results
         if not class_results:
-            no_results = gtk.Label('No results found.')
-            self.pack_start(no_results, expand=False)
-            class_expander.append((None, no_results))
-        for class_, results in class_results.iteritems():
-            extent = class_._extent
-            expander_label = gtk.HBox()
-            # Label for extent.
-            extent_image = icon.small_image(self, extent)
-            count = len(results)
-            if count != 1:
-                extent_label = gtk.Label(
-                    u'%i %s found:' % (count, plural(extent)))
-            else:
-                extent_label = gtk.Label(
-                    u'%i %s found:' % (count, label(extent)))
-            expander_label.pack_start(extent_image, expand=False, padding=6)
-            expander_label.pack_start(extent_label, expand=False, padding=6)
-            expander = gtk.Expander()
-            expander.props.label_widget = expander_label
-            expander.props.expanded = True
-            self.pack_start(expander, expand=True)
-            listview = ResultsListView(class_, results)
-            expander.add(listview)
-            class_expander.append((class_, expander))
+            if no_results is None:
+                no_results = self._no_results = gtk.Label('No results found.')
+                self.pack_start(no_results, expand=False)
+        elif no_results is not None:
+            no_results.destroy()
+            self._no_results = None
+        # Update or create expanders.
+        for class_ in order:
+            expander = class_expander.get(class_)
+            if expander is None:
+                expander = class_expander[class_] = ClassResults(
+                    self, class_, self.large_results)
+                self.pack_start(expander, expand=True)
+            expander.set_results(class_results[class_])
         self.show_all()
 
 
+class ClassResults(gtk.Expander):
+    """Expander for the results of one class.
+
+    Its view is only created when the expander is first expanded."""
+
+    def __init__(self, owner, class_, large_results):
+        gtk.Expander.__init__(self)
+        self._class = class_
+        self._large_results = large_results
+        self._results = []
+        self._view = None
+        extent = class_._extent
+        expander_label = gtk.HBox()
+        # Label for extent.
+        extent_image = icon.small_image(owner, extent)
+        extent_label = self._label = gtk.Label()
+        expander_label.pack_start(extent_image, expand=False, padding=6)
+        expander_label.pack_start(extent_label, expand=False, padding=6)
+        self.props.label_widget = expander_label
+        self.props.expanded = True
+        self.connect('notify::expanded', self.on_notify_expanded)
+
+    def set_results(self, results):
+        extent = self._class._extent
+        count = len(results)
+        if count != 1:
+            text = u'%i %s found:' % (count, plural(extent))
+        else:
+            text = u'%i %s found:' % (count, label(extent))
+        self._label.props.label = text
+        old_results = self._results
+        self._results = results
+        view = self._view
+        if view is not None:
+            if isinstance(view, LargeResultsView) != (
+                count > self._large_results):
+                # Crossed the threshold; switch kinds of view.
+                view.destroy()
+                self._view = None
+            else:
+                _apply_diff(view, old_results, results)
+        if self._view is None and self.props.expanded:
+            self._create_view()
+
+    def on_notify_expanded(self, expander, pspec):
+        if self._view is None and self.props.expanded:
+            self._create_view()
+            self._view.show_all()
+
+    def _create_view(self):
+        class_ = self._class
+        results = self._results
+        if len(results) > self._large_results:
+            view = LargeResultsView(class_, results)
+        else:
+            view = ResultsListView(class_, results)
+        self._view = view
+        self.add(view)
+
+
+def _batch_matches(query, extent):
+    """Return copies of the matches that `query` intersects, to run on
+    batches of the entities of `extent`, or None if `query` is not a
+    match or intersection of matches on `extent`."""
+    if isinstance(query, Q.Match):
+        queries = [query]
+    elif isinstance(query, Q.Intersection) and query.queries:
+        queries = query.queries
+    else:
+        return None
+    matches = []
+    for query in queries:
+        if not isinstance(query, Q.Match) or query.on is not extent:
+            return None
+        match = copy(query)
+        if match.operator is Q.o_in and isinstance(match.value, base.Query):
+            # Run the query of values once, not once per batch.
+            match.value = frozenset(match.value())
+        matches.append(match)
+    return matches
+
+
+def _apply_diff(view, old_results, results):
+    """Remove from `view` results in `old_results` that are not in
+    `results`, append the new ones, and redraw the rest, whose values
+    may have changed."""
+    old = set(old_results)
+    new = set(results)
+    removed = [result for result in old_results if result not in new]
+    added = [result for result in results if result not in old]
+    if len(removed) + len(added) > len(results):
+        # Cheaper to start over.
+        view.add_list(results)
+        return
+    for result in removed:
+        view.remove(result)
+    if added:
+        view.extend(added)
+    view.refresh()
+
+
 class ResultsListView(ObjectList):
 
     def __init__(self, ResultClass, results):
@@ -134,6 +366,65 @@ class ResultsListView(ObjectList):
         ObjectList.__init__(self, columns, results)
 
 
+class LargeResultsView(gtk.TreeView):
+    """Tree view of many results.
+
+    Rows have a fixed height and cells are formatted as they are drawn,
+    so the cost of showing results does not grow with their number.
+    Has the methods of `ResultsListView` used to apply changes."""
+
+    def __init__(self, ResultClass, results):
+        gtk.TreeView.__init__(self)
+        self._iters = {}
+        for field_name, FieldClass in ResultClass._field_spec.iteritems():
+            if not FieldClass.expensive:
+                renderer = gtk.CellRendererText()
+                renderer.props.xalign = 0.0
+                column = gtk.TreeViewColumn(label(FieldClass), renderer)
+                column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+                column.set_fixed_width(150)
+                column.set_resizable(True)
+                column.set_cell_data_func(
+                    renderer, self._cell_data_func, field_name)
+                self.append_column(column)
+        self.set_fixed_height_mode(True)
+        self.set_model(gtk.ListStore(object))
+        self.add_list(results)
+
+    def add_list(self, results):
+        model = self.get_model()
+        # Detach the model while filling it, to avoid per-row updates.
+        self.set_model(None)
+        model.clear()
+        self._iters.clear()
+        self._append(model, results)
+        self.set_model(model)
+
+    def extend(self, results):
+        self._append(self.get_model(), results)
+
+    def refresh(self):
+        self.queue_draw()
+
+    def remove(self, result):
+        model = self.get_model()
+        model.remove(self._iters.pop(result))
+
+    def _append(self, model, results):
+        iters = self._iters
+        append = model.append
+        for result in results:
+            iters[result] = append([result])
+
+    def _cell_data_func(self, column, cell, model, iter, field_name):
+        result = model.get_value(iter, 0)
+        try:
+            text = unicode(getattr(result.f, field_name))
+        except EntityDoesNotExist:
+            text = u''
+        cell.props.text = text
+
+
 ## class ResultsTreeView(gtk.TreeView):
 
 ##     def __init__(self, ResultClass, results):
@@ -312,6 +603,10 @@ class IntersectionForm(gtk.Frame):
         for widget in self._query_widget.itervalues():
             widget.update_ui()
 
+    def watch(self, callback):
+        for widget in self._query_widget.itervalues():
+            widget.watch(callback)
+
 
 FIELDLESS_OPERATORS = frozenset(
     (Q.o_any, Q.o_assigned, Q.o_in, Q.o_unassigned))
@@ -330,7 +625,7 @@ class MatchForm(gtk.HBox):
         field_label = widget.FieldLabel(label(field))
         self.pack_start(field_label, expand=False)
         # Menu list for operator selection.
-        opcombo = OperatorComboBox(query)
+        opcombo = self._opcombo = OperatorComboBox(query)
         self.pack_start(opcombo, expand=False)
         opcombo.connect('changed', self.on_opcombo_changed)
         # Field widget.
@@ -349,6 +644,17 @@ class MatchForm(gtk.HBox):
         operator = self._query.operator
         self._field_widget.props.visible = operator not in FIELDLESS_OPERATORS
 
+    def watch(self, callback):
+        """Call `callback()` whenever the operator or value is edited."""
+        def changed(*args):
+            callback()
+        self._opcombo.connect('changed', changed)
+        field_widget = self._field_widget
+        for signal in ('value-changed', 'changed'):
+            if gobject.signal_lookup(signal, field_widget):
+                field_widget.connect(signal, changed)
+                break
+
     def on_opcombo_changed(self, w):
         operator = self._query.operator = w.current_operator
         self._field_widget.props.visible = operator not in FIELDLESS_OPERATORS
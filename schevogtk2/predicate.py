@@ -0,0 +1,361 @@
+"""Declarative row filters for grids.
+
+Predicates describe which rows of a grid are visible, in terms of the
+attributes of the instances they show::
+
+  from schevogtk2.predicate import Contains, Eq, In, Range
+
+  grid.set_filter(Eq('hidden', False)
+                  & (Contains('name', u'smith') | In('status', ['new']))
+                  & ~Range('age', 0, 17))
+
+Attribute names may be dotted paths, such as `'extent.hidden'`.
+
+A predicate is compiled once into a `CompiledFilter`, whose evaluator
+works on a tuple of the row's attribute values.  Those values are
+cached per row, so that re-evaluating a row only reads the attributes
+of instances that changed.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import operator
+import time
+
+from schevo.error import EntityDoesNotExist
+
+
+class Predicate(object):
+    """Base class of predicates.
+
+    Predicates may be combined with `&` (and), `|` (or) and `~`
+    (not)."""
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def attributes(self):
+        """Return the set of attribute names the predicate reads."""
+        raise NotImplementedError()
+
+    def compile(self, slots):
+        """Return a function that takes a tuple of attribute values and
+        returns True if the row is visible.  `slots` maps each
+        attribute name to its index in the tuple."""
+        raise NotImplementedError()
+
+
+class _Comparison(Predicate):
+
+    op = None
+
+    def __init__(self, attribute, value):
+        self.attribute = attribute
+        self.value = value
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__,
+                               self.attribute, self.value)
+
+    def attributes(self):
+        return set([self.attribute])
+
+    def compile(self, slots):
+        index = slots[self.attribute]
+        value = self.value
+        op = self.op
+        def evaluate(values):
+            return op(values[index], value)
+        return evaluate
+
+
+class Eq(_Comparison):
+    op = staticmethod(operator.eq)
+
+
+class Ne(_Comparison):
+    op = staticmethod(operator.ne)
+
+
+class Lt(_Comparison):
+    op = staticmethod(operator.lt)
+
+
+class Le(_Comparison):
+    op = staticmethod(operator.le)
+
+
+class Gt(_Comparison):
+    op = staticmethod(operator.gt)
+
+
+class Ge(_Comparison):
+    op = staticmethod(operator.ge)
+
+
+class Range(Predicate):
+    """True if `low <= value <= high`.  Either bound may be None to
+    leave that end of the range open."""
+
+    def __init__(self, attribute, low=None, high=None):
+        self.attribute = attribute
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        return 'Range(%r, %r, %r)' % (self.attribute, self.low, self.high)
+
+    def attributes(self):
+        return set([self.attribute])
+
+    def compile(self, slots):
+        index = slots[self.attribute]
+        low = self.low
+        high = self.high
+        if low is None:
+            def evaluate(values):
+                value = values[index]
+                return value is not None and value <= high
+        elif high is None:
+            def evaluate(values):
+                value = values[index]
+                return value is not None and low <= value
+        else:
+            def evaluate(values):
+                value = values[index]
+                return value is not None and low <= value <= high
+        return evaluate
+
+
+class Contains(Predicate):
+    """True if the text of the value contains `text`."""
+
+    def __init__(self, attribute, text, case_sensitive=False):
+        self.attribute = attribute
+        self.text = text
+        self.case_sensitive = case_sensitive
+
+    def __repr__(self):
+        return 'Contains(%r, %r)' % (self.attribute, self.text)
+
+    def attributes(self):
+        return set([self.attribute])
+
+    def compile(self, slots):
+        index = slots[self.attribute]
+        if self.case_sensitive:
+            text = unicode(self.text)
+            def evaluate(values):
+                value = values[index]
+                return value is not None and text in unicode(value)
+        else:
+            text = unicode(self.text).lower()
+            def evaluate(values):
+                value = values[index]
+                return value is not None and text in unicode(value).lower()
+        return evaluate
+
+
+class In(Predicate):
+    """True if the value is one of `values`, which must be
+    hashable."""
+
+    def __init__(self, attribute, values):
+        self.attribute = attribute
+        self.values = frozenset(values)
+
+    def __repr__(self):
+        return 'In(%r, %r)' % (self.attribute, sorted(self.values))
+
+    def attributes(self):
+        return set([self.attribute])
+
+    def compile(self, slots):
+        index = slots[self.attribute]
+        members = self.values
+        def evaluate(values):
+            return values[index] in members
+        return evaluate
+
+
+class Where(Predicate):
+    """True if `func(value)` is true.  An escape hatch for conditions
+    the other predicates can't express."""
+
+    def __init__(self, attribute, func):
+        self.attribute = attribute
+        self.func = func
+
+    def attributes(self):
+        return set([self.attribute])
+
+    def compile(self, slots):
+        index = slots[self.attribute]
+        func = self.func
+        def evaluate(values):
+            return bool(func(values[index]))
+        return evaluate
+
+
+class And(Predicate):
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def __repr__(self):
+        return 'And%r' % (self.predicates, )
+
+    def attributes(self):
+        result = set()
+        for predicate in self.predicates:
+            result.update(predicate.attributes())
+        return result
+
+    def compile(self, slots):
+        evaluators = [predicate.compile(slots)
+                      for predicate in self.predicates]
+        if len(evaluators) == 2:
+            first, second = evaluators
+            def evaluate(values):
+                return first(values) and second(values)
+        else:
+            def evaluate(values):
+                for evaluator in evaluators:
+                    if not evaluator(values):
+                        return False
+                return True
+        return evaluate
+
+
+class Or(And):
+
+    def __repr__(self):
+        return 'Or%r' % (self.predicates, )
+
+    def compile(self, slots):
+        evaluators = [predicate.compile(slots)
+                      for predicate in self.predicates]
+        if len(evaluators) == 2:
+            first, second = evaluators
+            def evaluate(values):
+                return first(values) or second(values)
+        else:
+            def evaluate(values):
+                for evaluator in evaluators:
+                    if evaluator(values):
+                        return True
+                return False
+        return evaluate
+
+
+class Not(Predicate):
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def __repr__(self):
+        return 'Not(%r)' % (self.predicate, )
+
+    def attributes(self):
+        return self.predicate.attributes()
+
+    def compile(self, slots):
+        evaluator = self.predicate.compile(slots)
+        def evaluate(values):
+            return not evaluator(values)
+        return evaluate
+
+
+def getter(attribute):
+    """Return a function that reads the possibly dotted `attribute`
+    of an instance, or returns None if it can't be read."""
+    names = attribute.split('.')
+    def get(instance):
+        try:
+            for name in names:
+                instance = getattr(instance, name)
+        except (AttributeError, EntityDoesNotExist):
+            return None
+        return instance
+    return get
+
+
+class CompiledFilter(object):
+    """A predicate compiled into an evaluator over cached attribute
+    values.
+
+    - `rows_evaluated`, `seconds`: Totals since the filter was
+      compiled.
+
+    - `last_rows`, `last_seconds`: Number of rows and time taken by the
+      most recent call to `evaluate`.
+    """
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+        attributes = sorted(predicate.attributes())
+        slots = dict((name, index) for index, name in enumerate(attributes))
+        self.attributes = attributes
+        self._evaluator = predicate.compile(slots)
+        self._getters = [getter(name) for name in attributes]
+        self._values = {}
+        self.rows_evaluated = 0
+        self.seconds = 0.0
+        self.last_rows = 0
+        self.last_seconds = 0.0
+
+    def evaluate(self, rows):
+        """Return a list of visibility flags, one for each of `rows`,
+        a sequence of `(identity, instance)` pairs."""
+        start = time.time()
+        evaluator = self._evaluator
+        getters = self._getters
+        cache = self._values
+        flags = []
+        append = flags.append
+        for identity, instance in rows:
+            if instance is None:
+                append(False)
+                continue
+            values = cache.get(identity)
+            if values is None:
+                values = cache[identity] = tuple(
+                    [get(instance) for get in getters])
+            append(bool(evaluator(values)))
+        self.last_rows = len(flags)
+        self.last_seconds = time.time() - start
+        self.rows_evaluated += self.last_rows
+        self.seconds += self.last_seconds
+        return flags
+
+    def invalidate(self, identities=None):
+        """Forget the cached values of the rows with `identities`, or
+        of all rows."""
+        if identities is None:
+            self._values.clear()
+        else:
+            values = self._values
+            for identity in identities:
+                values.pop(identity, None)
+
+    def stats(self):
+        """Return the evaluation timings as a dictionary."""
+        return dict(
+            rows_evaluated=self.rows_evaluated,
+            seconds=self.seconds,
+            last_rows=self.last_rows,
+            last_seconds=self.last_seconds,
+            )
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,131 @@
+"""Idle-time prefetching of extent rows for entity grids."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from itertools import islice
+import time
+
+from schevogtk2.cache import LRUCache
+from schevogtk2.idle import IdleTask
+
+
+def _model_size(value):
+    model, row_map = value
+    return len(row_map)
+
+
+class ExtentPrefetcher(object):
+    """Build `EntityGrid` models, during main loop idle time, for the
+    extents the user is likely to view next.
+
+    - `grid`: The `EntityGrid` that will display the prefetched rows.
+
+    - `max_rows`: Memory budget; the total number of rows held across
+      all prefetched models.
+
+    - `slice_ms`: CPU budget; milliseconds of work done per idle slice.
+
+    - `max_seconds`: CPU budget; total seconds of work done after each
+      call to `schedule`.
+
+    - `frequent`: Number of most frequently visited extents to
+      prefetch in addition to the adjacent ones.
+    """
+
+    # Number of rows prefetched between checks of the time budget.
+    chunk_size = 50
+
+    def __init__(self, grid, max_rows=50000, slice_ms=10, max_seconds=2.0,
+                 frequent=2):
+        self.grid = grid
+        self.max_rows = max_rows
+        self.slice_ms = slice_ms
+        self.max_seconds = max_seconds
+        self.frequent = frequent
+        self._models = LRUCache(max_rows, sizeof=_model_size)
+        self._task = None
+        self._visits = {}
+
+    def cancel(self):
+        """Stop any prefetching in progress."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def clear(self):
+        """Discard all prefetched models.
+
+        Call this whenever the database changes, since prefetched rows
+        would no longer reflect its contents."""
+        self.cancel()
+        self._models.clear()
+
+    def frequent_extents(self, exclude=()):
+        """Return the most frequently visited extents of this session,
+        skipping those in `exclude`."""
+        visits = [(count, extent) for extent, count in self._visits.iteritems()
+                  if extent not in exclude]
+        visits.sort(reverse=True)
+        return [extent for count, extent in visits[:self.frequent]]
+
+    def schedule(self, extent, adjacent):
+        """Record a visit to `extent`, then prefetch the `adjacent`
+        extents and the most frequently visited ones."""
+        self.cancel()
+        self._visits[extent] = self._visits.get(extent, 0) + 1
+        candidates = []
+        for other in list(adjacent) + self.frequent_extents([extent]):
+            if other != extent and other not in candidates:
+                candidates.append(other)
+        if candidates:
+            self._task = IdleTask(self._prefetch(candidates), self.slice_ms)
+            self._task.start()
+
+    def take(self, extent):
+        """Return and forget the `(model, row_map)` pair prefetched for
+        `extent`, or None if there is none."""
+        return self._models.pop(extent.name)
+
+    def _prefetch(self, extents):
+        grid = self.grid
+        identify = grid.identify
+        row_styles = grid.row_styles
+        models = self._models
+        compact = grid.compact_rows
+        model_row = grid.model_row
+        spent = 0.0
+        for extent in extents:
+            if (extent.name in models
+                or len(extent) > self.max_rows
+                or grid._filter is not None
+                ):
+                continue
+            model = grid.new_model(compact)
+            append = model.append
+            row_map = {}
+            instances = iter(extent)
+            mark = time.time()
+            while True:
+                chunk = list(islice(instances, self.chunk_size))
+                if not chunk:
+                    break
+                styles = row_styles(chunk)
+                for instance, (color, strikethrough) in zip(chunk, styles):
+                    row_map[identify(instance)] = append(
+                        model_row(instance, color, strikethrough, compact))
+                spent += time.time() - mark
+                if spent > self.max_seconds:
+                    # Out of budget; drop the partial model.
+                    self._task = None
+                    return
+                yield
+                mark = time.time()
+            models[extent.name] = (model, row_map)
+        self._task = None
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -0,0 +1,243 @@
+"""Cache of query results."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from schevo import base
+from schevo.error import EntityDoesNotExist
+from schevo.query import Exact, Intersection, Links, Match, Union
+
+from schevogtk2.cache import LRUCache
+
+
+class Uncacheable(Exception):
+    """The results of a query cannot be cached."""
+
+
+class QueryCache(object):
+    """Results of queries on `db`, by query class and criteria.
+
+    Only queries whose results depend on nothing but their criteria and
+    the entities of known extents are cached: `Exact`, `Match` on
+    stored fields, `Links`, and intersections and unions of those.
+    Other queries are always run.  Only results made of entities are
+    kept, as the extent names and oids of the entities, holding at
+    most `max_results` results in all.
+
+    An entry is used only while the extents the query depends on are
+    unchanged.  Each extent has a change marker: the number of times
+    `reflect_changes` saw a transaction touch it, and its length.
+    Changes made by transactions not given to `reflect_changes` are
+    only noticed when they change the length of an extent.
+    """
+
+    def __init__(self, db, max_results=100000):
+        self.db = db
+        self.hits = 0
+        self.misses = 0
+        self._changes = {}
+        self._dependents = {}
+        self._entries = LRUCache(max_results, sizeof=_entry_size,
+                                 evict_cb=self._forget)
+
+    def clear(self):
+        self._entries.clear()
+        self._dependents.clear()
+
+    def invalidate(self, extent_name):
+        """Discard the results of queries that depend on the extent
+        named `extent_name`."""
+        self._changes[extent_name] = self._changes.get(extent_name, 0) + 1
+        for key in list(self._dependents.get(extent_name, ())):
+            self._discard(key)
+
+    def reflect_changes(self, tx):
+        """Discard the results of queries that depend on extents that
+        the executed transaction `tx` changed."""
+        summary = tx.s.summarize()
+        names = set()
+        for changes in (summary.creates, summary.deletes, summary.updates):
+            names.update(name for name, oids in changes.iteritems() if oids)
+        for name in names:
+            self.invalidate(name)
+
+    def iter_results(self, query):
+        """Yield the results of calling `query`, from the cache if they
+        are still valid, or as the query produces them.  The results
+        are cached only once all of them have been produced, so a query
+        that is not iterated to the end is run again next time."""
+        try:
+            key = query_key(query)
+            extent_names = query_extents(query)
+        except Uncacheable:
+            for result in query():
+                yield result
+            return
+        entries = self._entries
+        entry = entries.get(key)
+        if entry is not None:
+            markers, refs = entry
+            if markers == self._markers(extent_names):
+                try:
+                    results = self._resolve(refs)
+                except EntityDoesNotExist:
+                    pass
+                else:
+                    self.hits += 1
+                    for result in results:
+                        yield result
+                    return
+            self._discard(key)
+        self.misses += 1
+        markers = self._markers(extent_names)
+        refs = []
+        for result in query():
+            if refs is not None:
+                if isinstance(result, base.Entity):
+                    refs.append((result._extent.name, result._oid))
+                else:
+                    # Only entities can be found again by oid.
+                    refs = None
+            yield result
+        if refs is None:
+            return
+        entries[key] = (markers, refs)
+        if key in entries:
+            dependents = self._dependents
+            for name in extent_names:
+                dependents.setdefault(name, set()).add(key)
+
+    def results(self, query):
+        """Return the list of results of calling `query`, from the
+        cache if they are still valid."""
+        return list(self.iter_results(query))
+
+    def stats(self):
+        """Return a dictionary of cache statistics."""
+        return dict(
+            entries=len(self._entries),
+            hits=self.hits,
+            misses=self.misses,
+            results=self._entries.size,
+            )
+
+    def _discard(self, key):
+        entry = self._entries.pop(key)
+        if entry is not None:
+            self._forget(key, entry)
+
+    def _forget(self, key, entry):
+        """Stop tracking the extents of the discarded entry `entry`."""
+        dependents = self._dependents
+        markers, refs = entry
+        for name, changes, length in markers:
+            keys = dependents.get(name)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del dependents[name]
+
+    def _markers(self, extent_names):
+        changes = self._changes
+        extent = self.db.extent
+        return tuple((name, changes.get(name, 0), len(extent(name)))
+                     for name in extent_names)
+
+    def _resolve(self, refs):
+        extent = self.db.extent
+        return [extent(name)[oid] for name, oid in refs]
+
+
+def query_extents(query):
+    """Return the sorted tuple of names of extents that the results of
+    `query` depend on.  Raise `Uncacheable` if they are not known."""
+    names = set()
+    _add_extents(query, names)
+    return tuple(sorted(names))
+
+
+def query_key(query):
+    """Return a hashable key for the class and criteria of `query`.
+    Raise `Uncacheable` if it has none."""
+    if isinstance(query, Exact):
+        criteria = tuple(sorted(
+            (name, _value_key(value))
+            for name, value in query._criteria.iteritems()))
+        return (query.__class__, query._on.name, criteria)
+    elif isinstance(query, Match):
+        if _calculated(query.FieldClass):
+            # May depend on any extent.
+            raise Uncacheable(query)
+        return (query.__class__, _on_key(query.on), query.field_name,
+                query.operator.name, _value_key(query.value))
+    elif isinstance(query, Links):
+        entity = query._entity
+        return (query.__class__, entity._extent.name, entity._oid,
+                query._other_extent, query._other_field_name)
+    elif isinstance(query, (Intersection, Union)):
+        return (query.__class__,
+                tuple(query_key(subquery) for subquery in query.queries))
+    raise Uncacheable(query)
+
+
+def _add_extents(query, names):
+    if isinstance(query, Exact):
+        names.add(query._on.name)
+    elif isinstance(query, Match):
+        on = query.on
+        if isinstance(on, base.Extent):
+            names.add(on.name)
+        else:
+            _add_extents(on, names)
+        if isinstance(query.value, base.Query):
+            _add_extents(query.value, names)
+    elif isinstance(query, Links):
+        names.add(query._other_extent)
+    elif isinstance(query, (Intersection, Union)):
+        for subquery in query.queries:
+            _add_extents(subquery, names)
+    else:
+        raise Uncacheable(query)
+
+
+def _calculated(FieldClass):
+    """Return True if the field matched by a `Match` query, whose
+    `FieldClass` replaces the field's `fget`, is calculated."""
+    for cls in FieldClass.__mro__[1:]:
+        if 'fget' in cls.__dict__:
+            return bool(cls.__dict__['fget'])
+    return False
+
+
+def _entry_size(entry):
+    markers, refs = entry
+    # Count empty results too, so that any number of them is bounded.
+    return max(len(refs), 1)
+
+
+def _on_key(on):
+    if isinstance(on, base.Extent):
+        return on.name
+    elif isinstance(on, base.Query):
+        return query_key(on)
+    raise Uncacheable(on)
+
+
+def _value_key(value):
+    if isinstance(value, base.Entity):
+        return (value._extent.name, value._oid)
+    elif isinstance(value, base.Query):
+        return query_key(value)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(_value_key(item) for item in value))
+    try:
+        hash(value)
+    except TypeError:
+        raise Uncacheable(value)
+    return value
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
@@ -11,6 +11,7 @@ from schevo.label import label, plural
 from schevogtk2 import action
 from schevogtk2 import grid
 from schevogtk2 import icon
+from schevogtk2.predicate import Eq
 from schevogtk2.utils import gsignal, type_register
 
 import gtk
@@ -58,9 +59,7 @@ class RelatedGrid(grid.Grid):
     def __init__(self):
         grid.Grid.__init__(self)
         self._show_hidden_extents = False
-        self._filter = self._model.filter_new()
-        self._filter.set_visible_func(self._is_visible)
-        self._sorter = gtk.TreeModelSort(self._filter)
+        self.set_filter(self._hidden_filter())
         self._row_popup_menu = PopupMenu(self)
         self._set_bindings()
         columns = []
@@ -99,21 +98,15 @@ class RelatedGrid(grid.Grid):
 
     def _set_show_hidden_extents(self, value):
         self._show_hidden_extents = value
-        self._filter.refilter()
+        self.set_filter(self._hidden_filter())
 
     show_hidden_extents = property(fget=_get_show_hidden_extents,
                                    fset=_set_show_hidden_extents)
 
-    def _is_visible(self, model, row):
-        related = model[row][0]
-        if related is None:
-            # XXX Find out why this is happening.
-            return False
-        extent = related.extent
-        visible = True
-        if extent.hidden and not self._show_hidden_extents:
-            visible = False
-        return visible
+    def _hidden_filter(self):
+        if self._show_hidden_extents:
+            return None
+        return Eq('extent.hidden', False)
 
     def _set_bindings(self):
         items = [
@@ -6,11 +6,13 @@
 import os
 import sys
 import thread
+import time
 
 ## import louie
 
+# The GTK stack is imported by Navigator.main, so that its import time
+# is included in the startup timing.
 if sys.platform == 'win32' or os.environ.get('DISPLAY', '') != '':
-    from schevogtk2.application import Application
     GTK_AVAILABLE = True
 else:
     GTK_AVAILABLE = False
@@ -32,6 +34,24 @@ def _parser():
                  help='Open a PyCrust session in a separate thread.',
                  action='store_true', default=False,
                  )
+    p.add_option('-f', '--fast-start', dest='fast_start',
+                 help='Show the navigator immediately and open DBFILE '
+                 'in the background.',
+                 action='store_true', default=False,
+                 )
+    p.add_option('-w', '--watchdog', dest='watchdog', metavar='MS',
+                 help='Log main loop stalls longer than MS milliseconds.',
+                 type='int', default=None,
+                 )
+    p.add_option('--watchdog-log', dest='watchdog_log', metavar='FILE',
+                 help='Log main loop stalls to FILE instead of '
+                 'gnav-stalls.log.',
+                 default=None,
+                 )
+    p.add_option('--startup-timing', dest='startup_timing',
+                 help='Print the time taken by each startup phase.',
+                 action='store_true', default=False,
+                 )
     return p
 
 
@@ -51,6 +71,28 @@ def start_pycrust(**locals):
     thread.start_new_thread(app.MainLoop, ())
 
 
+class StartupTimer(object):
+    """Record the time taken by each phase of startup."""
+
+    def __init__(self):
+        self.phases = []
+        self._start = self._last = time.time()
+
+    def mark(self, phase):
+        """Record the end of `phase`, which began at the previous
+        mark."""
+        now = time.time()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        print 'Startup timing:'
+        for phase, seconds in self.phases:
+            print '  %-32s %8.1f ms' % (phase, seconds * 1000.0)
+        total = self._last - self._start
+        print '  %-32s %8.1f ms' % ('Total', total * 1000.0)
+
+
 class Navigator(Command):
 
     name = 'Database Navigator'
@@ -69,12 +111,37 @@ class Navigator(Command):
                     return 1
             else:
                 db_filename = None
+            timer = StartupTimer()
+            def report_timing(phase):
+                timer.mark(phase)
+                if options.startup_timing:
+                    timer.report()
             # Create PyGTK application.
-            app = Application()
+            import gobject
+            from schevogtk2.application import Application
+            from schevogtk2.worker import threads_init
+            timer.mark('Import GTK, kiwi and gazpacho')
+            threads_init()
+            app = Application(watchdog_ms=options.watchdog,
+                              watchdog_log=options.watchdog_log)
+            if app.watchdog is not None:
+                print 'Logging main loop stalls to', app.watchdog.log_filename
+            timer.mark('Create navigator window')
             # Open the database.
-            if db_filename:
-                print 'Opened database', db_filename
-                app.database_open(db_filename)
+            if db_filename and options.fast_start:
+                app.window.show()
+                timer.mark('Show navigator window')
+                def opened(db):
+                    if db is not None:
+                        print 'Opened database', db_filename
+                    report_timing('Open database in background')
+                app.database_open_async(db_filename, opened)
+            else:
+                if db_filename:
+                    print 'Opened database', db_filename
+                    app.database_open(db_filename)
+                    timer.mark('Open database')
+                gobject.idle_add(report_timing, 'Start main loop')
             # Start PyCrust if requested.
             if options.pycrust:
                 start_pycrust(app=app)
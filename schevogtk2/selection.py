@@ -0,0 +1,206 @@
+"""Lazy selections of grid rows."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+from schevo.error import EntityDoesNotExist
+from schevo.introspect import commontype
+
+from schevogtk2.grid import OBJECT_COLUMN
+
+
+class GridSelection(object):
+    """The selected rows of a grid in multiple selection mode.
+
+    Unlike a list of the selected instances, nothing is built up front.
+    The count comes from GTK.  Membership is tested by finding the
+    instance's row in the view, and instances are resolved only while
+    iterating.  The selected paths and identities are cached until the
+    selection changes.
+
+    The selection is live: it always reflects the grid's current
+    selection.  Use `list(selection)` to keep a snapshot.
+
+    The number of selected instances of each type is tracked as rows
+    are selected and unselected, once `common_type` has been asked for
+    on a grid whose rows are of several types.  Changes that GTK makes
+    without consulting the select function, such as `select_all`,
+    `unselect_all` and `select_range`, discard the counts, and they
+    are counted again when next needed.
+    """
+
+    def __init__(self, grid):
+        self.grid = grid
+        self._identities = None
+        self._paths = None
+        self._tree_selection = grid._view.get_selection()
+        self._type_counts = None
+        self._type_samples = None
+        self._tracking = False
+        # True once the select function has seen the change that the
+        # next call to `changed` reports.
+        self._seen = False
+
+    def __contains__(self, instance):
+        if instance is None:
+            return False
+        try:
+            identity = self.grid.identify(instance)
+        except (AttributeError, EntityDoesNotExist):
+            return False
+        return self.contains_identity(identity)
+
+    def __getitem__(self, index):
+        paths = self.paths()
+        if isinstance(index, slice):
+            return [self._instance(path) for path in paths[index]]
+        return self._instance(paths[index])
+
+    def __iter__(self):
+        instance = self._instance
+        for path in self.paths():
+            yield instance(path)
+
+    def __len__(self):
+        return self._tree_selection.count_selected_rows()
+
+    def __nonzero__(self):
+        return self._tree_selection.count_selected_rows() > 0
+
+    def __repr__(self):
+        return '<GridSelection of %i rows>' % len(self)
+
+    def changed(self):
+        """Discard cached paths and identities.  Called by the grid
+        when its selection changes."""
+        self._identities = None
+        self._paths = None
+        if not self._seen:
+            # Changed without the select function.
+            self._type_counts = None
+            self._type_samples = None
+        self._seen = False
+
+    def common_type(self):
+        """Return the common type of the selected instances, as
+        `schevo.introspect.commontype` does for a list of them, or None
+        if nothing is selected."""
+        if not len(self):
+            return None
+        row_types = self.grid.row_types()
+        if row_types is not None and len(row_types) == 1:
+            # All rows are of the same type.
+            for row_type in row_types:
+                return row_type
+        counts = self._type_counts
+        if counts is None or sum(counts.itervalues()) != len(self):
+            # Not tracked yet, or out of step.
+            self._count_types()
+        return commontype(self._type_samples.values())
+
+    def contains_identity(self, identity):
+        """Return True if the row of the instance with `identity` is
+        selected."""
+        identities = self._identities
+        if identities is not None:
+            return identity in identities
+        path = self.grid.view_path(identity)
+        return path is not None and self._tree_selection.path_is_selected(path)
+
+    def first(self):
+        """Return the first selected instance, or None."""
+        paths = self.paths()
+        if paths:
+            return self._instance(paths[0])
+        return None
+
+    def identities(self):
+        """Return the set of identities of the selected instances."""
+        identities = self._identities
+        if identities is None:
+            grid = self.grid
+            model = grid._view.get_model()
+            get_iter = model.get_iter
+            get_value = model.get_value
+            identify = grid.identify
+            compact = grid._compact
+            identities = set()
+            add = identities.add
+            for path in self.paths():
+                value = get_value(get_iter(path), OBJECT_COLUMN)
+                if compact:
+                    add(value)
+                else:
+                    add(identify(value))
+            self._identities = identities
+        return identities
+
+    def paths(self):
+        """Return the list of selected paths in the grid's view."""
+        paths = self._paths
+        if paths is None:
+            model, paths = self._tree_selection.get_selected_rows()
+            self._paths = paths
+        return paths
+
+    def rows_changed(self):
+        """Discard cached state after rows were removed or replaced,
+        which changes the selection without calling the select
+        function."""
+        self.changed()
+        self._type_counts = None
+        self._type_samples = None
+
+    def _count_types(self):
+        counts = {}
+        samples = {}
+        for instance in self:
+            instance_type = instance.__class__
+            counts[instance_type] = counts.get(instance_type, 0) + 1
+            if instance_type not in samples:
+                samples[instance_type] = instance
+        self._type_counts = counts
+        self._type_samples = samples
+        if not self._tracking:
+            self._tree_selection.set_select_function(
+                self._select_function, full=True)
+            self._tracking = True
+
+    def _instance(self, path):
+        model = self.grid._view.get_model()
+        return self.grid.row_instance(model, model.get_iter(path))
+
+    def _select_function(self, tree_selection, model, path, selected):
+        """Update the counts of selected instances by type before the
+        row at `path` is selected or, if `selected`, unselected."""
+        counts = self._type_counts
+        if counts is None:
+            return True
+        self._seen = True
+        try:
+            instance = self.grid.row_instance(model, model.get_iter(path))
+        except EntityDoesNotExist:
+            self._type_counts = None
+            return True
+        instance_type = instance.__class__
+        if selected:
+            count = counts.get(instance_type, 0) - 1
+            if count > 0:
+                counts[instance_type] = count
+            elif count == 0:
+                del counts[instance_type]
+                del self._type_samples[instance_type]
+            else:
+                # Out of step; count again when next needed.
+                self._type_counts = None
+        else:
+            counts[instance_type] = counts.get(instance_type, 0) + 1
+            if instance_type not in self._type_samples:
+                self._type_samples[instance_type] = instance
+        return True
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
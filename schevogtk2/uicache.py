@@ -0,0 +1,46 @@
+"""Glade UI definitions cached in memory.
+
+The contents of each glade file are read once per process and kept in
+memory, so that creating another window from the same glade file does
+not read it from disk again.  A cached definition is reused only while
+the glade file's modification time matches the one it was read with.
+
+The gazpacho loader still parses the definition each time a window is
+created, since the widgets it builds cannot be shared between windows.
+"""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import os
+
+
+# `(mtime, data)` by glade file path.
+_definitions = {}
+
+
+def clear():
+    """Forget all definitions held in memory."""
+    _definitions.clear()
+
+
+def load(path):
+    """Return the contents of the glade file at `path`, reading it only
+    if it is not cached or has changed since it was read."""
+    mtime = os.stat(path).st_mtime
+    cached = _definitions.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    f = open(path, 'rb')
+    try:
+        data = f.read()
+    finally:
+        f.close()
+    _definitions[path] = (mtime, data)
+    return data
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
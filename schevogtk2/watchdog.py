@@ -0,0 +1,163 @@
+"""Detection and reporting of main loop stalls."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import logging
+from logging.handlers import RotatingFileHandler
+import thread
+import threading
+import time
+import traceback
+
+import gobject
+
+from schevogtk2.worker import threads_init
+
+
+DEFAULT_LOG_FILENAME = 'gnav-stalls.log'
+
+
+class MainLoopWatchdog(object):
+    """Report stalls of the GTK main loop.
+
+    A heartbeat is scheduled on the main loop, and a background thread
+    checks that it keeps beating.  When no heartbeat has been seen for
+    more than `threshold_ms` milliseconds, the main thread's Python
+    stack is captured and written to a rotating log file along with
+    the current activity.  When the main loop recovers, the total
+    duration of the stall is written as well.
+
+    - `threshold_ms`: Milliseconds without a heartbeat before a stall
+      is reported.
+
+    - `log_filename`: Name of the log file to write stall reports to.
+
+    - `activity`: Callable that returns a dictionary describing what
+      the user is doing, such as the active grid, extent or form.  It
+      is called from the background thread while the main loop is
+      stalled, so it must not call GTK.
+
+    - `max_bytes`, `backup_count`: Size of each log file, and number
+      of old log files to keep.
+    """
+
+    def __init__(self, threshold_ms=500, log_filename=None, activity=None,
+                 max_bytes=1024 * 1024, backup_count=3):
+        if log_filename is None:
+            log_filename = DEFAULT_LOG_FILENAME
+        self.threshold_ms = threshold_ms
+        self.log_filename = log_filename
+        self.activity = activity
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.stalls = 0
+        self._last_beat = None
+        self._logger = None
+        self._main_ident = None
+        self._source_id = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Start watching the main loop.  Call this from the main
+        thread."""
+        if self._thread is not None:
+            return self
+        threads_init()
+        self._logger = self._create_logger()
+        self._main_ident = thread.get_ident()
+        self._last_beat = time.time()
+        # Beat several times per threshold, so that a stall is
+        # detected soon after it passes the threshold.
+        interval = max(self.threshold_ms // 4, 10)
+        self._source_id = gobject.timeout_add(interval, self._on_heartbeat)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch,
+                                        name='MainLoopWatchdog')
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching the main loop."""
+        if self._thread is None:
+            return
+        gobject.source_remove(self._source_id)
+        self._source_id = None
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        for handler in self._logger.handlers[:]:
+            handler.close()
+            self._logger.removeHandler(handler)
+        self._logger = None
+
+    def _create_logger(self):
+        logger = logging.getLogger('schevogtk2.watchdog.%i' % id(self))
+        logger.propagate = False
+        logger.setLevel(logging.WARNING)
+        handler = RotatingFileHandler(
+            self.log_filename, maxBytes=self.max_bytes,
+            backupCount=self.backup_count)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        return logger
+
+    def _describe_activity(self):
+        if self.activity is None:
+            return ''
+        try:
+            activity = self.activity()
+        except Exception, e:
+            return '  (activity unavailable: %s)\n' % e
+        lines = ['  %s: %s\n' % (key, activity[key])
+                 for key in sorted(activity)
+                 if activity[key] is not None]
+        return ''.join(lines)
+
+    def _on_heartbeat(self):
+        self._last_beat = time.time()
+        return True
+
+    def _report_stall(self, stalled_ms):
+        frame = sys._current_frames().get(self._main_ident)
+        if frame is None:
+            stack = '  (main thread stack unavailable)\n'
+        else:
+            stack = ''.join(traceback.format_stack(frame))
+        self._logger.warning(
+            'Main loop stalled for %i ms\nActivity:\n%sMain thread stack:\n%s',
+            stalled_ms, self._describe_activity(), stack)
+
+    def _watch(self):
+        threshold = self.threshold_ms / 1000.0
+        interval = threshold / 4.0
+        stall_beat = None
+        while not self._stopped.isSet():
+            self._stopped.wait(interval)
+            last_beat = self._last_beat
+            stalled = time.time() - last_beat
+            if stall_beat is None:
+                if stalled > threshold:
+                    # Newly stalled; capture the stack while the main
+                    # thread is still stuck.
+                    stall_beat = last_beat
+                    self.stalls += 1
+                    self._report_stall(stalled * 1000)
+            elif last_beat != stall_beat:
+                # Recovered.
+                duration = (last_beat - stall_beat) * 1000
+                self._logger.warning(
+                    'Main loop recovered after a stall of %i ms', duration)
+                stall_beat = None
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.
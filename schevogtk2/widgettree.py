@@ -9,6 +9,7 @@ from schevo.lib import optimize
 import os
 
 from schevogtk2 import gazpacholoader
+from schevogtk2 import uicache
 
 from gazpacho.loader.loader import ObjectBuilder
 ## from kiwi.ui import dialogs
@@ -17,12 +18,25 @@ from kiwi.ui.views import GladeSignalBroker
 ## from kiwi.ui.gazpacholoader import GazpachoWidgetTree as WidgetTree
 
 
+# Resolved glade file paths by glade file name.
+_gladefile_paths = {}
+
+
 class Builder(ObjectBuilder):
 
     def find_resource(self, filename):
         return environ.find_resource("pixmaps",  filename)
 
 
+def find_gladefile(filename):
+    """Return the path to the glade resource `filename`."""
+    path = _gladefile_paths.get(filename)
+    if path is None:
+        path = _gladefile_paths[filename] = environ.find_resource(
+            "glade", filename)
+    return path
+
+
 class WidgetTree:
     """Example class of GladeAdaptor that uses Gazpacho loader to load the
     glade files
@@ -37,12 +51,13 @@ class WidgetTree:
         filename = os.path.splitext(os.path.basename(gladefile))[0]
         self._filename = filename + '.glade'
         self._view = view
-        self._gladefile = environ.find_resource("glade", self._filename)
+        self._gladefile = find_gladefile(self._filename)
         self._widgets = (widgets or view.widgets or [])[:]
         self.gladename = gladename or filename
 ##         self._showwarning = warnings.showwarning
 ##         warnings.showwarning = self._on_load_warning
-        self._tree = Builder(self._gladefile, domain=domain)
+        self._tree = Builder(buffer=uicache.load(self._gladefile),
+                             domain=domain)
 ##         warnings.showwarning = self._showwarning
         if not self._widgets:
             self._widgets = [w.get_data("gazpacho::object-id")
@@ -19,12 +19,11 @@ from schevo.introspect import isselectionmethod
 
 from schevogtk2.cursor import TemporaryCursor
 from schevogtk2 import dialog
-from schevogtk2.error import FriendlyErrorDialog
 from schevogtk2.field import (
     DEFAULT_GET_VALUE_HANDLERS, DEFAULT_SET_FIELD_HANDLERS)
-from schevogtk2 import form
 from schevogtk2 import icon
 from schevogtk2.widgettree import GladeSignalBroker, WidgetTree
+from schevogtk2.worker import run_in_background
 
 
 WATCH = gdk.Cursor(gdk.WATCH)
@@ -38,6 +37,9 @@ class BaseWindow(object):
     set_field_handlers = DEFAULT_SET_FIELD_HANDLERS
 
     def __init__(self):
+        # What the user is doing, for diagnostics such as the main
+        # loop watchdog.  Keys are 'grid', 'extent' and 'form'.
+        self.activity = {}
         self._bindings = {}
         self._db = None
         self.widgets = []
@@ -103,34 +105,44 @@ class BaseWindow(object):
         dialog.destroy()
 
     def _on_action_selected(self, widget, action):
-        self.before_action(action)
-        if action.type == 'relationship':
-            entity = action.instance
-            self.run_relationship_dialog(entity)
-        elif action.type == 'transaction':
-            if not isselectionmethod(action.method):
-                tx = action.method()
-            else:
-                tx = action.method(action.selection)
-            if action.related is not None:
-                # Initialize the related field if the transaction
-                # setup hasn't already done so or set it to readonly.
-                field_name = action.related.field_name
-                if (field_name in tx.f and not tx.f[field_name].readonly and
-                    getattr(tx, field_name) is UNASSIGNED):
-                    setattr(tx, field_name, action.related.entity)
-            self.before_tx(tx, action)
-            tx_result = self.run_tx_dialog(tx, action)
-            if tx.s.executed:
-                reflect_changes = getattr(widget, 'reflect_changes', None)
-                if reflect_changes:
-                    reflect_changes(tx_result, tx)
-            self.reflect_changes(tx_result, tx)
-            self.after_tx(tx, tx_result)
-        elif action.type == 'view':
-            entity = action.instance
-            self.run_view_dialog(entity, action)
-        self.after_action(action)
+        self.activity['form'] = action.label
+        try:
+            self.before_action(action)
+            if action.type == 'bulk':
+                self.run_bulk_dialog(widget, action)
+            elif action.type == 'relationship':
+                entity = action.instance
+                self.run_relationship_dialog(entity)
+            elif action.type == 'transaction':
+                if not isselectionmethod(action.method):
+                    tx = action.method()
+                else:
+                    # The selection may be a live `GridSelection`; pass
+                    # the instances selected now.
+                    tx = action.method(list(action.selection))
+                if action.related is not None:
+                    # Initialize the related field if the transaction
+                    # setup hasn't already done so or set it to
+                    # readonly.
+                    field_name = action.related.field_name
+                    if (field_name in tx.f
+                        and not tx.f[field_name].readonly
+                        and getattr(tx, field_name) is UNASSIGNED):
+                        setattr(tx, field_name, action.related.entity)
+                self.before_tx(tx, action)
+                tx_result = self.run_tx_dialog(tx, action)
+                if tx.s.executed:
+                    reflect_changes = getattr(widget, 'reflect_changes', None)
+                    if reflect_changes:
+                        reflect_changes(tx_result, tx)
+                self.reflect_changes(tx_result, tx)
+                self.after_tx(tx, tx_result)
+            elif action.type == 'view':
+                entity = action.instance
+                self.run_view_dialog(entity, action)
+            self.after_action(action)
+        finally:
+            self.activity['form'] = None
         # XXX Hack due to a bug where this window doesn't become
         # active when one modal dialog leads to another (including the
         # dialog used by FileChooserButton, or an error message).
@@ -160,6 +172,23 @@ class BaseWindow(object):
         self.show()
         gtk.main()
 
+    def run_bulk_dialog(self, widget, action):
+        from schevogtk2 import bulk
+        reflect_changes = getattr(widget, 'reflect_changes', None)
+        def on_chunk(job, entities, tx):
+            # Each chunk is its own transaction.
+            if reflect_changes:
+                reflect_changes(None, tx)
+            self.reflect_changes(None, tx)
+            self.after_tx(tx, None)
+        job = action.method()
+        if not job.configure(self.toplevel, self.get_value_handlers,
+                             self.set_field_handlers):
+            return
+        dialog = bulk.BulkJobDialog(self.toplevel, job, action.label, on_chunk)
+        dialog.run()
+        dialog.destroy()
+
     def run_relationship_dialog(self, entity):
         from schevogtk2 import relationship
         with TemporaryCursor(self):
@@ -168,6 +197,8 @@ class BaseWindow(object):
             dialog = relationship.RelationshipWindow(db, entity)
             dialog.after_tx = self.after_tx
             dialog.before_tx = self.before_tx
+            # Let this window see transactions executed in the dialog.
+            dialog.reflect_changes = self.reflect_changes
             # Be sure to set the get_value and set_field handlers to match
             # this window.
             dialog.get_value_handlers = self.get_value_handlers
@@ -180,6 +211,7 @@ class BaseWindow(object):
         dialog.destroy()
 
     def run_tx_dialog(self, tx, action):
+        from schevogtk2 import form
         with TemporaryCursor(self):
             db = action.db
             parent = self.toplevel
@@ -193,6 +225,7 @@ class BaseWindow(object):
         return tx_result
 
     def run_view_dialog(self, entity, action):
+        from schevogtk2 import form
         with TemporaryCursor(self):
             db = action.db
             parent = self.toplevel
@@ -255,6 +288,11 @@ class Window(BaseWindow):
     def __init__(self):
         BaseWindow.__init__(self)
         self._db_filename = None
+        # Incremented each time a database is opened or closed, so that
+        # a database opened in the background after another was opened
+        # or closed is discarded.
+        self._db_generation = 0
+        self._db_opening = False
 
     def create_backup(self, filename):
         if os.path.isfile(filename):
@@ -276,12 +314,18 @@ class Window(BaseWindow):
 
     def database_close(self):
         """Close an existing database file."""
+        self._db_generation += 1
         if self._db is not None:
             with TemporaryCursor(self):
                 self._db.close()
                 self._db = None
                 self._db_filename = None
                 self.update_ui()
+        elif self._db_opening:
+            # Replace the placeholder of the abandoned open.
+            self._db_opening = False
+            self.status()
+            self.update_ui()
 
     def database_new(self, filename):
         """Create a new database file."""
@@ -300,6 +344,47 @@ class Window(BaseWindow):
                 self._db_filename = filename
                 self.update_ui()
 
+    def database_open_async(self, filename, done_cb=None):
+        """Open a database file in a background thread, showing a
+        placeholder until it is ready.
+
+        `done_cb`, if given, is called from the main loop with the
+        database, or with None if it could not be opened or another
+        database was opened or closed meanwhile."""
+        self.database_close()
+        generation = self._db_generation
+        self._db_opening = True
+        text = u'Opening %s...' % filename
+        self.show_placeholder(text)
+        self.status(text)
+        def opened(db):
+            if generation != self._db_generation:
+                # Superseded; don't replace the current database.
+                db.close()
+                if done_cb is not None:
+                    done_cb(None)
+                return
+            self._db_opening = False
+            self.status()
+            self._db = db
+            self._db_filename = filename
+            self.update_ui()
+            if done_cb is not None:
+                done_cb(db)
+        def failed(exc_type, exc_val, exc_tb):
+            if generation != self._db_generation:
+                if done_cb is not None:
+                    done_cb(None)
+                return
+            self._db_opening = False
+            self.status()
+            self.update_ui()
+            msg = 'Unable to open %s' % filename
+            self.message(msg)
+            if done_cb is not None:
+                done_cb(None)
+        run_in_background(schevo.database.open, (filename, ), opened, failed)
+
     def database_pack(self):
         """Pack the currently open database file."""
         if self._db is not None:
@@ -351,6 +436,10 @@ class Window(BaseWindow):
             mod = mod | gtk.gdk.LOCK_MASK
             self._bindings[(keyval, mod)] = func
 
+    def show_placeholder(self, text):
+        """Show `text` in place of content that is not yet available."""
+        pass
+
     def show_and_loop(self):
         self.show()
         gtk.main()
@@ -0,0 +1,66 @@
+"""Background threads that report back to the GTK main loop."""
+
+# Copyright (c) 2001-2009 ElevenCraft Inc.
+# See LICENSE for details.
+
+import sys
+from schevo.lib import optimize
+
+import threading
+
+import gobject
+
+
+class _State(object):
+    """Module state.
+
+    This is a class instead of globals, because globals won't work
+    because of the binding done by optimize.bind_all.
+    """
+
+    threads_initialized = False
+
+
+def threads_init():
+    """Enable thread support in GObject, if not yet enabled.
+
+    Call this before starting the main loop if any background threads
+    will be used."""
+    if not _State.threads_initialized:
+        gobject.threads_init()
+        _State.threads_initialized = True
+
+
+def call_in_main(func, *args):
+    """Call `func(*args)` from the main loop.  Safe to call from any
+    thread."""
+    def on_idle():
+        func(*args)
+        return False
+    gobject.idle_add(on_idle)
+
+
+def run_in_background(func, args=(), callback=None, errback=None):
+    """Call `func(*args)` in a new daemon thread and return the thread.
+
+    When `func` returns, `callback(result)` is called from the main
+    loop.  If it raises an exception, `errback(exc_type, exc_val,
+    exc_tb)` is called from the main loop instead.
+    """
+    threads_init()
+    def run():
+        try:
+            result = func(*args)
+        except:
+            if errback is not None:
+                call_in_main(errback, *sys.exc_info())
+        else:
+            if callback is not None:
+                call_in_main(callback, result)
+    thread = threading.Thread(target=run)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
+
+
+optimize.bind_all(sys.modules[__name__])  # Last line of module.